@@ -0,0 +1,246 @@
+import sys
+from collections import OrderedDict
+from importlib import import_module
+from importlib.util import find_spec
+from timeit import default_timer
+
+
+class LazyModule(object):
+    """
+    Class to import a module on the first access to one of its attributes, so the import of the modules that use
+    it does not import its backend. Each attribute read is kept, the next reads do not go through the module.
+    """
+
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attribute):
+        #only called for the attributes not read yet
+        if self.__module is None:
+            self.__module = import_module(self.__name)
+        value = getattr(self.__module, attribute)
+        setattr(self, attribute, value)
+        return value
+
+    @property
+    def get_module_name(self):
+        return self.__name
+
+
+def is_module_available(name):
+    """
+    Return whether the module name can be imported, without importing it
+    """
+    if name in sys.modules:
+        return sys.modules[name] is not None
+    try:
+        return find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def is_numpy_array(value):
+    """
+    Return whether value is a NumPy array, without importing NumPy: there are no arrays before it is imported
+    """
+    numpy = sys.modules.get('numpy')
+    return numpy is not None and isinstance(value, numpy.ndarray)
+
+
+def import_path(path):
+    """
+    Return the object of a dotted import path, i.e. 'matcher.matcher_by_text.MatchBySimpleRatio'
+    """
+    module_name, _, name = path.rpartition('.')
+    if not module_name:
+        raise ImportError('%s is not a dotted import path' % path)
+    return getattr(import_module(module_name), name)
+
+
+class BackendRegistry(object):
+    """
+    Class to register classes (match algorithms, geo distance implementors) by name.
+
+    Each class is registered by its dotted import path and the modules of its backend, and it is only imported when
+    its name is used for the first time. A name not registered but with dots is imported as a path, so a
+    configuration can name any class. Registering an existing name replaces its class, i.e. by a faster backend.
+    """
+
+    def __init__(self):
+        self.__paths = OrderedDict()
+        self.__backends = {}
+        self.__classes = {}
+        self.__instances = {}
+
+    def register(self, name, path, backends=()):
+        """
+        Register path (dotted import path or class) as name. backends are the modules the class needs.
+        """
+        self.__paths[name] = path
+        self.__backends[name] = tuple(backends)
+        self.__classes.pop(name, None)
+        self.__instances.pop(name, None)
+
+    @property
+    def get_names(self):
+        return list(self.__paths.keys())
+
+    def __contains__(self, name):
+        return name in self.__paths
+
+    def __getitem__(self, name):
+        """
+        Return the class of name, imported on the first use
+        """
+        cls = self.__classes.get(name)
+        if cls is None:
+            path = self.__paths.get(name, name)
+            if not isinstance(path, str):
+                cls = path
+            elif name in self.__paths:
+                cls = import_path(path)
+            elif '.' in name:
+                try:
+                    cls = import_path(path)
+                except (ImportError, AttributeError):
+                    raise KeyError(name)
+            else:
+                raise KeyError(name)
+            self.__classes[name] = cls
+        return cls
+
+    def create(self, name, *args, **kwargs):
+        return self[name](*args, **kwargs)
+
+    def get_instance(self, name):
+        """
+        Return the instance of name shared by all its users, for classes without state
+        """
+        instance = self.__instances.get(name)
+        if instance is None:
+            instance = self.__instances[name] = self.create(name)
+        return instance
+
+    def get_missing_backends(self, name):
+        """
+        Return the list of backends of name that can not be imported
+        """
+        missing = []
+        for backend in self.__backends.get(name, ()):
+            try:
+                import_module(backend)
+            except ImportError:
+                missing.append(backend)
+        return missing
+
+    def is_available(self, name):
+        return not self.get_missing_backends(name)
+
+
+TEXT_ALGORITHMS = BackendRegistry()
+TEXT_ALGORITHMS.register('simple_ratio', 'matcher.matcher_by_text.MatchBySimpleRatio', ('fuzzywuzzy.fuzz',))
+TEXT_ALGORITHMS.register('partial_ratio', 'matcher.matcher_by_text.MatchByPartialRatio', ('fuzzywuzzy.fuzz',))
+TEXT_ALGORITHMS.register('token_sort_ratio', 'matcher.matcher_by_text.MatchByTokenSortRatio', ('fuzzywuzzy.fuzz',))
+TEXT_ALGORITHMS.register('token_set_ratio', 'matcher.matcher_by_text.MatchByTokenSetRatio', ('fuzzywuzzy.fuzz',))
+TEXT_ALGORITHMS.register('string_score', 'matcher.matcher_by_text.MatchByStringScore')
+TEXT_ALGORITHMS.register('jaro_distance', 'matcher.matcher_by_text.MatchByJaroDistance', ('jellyfish',))
+TEXT_ALGORITHMS.register('levenshtein_distance', 'matcher.matcher_by_text.MatchByLevenshteinDistance',
+                         ('jellyfish',))
+TEXT_ALGORITHMS.register('hamming_distance', 'matcher.matcher_by_text.MatchByHammingDistance', ('jellyfish',))
+#not fitted: every n-gram weights the same. NumPy and SciPy are only needed to fit.
+TEXT_ALGORITHMS.register('tfidf_cosine', 'matcher.matcher_by_tfidf.MatchByTfidfCosine')
+
+#algorithms of a MatcherByText without algorithms
+DEFAULT_TEXT_ALGORITHMS = ('simple_ratio', 'partial_ratio', 'token_sort_ratio', 'token_set_ratio', 'string_score',
+                           'jaro_distance', 'levenshtein_distance', 'hamming_distance')
+
+GEO_DISTANCE_IMPLEMENTORS = BackendRegistry()
+GEO_DISTANCE_IMPLEMENTORS.register('haversine', 'matcher.matcher_by_geo_distance.GeoDistanceByHaversine',
+                                   ('haversine',))
+GEO_DISTANCE_IMPLEMENTORS.register('great_circle', 'matcher.matcher_by_geo_distance.GeoDistanceByGreatCircle',
+                                   ('geopy.distance',))
+GEO_DISTANCE_IMPLEMENTORS.register('vincenty', 'matcher.matcher_by_geo_distance.GeoDistanceByVincenty',
+                                   ('geopy.distance',))
+
+#implementor of a MatcherByGeoDistance without concrete_implementor
+DEFAULT_GEO_DISTANCE_IMPLEMENTOR = 'vincenty'
+
+#pairs timed by get_backends_report
+TEXT_SAMPLE = [(u'Camp Nou', u'Estadi Camp Nou'), (u'Santiago Bernabeu', u'Estadio Santiago Bernabeu'),
+               (u'Hotel NH Rallye', u'Hotel NH Eurobuilding - Madrid'), (u'Plaza Mayor - Madrid', u'Plaza Catalunya')]
+GEO_SAMPLE = [((41.380853, 2.122907), (41.381401, 2.126934)), ((40.451585, -3.690375), (41.386997, 2.168546)),
+              ((40.415832, -3.707285), (40.458948, -3.685961))]
+
+
+class BackendReport(object):
+    """
+    Class to define the availability and speed of a registered name: missing backends, the error of its import or
+    first calls if any, and the calls per second of its comparison over a small sample (None when not available).
+    """
+
+    def __init__(self, kind, name, missing_backends, calls_per_second=None, error=None):
+        self.__kind = kind
+        self.__name = name
+        self.__missing_backends = missing_backends
+        self.__calls_per_second = calls_per_second
+        self.__error = error
+
+    @property
+    def get_kind(self):
+        return self.__kind
+
+    @property
+    def get_name(self):
+        return self.__name
+
+    @property
+    def get_missing_backends(self):
+        return self.__missing_backends
+
+    @property
+    def get_calls_per_second(self):
+        return self.__calls_per_second
+
+    @property
+    def get_error(self):
+        return self.__error
+
+    @property
+    def is_available(self):
+        return not self.__missing_backends and self.__error is None
+
+
+def measure_calls_per_second(function, sample, repeat):
+    """
+    Return the calls per second of function over the pairs of sample, called repeat times
+    """
+    start = default_timer()
+    for _ in range(repeat):
+        for value_a, value_b in sample:
+            function(value_a, value_b)
+    elapsed = default_timer() - start
+    return repeat * len(sample) / elapsed if elapsed > 0 else None
+
+
+def get_backends_report(repeat=100):
+    """
+    Return the BackendReport of each registered text algorithm and geo distance implementor. Measuring imports
+    every available backend.
+    """
+    reports = []
+    for kind, registry, method, sample in (
+            ('text', TEXT_ALGORITHMS, 'compare_two_texts', TEXT_SAMPLE),
+            ('geo', GEO_DISTANCE_IMPLEMENTORS, 'calculate_distance_between_points', GEO_SAMPLE)):
+        for name in registry.get_names:
+            missing_backends = registry.get_missing_backends(name)
+            if missing_backends:
+                reports.append(BackendReport(kind, name, missing_backends))
+                continue
+            try:
+                function = getattr(registry.create(name), method)
+                reports.append(BackendReport(kind, name, [], measure_calls_per_second(function, sample, repeat)))
+            except Exception as e:
+                reports.append(BackendReport(kind, name, [], error='%s: %s' % (e.__class__.__name__, e)))
+
+    return reports
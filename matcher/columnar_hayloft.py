@@ -0,0 +1,103 @@
+from matcher.backends import LazyModule, is_module_available
+from matcher.matcher_exceptions import MatcherException
+
+
+numpy = LazyModule('numpy')
+HAS_NUMPY = is_module_available('numpy')
+
+
+class ColumnarHayloft(object):
+    """
+    Class to define a hayloft stored by columns instead of by rows.
+
+    columns can be a pandas DataFrame, a dict of arrays (or lists) or a NumPy record array. Each configured field of
+    the matcher configuration is read from the column with the same name, without building one object per row.
+
+    geo_fields maps a geo field name to its coordinates: an (N, 2) array of (lat, lng) rows or a tuple with the names
+    of the lat and lng columns, i.e. {'Geopoint': ('lat', 'lng')}.
+
+    The matches of a ColumnarHayloft refer to row positions: get_match_element is the position of the row.
+    """
+
+    def __init__(self, columns, geo_fields=None):
+        self.__columns = columns
+        self.__geo_columns = {}
+        self.__length = None
+
+        if geo_fields:
+            for field, coordinates in geo_fields.items():
+                if isinstance(coordinates, tuple) and len(coordinates) == 2:
+                    self.__geo_columns[field] = self.__stack_coordinates(self.__get_raw_column(coordinates[0]),
+                                                                         self.__get_raw_column(coordinates[1]))
+                else:
+                    self.__geo_columns[field] = coordinates
+
+                self.__check_length(self.__geo_columns[field])
+
+    @property
+    def get_columns(self):
+        return self.__columns
+
+    @property
+    def get_geo_fields(self):
+        return list(self.__geo_columns.keys())
+
+    def __len__(self):
+        if self.__length is None:
+            if hasattr(self.__columns, 'keys') and not hasattr(self.__columns, 'dtype'):
+                #dict of arrays or DataFrame
+                keys = list(self.__columns.keys())
+                self.__length = len(self.__columns[keys[0]]) if keys else 0
+            else:
+                self.__length = len(self.__columns)
+
+        return self.__length
+
+    def __check_length(self, column):
+        if len(column) != len(self):
+            raise MatcherException(1004, msg_to_append='%i rows instead of %i.' % (len(column), len(self)))
+
+    def __get_raw_column(self, field):
+        try:
+            return self.__columns[field]
+        except (KeyError, ValueError, IndexError):
+            raise MatcherException(1000, msg_to_append='%s column not exist.' % field)
+
+    def __stack_coordinates(self, lat_column, lng_column):
+        if HAS_NUMPY:
+            return numpy.column_stack((numpy.asarray(lat_column, dtype=float), numpy.asarray(lng_column, dtype=float)))
+        else:
+            return list(zip(lat_column, lng_column))
+
+    def get_column(self, field):
+        """
+        Return the values of field for all rows, a NumPy array when possible.
+        Geo fields are returned as an (N, 2) array of (lat, lng) rows.
+        """
+        if field in self.__geo_columns:
+            return self.__geo_columns[field]
+
+        column = self.__get_raw_column(field)
+        self.__check_length(column)
+        if HAS_NUMPY and not isinstance(column, (list, tuple)):
+            #pandas Series or NumPy array
+            return numpy.asarray(column)
+
+        return column
+
+    def get_row(self, position):
+        """
+        Return a dict with the configured values of the row in position
+        """
+        row = {}
+        if hasattr(self.__columns, 'dtype') and self.__columns.dtype.names:
+            fields = self.__columns.dtype.names
+        else:
+            fields = list(self.__columns.keys())
+
+        for field in fields:
+            row[field] = self.get_column(field)[position]
+        for field in self.__geo_columns:
+            row[field] = tuple(self.__geo_columns[field][position])
+
+        return row
@@ -0,0 +1,138 @@
+import json
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from matcher.backends import DEFAULT_GEO_DISTANCE_IMPLEMENTOR, GEO_DISTANCE_IMPLEMENTORS, TEXT_ALGORITHMS
+from matcher.matcher import ConfiguredMatcher, MatcherFieldConfiguration
+from matcher.matcher_by_geo_distance import MatcherByGeoDistance, Radius
+from matcher.matcher_by_text import MatcherByText
+from matcher.matcher_exceptions import MatcherException
+
+
+class MatcherConfigurationLoader(object):
+    """
+    Class to build a matcher configuration from a JSON or YAML description:
+
+    threshold: 0.5
+    fields:
+      - {field: Place, type: text, weight: 0.3, mode: 2, algorithms: [simple_ratio, levenshtein_distance]}
+      - field: Geopoint
+        type: geo
+        weight: 0.7
+        implementor: haversine
+        ratio_farther: 0
+        columns: [lat, lng]
+        radiuses:
+          - {from: 0, to: 0.2, max_ratio: 1, min_ratio: 0.8, balanced_by_distance: true}
+          - {from: 0.2, to: 1, max_ratio: 0.8, min_ratio: 0.5}
+
+    Text fields without algorithms use all the default algorithms of MatcherByText. Geo fields are read from the
+    columns [lat, lng] of each record when columns is given, otherwise from the field itself.
+
+    algorithms and implementor are names of the TEXT_ALGORITHMS and GEO_DISTANCE_IMPLEMENTORS registries (backends.py)
+    or dotted import paths of other classes.
+    """
+
+    def __init__(self, description):
+        self.__description = description
+        try:
+            self.__threshold = float(description.get('threshold', 0))
+            self.__matcher_configuration = []
+            self.__geo_columns = {}
+            self.__text_fields = []
+
+            for field_description in description['fields']:
+                self.__matcher_configuration.append(self.__get_field_configuration(field_description))
+
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            raise MatcherException(1003, msg_to_append=': %s' % e)
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Load the description of path, a .json or a .yaml / .yml file
+        """
+        with open(path) as description_file:
+            if path.endswith(('.yaml', '.yml')):
+                if yaml is None:
+                    raise MatcherException(1003, msg_to_append=': PyYAML is needed to read %s' % path)
+                return cls(yaml.safe_load(description_file))
+            else:
+                return cls(json.load(description_file))
+
+    @property
+    def get_description(self):
+        return self.__description
+
+    @property
+    def get_matcher_configuration(self):
+        return self.__matcher_configuration
+
+    @property
+    def get_threshold(self):
+        return self.__threshold
+
+    @property
+    def get_geo_columns(self):
+        return self.__geo_columns
+
+    @property
+    def get_text_fields(self):
+        return self.__text_fields
+
+    def get_configured_matcher(self, check_classes=True):
+        return ConfiguredMatcher(self.__matcher_configuration, self.__threshold, check_classes)
+
+    def __get_field_configuration(self, field_description):
+        field = str(field_description['field'])
+        weight = float(field_description['weight'])
+        field_type = field_description.get('type', 'text')
+
+        if field_type == 'text':
+            algorithms = [TEXT_ALGORITHMS[name]() for name in field_description.get('algorithms', [])]
+            matcher_type = MatcherByText(mode=int(field_description.get('mode', 2)), algorithms=algorithms)
+            self.__text_fields.append(field)
+
+        elif field_type == 'geo':
+            radiuses = [Radius(radius['from'], radius['to'], radius['max_ratio'], radius['min_ratio'],
+                               balanced_by_distance=bool(radius.get('balanced_by_distance', False)))
+                        for radius in field_description['radiuses']]
+            implementor_name = field_description.get('implementor', DEFAULT_GEO_DISTANCE_IMPLEMENTOR)
+            implementor = GEO_DISTANCE_IMPLEMENTORS[implementor_name]()
+            matcher_type = MatcherByGeoDistance(radiuses, implementor,
+                                                ratio_farther=float(field_description.get('ratio_farther', 0)))
+            self.__geo_columns[field] = tuple(field_description.get('columns', ())) or None
+
+        else:
+            raise ValueError('Unknown field type %s' % field_type)
+
+        return MatcherFieldConfiguration(matcher_type, field, weight)
+
+    def get_record(self, row):
+        """
+        Convert a row read from a file (a dict) in an element for the matcher configuration: geo fields become
+        (lat, lng) tuples of floats, text fields become str.
+        """
+        record = dict(row)
+        for field, columns in self.__geo_columns.items():
+            if columns:
+                values = (row.get(columns[0]), row.get(columns[1]))
+            else:
+                values = row.get(field)
+                if isinstance(values, str):
+                    values = values.split(',')
+
+            try:
+                record[field] = (float(values[0]), float(values[1]))
+            except (TypeError, ValueError, IndexError):
+                #no point, the MatcherByGeoDistance returns its ratio_farther
+                record[field] = None
+
+        for field in self.__text_fields:
+            value = row.get(field)
+            record[field] = value if isinstance(value, str) else ('' if value is None else str(value))
+
+        return record
@@ -0,0 +1,109 @@
+"""
+Edit distances with a cutoff: the exact distance when it is not greater than max_distance, max_distance + 1 otherwise.
+
+They give the same distances as jellyfish up to the cutoff and stop as soon as the distance is known to be greater.
+"""
+from operator import ne
+
+from matcher.backends import LazyModule
+
+
+jellyfish = LazyModule('jellyfish')
+
+
+#jellyfish computes the whole matrix about 12 times faster per cell than the band below in the worst case, it is
+#used when the band is not narrow enough to pay off
+BAND_SPEEDUP = 12
+
+#characters compared at once by bounded_hamming_distance between cutoff checks
+HAMMING_BLOCK_SIZE = 256
+
+
+def bounded_levenshtein_distance(string_a, string_b, max_distance):
+    """
+    Levenshtein distance of string_a and string_b if it is not greater than max_distance, max_distance + 1 otherwise.
+
+    Ukkonen's cutoff: only the diagonal band of cells within max_distance of the main diagonal is computed, and the
+    computation stops when a whole row of the band is greater than max_distance.
+    """
+    if string_a == string_b:
+        return 0
+
+    if len(string_a) > len(string_b):
+        string_a, string_b = string_b, string_a
+    if len(string_b) - len(string_a) > max_distance:
+        return max_distance + 1
+
+    #common prefix and suffix do not change the distance
+    start = 0
+    end_a, end_b = len(string_a), len(string_b)
+    while start < end_a and string_a[start] == string_b[start]:
+        start += 1
+    while end_a > start and string_a[end_a - 1] == string_b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+    string_a, string_b = string_a[start:end_a], string_b[start:end_b]
+
+    length_a, length_b = len(string_a), len(string_b)
+    if length_a == 0:
+        return length_b
+
+    outside = max_distance + 1
+    if (2 * max_distance + 1) * BAND_SPEEDUP >= length_b:
+        return min(jellyfish.levenshtein_distance(string_a, string_b), outside)
+
+    previous = [j if j <= max_distance else outside for j in range(length_b + 1)]
+    current = [outside] * (length_b + 1)
+
+    for i in range(1, length_a + 1):
+        char_a = string_a[i - 1]
+        first = max(1, i - max_distance)
+        last = min(length_b, i + max_distance)
+
+        current[first - 1] = i if first == 1 else outside
+        if last == i + max_distance:
+            #the cell of the previous row out of its band
+            previous[last] = outside
+
+        row_min = current[first - 1]
+        for j in range(first, last + 1):
+            cost = previous[j - 1] + (char_a != string_b[j - 1])
+            deletion = previous[j] + 1
+            insertion = current[j - 1] + 1
+            if deletion < cost:
+                cost = deletion
+            if insertion < cost:
+                cost = insertion
+            current[j] = cost
+            if cost < row_min:
+                row_min = cost
+
+        if row_min > max_distance:
+            return outside
+
+        previous, current = current, previous
+
+    return min(previous[length_b], outside)
+
+
+def bounded_hamming_distance(string_a, string_b, max_distance):
+    """
+    Hamming distance of string_a and string_b (as jellyfish, the extra characters of the longer string are
+    differences) if it is not greater than max_distance, max_distance + 1 otherwise.
+    """
+    outside = max_distance + 1
+    distance = abs(len(string_a) - len(string_b))
+    if distance > max_distance:
+        return outside
+
+    length = min(len(string_a), len(string_b))
+    if length <= HAMMING_BLOCK_SIZE:
+        return min(jellyfish.hamming_distance(string_a, string_b), outside)
+
+    for start in range(0, length, HAMMING_BLOCK_SIZE):
+        end = min(start + HAMMING_BLOCK_SIZE, length)
+        distance += sum(map(ne, string_a[start:end], string_b[start:end]))
+        if distance > max_distance:
+            return outside
+
+    return distance
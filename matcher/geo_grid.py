@@ -0,0 +1,92 @@
+from math import asin, cos, degrees, floor, radians, sin
+
+from matcher.matcher_by_geo_distance import get_haversine_earth_radius
+
+
+class GeoGrid(object):
+    """
+    Class to define a lat/lng grid over the whole Earth with cells of about cell_size km.
+
+    Rows have a height of cell_size km of latitude. Each row is divided in columns of at least cell_size km at its
+    latitude nearest to the pole, so cells do not get smaller at high latitudes, and the columns of every row wrap
+    around the antimeridian (lng 180 and lng -180 are the same column border).
+
+    get_cell returns the (row, column) cell of a point and get_cells_within returns every cell which may contain points
+    within a distance of a point, the cells to compare in a spatial join.
+
+    margin enlarges the searched distance (1% by default) to cover the difference between the sphere used by the grid
+    and the ellipsoid of Vincenty distances.
+    """
+
+    def __init__(self, cell_size, margin=0.01):
+        if float(cell_size) <= 0:
+            raise ValueError('cell_size must be greater than 0')
+
+        self.__cell_size = float(cell_size)
+        self.__margin = float(margin)
+        self.__earth_radius = get_haversine_earth_radius()
+        self.__lat_step = degrees(self.__cell_size / self.__earth_radius)
+        self.__rows = max(1, int(floor(180 / self.__lat_step)))
+        self.__lat_step = 180.0 / self.__rows
+        self.__columns = [self.__get_row_columns(row) for row in range(self.__rows)]
+
+    @property
+    def get_cell_size(self):
+        return self.__cell_size
+
+    @property
+    def get_rows(self):
+        return self.__rows
+
+    def __get_row_columns(self, row):
+        """
+        Number of columns of a row: the widest number of cells of at least cell_size km at the latitude of the row
+        nearest to the pole.
+        """
+        south = -90 + row * self.__lat_step
+        north = south + self.__lat_step
+        width = cos(radians(max(abs(south), abs(north)))) * 360
+        return max(1, int(floor(width / self.__lat_step)))
+
+    def __get_row(self, lat):
+        return min(self.__rows - 1, max(0, int(floor((lat + 90) / self.__lat_step))))
+
+    def __get_column(self, row, lng):
+        columns = self.__columns[row]
+        return int(floor(((lng + 180) % 360) / (360.0 / columns))) % columns
+
+    def get_cell(self, point):
+        """
+        Return the (row, column) cell of point, a (lat, lng) tuple
+        """
+        row = self.__get_row(point[0])
+        return row, self.__get_column(row, point[1])
+
+    def get_cells_within(self, point, distance):
+        """
+        Return the list of cells which may contain points within distance km of point, a (lat, lng) tuple
+        """
+        angle = distance * (1 + self.__margin) / self.__earth_radius
+        lat = radians(point[0])
+        north = degrees(lat + angle)
+        south = degrees(lat - angle)
+
+        #max difference of longitude of the points within distance, all longitudes when the circle contains a pole
+        if north >= 90 or south <= -90 or sin(angle) >= cos(lat):
+            delta_lng = None
+        else:
+            delta_lng = degrees(asin(sin(angle) / cos(lat)))
+
+        cells = []
+        for row in range(self.__get_row(south), self.__get_row(north) + 1):
+            columns = self.__columns[row]
+            if delta_lng is None or 2 * delta_lng >= 360 - 360.0 / columns:
+                cells.extend((row, column) for column in range(columns))
+            else:
+                first = self.__get_column(row, point[1] - delta_lng)
+                last = self.__get_column(row, point[1] + delta_lng)
+                #columns wrap around the antimeridian
+                span = (last - first) % columns
+                cells.extend((row, (first + offset) % columns) for offset in range(span + 1))
+
+        return cells
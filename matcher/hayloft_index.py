@@ -0,0 +1,888 @@
+import re
+import zlib
+from heapq import merge
+from math import radians
+from random import Random
+
+from django.db.models.query import QuerySet
+
+from matcher.backends import LazyModule, is_module_available
+from matcher.geo_grid import GeoGrid
+from matcher.matcher_by_geo_distance import get_haversine_earth_radius
+from matcher.matcher_exceptions import MatcherException
+from matcher.queryset_iterator import QuerySetIterator
+from matcher.related_fields import get_field_getter
+
+
+jellyfish = LazyModule('jellyfish')
+numpy = LazyModule('numpy')
+HAS_NUMPY = is_module_available('numpy')
+
+
+def get_field_value(obj, field_str):
+    """
+    Return the value of field_str in obj, a dict or an object. field_str can be a field path (see get_field_getter).
+    """
+    if isinstance(obj, dict):
+        try:
+            return get_field_getter(field_str, True)(obj)
+        except KeyError:
+            raise MatcherException(1000, msg_to_append='%s key not exist.' % field_str)
+
+    else:
+        try:
+            return get_field_getter(field_str, False)(obj)
+        except AttributeError:
+            raise MatcherException(1001, msg_to_append='%s Attribute not exist.' % field_str)
+
+
+#encoder name -> function of jellyfish
+PHONETIC_ENCODERS = {
+    'soundex': 'soundex',
+    'metaphone': 'metaphone',
+    'nysiis': 'nysiis',
+}
+
+
+def get_phonetic_keys(value, encoders, min_token_length=3):
+    """
+    Return the set of (encoder, key) phonetic keys of each word of at least min_token_length characters of value
+    """
+    keys = set()
+    if not value:
+        return keys
+
+    for token in re.findall(r'\w+', value, re.UNICODE):
+        if len(token) >= min_token_length:
+            for encoder in encoders:
+                key = getattr(jellyfish, PHONETIC_ENCODERS[encoder])(token)
+                if key:
+                    keys.add((encoder, key))
+
+    return keys
+
+
+def get_tokens(value):
+    """
+    Return the set of lowercase words of value
+    """
+    if not value:
+        return set()
+    return set(re.findall(r'\w+', value.lower(), re.UNICODE))
+
+
+class IndexStatistics(object):
+    """
+    Class to define the statistics of the candidates of a hayloft index for a needle
+
+    pruning is the fraction of the hayloft skipped (0 nothing skipped, 1 everything skipped)
+    recall is the fraction of the matches of a full scan found through the index, None if it was not measured
+    """
+
+    def __init__(self, hayloft_size, candidates, matches=None, full_scan_matches=None):
+        self.__hayloft_size = hayloft_size
+        self.__candidates = candidates
+        self.__matches = matches
+        self.__full_scan_matches = full_scan_matches
+
+    @property
+    def get_hayloft_size(self):
+        return self.__hayloft_size
+
+    @property
+    def get_candidates(self):
+        return self.__candidates
+
+    @property
+    def get_pruning(self):
+        if not self.__hayloft_size:
+            return 0
+        return 1 - float(self.__candidates) / self.__hayloft_size
+
+    @property
+    def get_recall(self):
+        if self.__full_scan_matches is None:
+            return None
+        elif not self.__full_scan_matches:
+            return 1
+        return float(self.__matches) / self.__full_scan_matches
+
+
+class HayloftIndex(object):
+    """
+    Interface for any hayloft index.
+
+    A hayloft index is built once over the elements of a hayloft and it can be passed as hayloft to
+    ConfiguredMatcher.search_matches (or Matcher.search_matches): only the candidates returned by get_candidates for
+    the needle are scored instead of the whole hayloft.
+    """
+
+    def get_candidates(self, needle, configured_matcher):
+        pass
+
+    def measure_recall(self, needles, configured_matcher):
+        """
+        Search each needle of needles with and without the index and return the IndexStatistics of all of them.
+        It executes a full scan of the hayloft (get_elements) for each needle, so use a sample of needles.
+        """
+        elements = self.get_elements
+        candidates = matches = full_scan_matches = searches = 0
+        for needle in needles:
+            searches += 1
+            candidates += len(self.get_candidates(needle, configured_matcher))
+            matches += len(configured_matcher.search_matches(needle, self).get_matches)
+            full_scan_matches += len(configured_matcher.search_matches(needle, elements).get_matches)
+
+        return IndexStatistics(len(elements) * searches, candidates, matches, full_scan_matches)
+
+
+class LengthBucketedIndex(HayloftIndex):
+    """
+    Class to index the elements of a hayloft in buckets by the length of the text of field.
+
+    field must be configured in the ConfiguredMatcher with a MatcherByText. For each needle, the buckets whose length
+    upper bound (MatcherByText.get_length_upper_bound) can not reach the minimum ratio the field needs to reach the
+    threshold are skipped without comparing any string. Candidates are returned in hayloft order, so the matches are
+    the same as scanning the whole hayloft.
+    """
+
+    def __init__(self, hayloft, field):
+        if not isinstance(field, str):
+            raise TypeError
+
+        self.__field = field
+        self.__elements = []
+        self.__buckets = {}
+        #elements without text are always candidates, as in a full scan
+        self.__unbucketed = []
+
+        if isinstance(hayloft, QuerySet):
+            hayloft = QuerySetIterator(hayloft).queryset_iterator()
+
+        for element in hayloft:
+            self.add_element(element)
+
+    @property
+    def get_field(self):
+        return self.__field
+
+    @property
+    def get_elements(self):
+        return self.__elements
+
+    @property
+    def get_lengths(self):
+        return sorted(self.__buckets.keys())
+
+    def __len__(self):
+        return len(self.__elements)
+
+    def add_element(self, element):
+        position = len(self.__elements)
+        self.__elements.append(element)
+
+        value = get_field_value(element, self.__field)
+        if value:
+            self.__buckets.setdefault(len(value), []).append(position)
+        else:
+            self.__unbucketed.append(position)
+
+    def __get_text_configuration(self, configured_matcher):
+        for config in configured_matcher.get_matcher_configuration:
+            if config.get_field == self.__field and hasattr(config.get_matcher_type, 'get_length_upper_bound'):
+                return config
+
+        raise MatcherException(1003, msg_to_append=' %s is not configured with a MatcherByText.' % self.__field)
+
+    def get_candidate_positions(self, needle, configured_matcher):
+        """
+        Return the sorted hayloft positions of the elements that can reach the threshold for needle
+        """
+        config = self.__get_text_configuration(configured_matcher)
+        needle_value = get_field_value(needle, self.__field)
+
+        if not needle_value:
+            #nothing to prune, the matcher type will decide
+            return list(range(len(self.__elements)))
+
+        min_ratio = configured_matcher.get_min_ratio(config)
+        needle_length = len(needle_value)
+
+        buckets = [self.__unbucketed]
+        for length, positions in self.__buckets.items():
+            upper_bound = config.get_matcher_type.get_length_upper_bound(needle_length, length)
+            if upper_bound is None or upper_bound >= min_ratio:
+                buckets.append(positions)
+
+        return list(merge(*buckets))
+
+    def get_candidates(self, needle, configured_matcher):
+        elements = self.__elements
+        return [elements[position] for position in self.get_candidate_positions(needle, configured_matcher)]
+
+
+class PhoneticIndex(HayloftIndex):
+    """
+    Class to block the elements of a hayloft by phonetic keys of the text of field.
+
+    Each word of the text (of at least min_token_length characters) is encoded with each encoder of encoders
+    ('soundex', 'metaphone' and/or 'nysiis' of jellyfish) into a hash index. For a needle, only the elements sharing at
+    least one key with the needle text are candidates. Blocking is approximate: spelling variants usually share a key,
+    but some matches of a full scan can be lost. measure_recall reports how many.
+    """
+
+    def __init__(self, hayloft, field, encoders=('metaphone',), min_token_length=3):
+        if not isinstance(field, str) or not encoders:
+            raise TypeError
+        for encoder in encoders:
+            if encoder not in PHONETIC_ENCODERS:
+                raise ValueError('Unknown phonetic encoder %s' % encoder)
+
+        self.__field = field
+        self.__encoders = tuple(encoders)
+        self.__min_token_length = min_token_length
+        self.__elements = []
+        self.__keys = {}
+
+        if isinstance(hayloft, QuerySet):
+            hayloft = QuerySetIterator(hayloft).queryset_iterator()
+
+        for element in hayloft:
+            self.add_element(element)
+
+    @property
+    def get_field(self):
+        return self.__field
+
+    @property
+    def get_elements(self):
+        return self.__elements
+
+    @property
+    def get_encoders(self):
+        return self.__encoders
+
+    def __len__(self):
+        return len(self.__elements)
+
+    def get_phonetic_keys(self, value):
+        """
+        Return the set of phonetic keys of a text value
+        """
+        return get_phonetic_keys(value, self.__encoders, self.__min_token_length)
+
+    def add_element(self, element):
+        position = len(self.__elements)
+        self.__elements.append(element)
+
+        for key in self.get_phonetic_keys(get_field_value(element, self.__field)):
+            self.__keys.setdefault(key, []).append(position)
+
+    def get_candidate_positions(self, needle, configured_matcher=None):
+        """
+        Return the sorted hayloft positions of the elements sharing a phonetic key with needle
+        """
+        positions = set()
+        for key in self.get_phonetic_keys(get_field_value(needle, self.__field)):
+            positions.update(self.__keys.get(key, ()))
+
+        return sorted(positions)
+
+    def get_candidates(self, needle, configured_matcher=None):
+        elements = self.__elements
+        return [elements[position] for position in self.get_candidate_positions(needle)]
+
+    def get_statistics(self, needle):
+        """
+        Return the IndexStatistics of the candidates of needle
+        """
+        return IndexStatistics(len(self.__elements), len(self.get_candidate_positions(needle)))
+
+
+class GeoGridIndex(HayloftIndex):
+    """
+    Class to index the elements of a hayloft in the GeoGrid cells of the point of field.
+
+    field must be configured in the ConfiguredMatcher with a MatcherByGeoDistance. Points farther than the greatest
+    radius of the MatcherByGeoDistance (get_max_distance) always get its ratio_farther, so when ratio_farther can not
+    reach the minimum ratio the field needs to reach the threshold, only the elements in the cells within that distance
+    of the needle are candidates. Their exact distances are calculated when they are scored. Candidates are returned
+    in hayloft order, so the matches are the same as scanning the whole hayloft.
+
+    cell_size (km) is usually the get_max_distance of the MatcherByGeoDistance: each needle looks up about 3x3 cells.
+    """
+
+    def __init__(self, hayloft, field, cell_size):
+        if not isinstance(field, str):
+            raise TypeError
+
+        self.__field = field
+        self.__grid = GeoGrid(cell_size)
+        self.__elements = []
+        self.__cells = {}
+        #elements without point always get ratio_farther
+        self.__unindexed = []
+
+        if isinstance(hayloft, QuerySet):
+            hayloft = QuerySetIterator(hayloft).queryset_iterator()
+
+        for element in hayloft:
+            self.add_element(element)
+
+    @property
+    def get_field(self):
+        return self.__field
+
+    @property
+    def get_elements(self):
+        return self.__elements
+
+    @property
+    def get_grid(self):
+        return self.__grid
+
+    def __len__(self):
+        return len(self.__elements)
+
+    @staticmethod
+    def __is_point(value):
+        #the same points MatcherByGeoDistance.get_ratio_match calculates a distance for
+        return isinstance(value, tuple) and len(value) > 0
+
+    def add_element(self, element):
+        position = len(self.__elements)
+        self.__elements.append(element)
+
+        point = get_field_value(element, self.__field)
+        if self.__is_point(point):
+            self.__cells.setdefault(self.__grid.get_cell(point), []).append(position)
+        else:
+            self.__unindexed.append(position)
+
+    def __get_geo_configuration(self, configured_matcher):
+        for config in configured_matcher.get_matcher_configuration:
+            if config.get_field == self.__field and hasattr(config.get_matcher_type, 'get_max_distance'):
+                return config
+
+        raise MatcherException(1003, msg_to_append=' %s is not configured with a MatcherByGeoDistance.' % self.__field)
+
+    def get_candidate_positions(self, needle, configured_matcher):
+        """
+        Return the sorted hayloft positions of the elements that can reach the threshold for needle
+        """
+        config = self.__get_geo_configuration(configured_matcher)
+        matcher_type = config.get_matcher_type
+
+        if matcher_type.get_ratio_farther >= configured_matcher.get_min_ratio(config):
+            #any element can reach the threshold, nothing to prune
+            return list(range(len(self.__elements)))
+
+        point = get_field_value(needle, self.__field)
+        if not self.__is_point(point):
+            #every element gets ratio_farther
+            return []
+
+        cells = self.__cells
+        return list(merge(*[cells[cell] for cell in self.__grid.get_cells_within(point, matcher_type.get_max_distance)
+                            if cell in cells]))
+
+    def get_candidates(self, needle, configured_matcher):
+        elements = self.__elements
+        return [elements[position] for position in self.get_candidate_positions(needle, configured_matcher)]
+
+    def get_statistics(self, needle, configured_matcher):
+        """
+        Return the IndexStatistics of the candidates of needle
+        """
+        return IndexStatistics(len(self.__elements), len(self.get_candidate_positions(needle, configured_matcher)))
+
+
+class BKTreeIndex(HayloftIndex):
+    """
+    Class to index the distinct values of the text of field of a hayloft in a BK-tree (Burkhard-Keller tree) by
+    Levenshtein distance.
+
+    get_values_within returns the values within a Levenshtein distance of a value visiting only the subtrees that can
+    contain them (triangle inequality), usually a small part of the distinct values. Each value maps back to the
+    positions of its hayloft elements and elements can be added at any time, so the index is built once and reused
+    for every needle.
+
+    As hayloft index, field must be configured in the ConfiguredMatcher with a MatcherByText whose ratio is bounded by
+    the Levenshtein distance (MatcherByText.get_max_edit_distance), i.e. only Levenshtein and Hamming algorithms in
+    better case mode. Then only the elements within the distance that can reach the threshold are candidates, in
+    hayloft order, so the matches are the same as scanning the whole hayloft. Otherwise every element is a candidate.
+    """
+
+    def __init__(self, hayloft, field):
+        if not isinstance(field, str):
+            raise TypeError
+
+        self.__field = field
+        self.__elements = []
+        #value -> positions of the elements with that value
+        self.__positions = {}
+        #each node is [value, {distance: child node}]
+        self.__root = None
+        #elements without text are always candidates, as in a full scan
+        self.__unindexed = []
+
+        if isinstance(hayloft, QuerySet):
+            hayloft = QuerySetIterator(hayloft).queryset_iterator()
+
+        for element in hayloft:
+            self.add_element(element)
+
+    @property
+    def get_field(self):
+        return self.__field
+
+    @property
+    def get_elements(self):
+        return self.__elements
+
+    def __len__(self):
+        return len(self.__elements)
+
+    @property
+    def get_values_count(self):
+        return len(self.__positions)
+
+    def __add_value(self, value):
+        if self.__root is None:
+            self.__root = [value, {}]
+            return
+
+        node = self.__root
+        while True:
+            distance = jellyfish.levenshtein_distance(value, node[0])
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = [value, {}]
+                return
+            node = child
+
+    def add_element(self, element):
+        position = len(self.__elements)
+        self.__elements.append(element)
+
+        value = get_field_value(element, self.__field)
+        if not value:
+            self.__unindexed.append(position)
+        elif value in self.__positions:
+            self.__positions[value].append(position)
+        else:
+            self.__positions[value] = [position]
+            self.__add_value(value)
+
+    def get_values_within(self, value, max_distance):
+        """
+        Return the list of (indexed value, Levenshtein distance) of the indexed values within max_distance of value
+        """
+        values = []
+        if self.__root is None:
+            return values
+
+        nodes = [self.__root]
+        while nodes:
+            node_value, children = nodes.pop()
+            distance = jellyfish.levenshtein_distance(value, node_value)
+            if distance <= max_distance:
+                values.append((node_value, distance))
+            #only the children at a distance in [distance - max_distance, distance + max_distance] can be within
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    nodes.append(child)
+
+        return values
+
+    def get_positions_within(self, value, max_distance):
+        """
+        Return the sorted hayloft positions of the elements within max_distance of value
+        """
+        positions = self.__positions
+        return list(merge(*[positions[node_value] for node_value, distance in self.get_values_within(value,
+                                                                                                     max_distance)]))
+
+    def __get_text_configuration(self, configured_matcher):
+        for config in configured_matcher.get_matcher_configuration:
+            if config.get_field == self.__field and hasattr(config.get_matcher_type, 'get_max_edit_distance'):
+                return config
+
+        raise MatcherException(1003, msg_to_append=' %s is not configured with a MatcherByText.' % self.__field)
+
+    def get_candidate_positions(self, needle, configured_matcher):
+        """
+        Return the sorted hayloft positions of the elements that can reach the threshold for needle
+        """
+        config = self.__get_text_configuration(configured_matcher)
+        needle_value = get_field_value(needle, self.__field)
+        max_distance = config.get_matcher_type.get_max_edit_distance(configured_matcher.get_min_ratio(config))
+
+        if not needle_value or max_distance is None:
+            #nothing to prune, the matcher type will decide
+            return list(range(len(self.__elements)))
+
+        return list(merge(self.__unindexed, self.get_positions_within(needle_value, max_distance)))
+
+    def get_candidates(self, needle, configured_matcher):
+        elements = self.__elements
+        return [elements[position] for position in self.get_candidate_positions(needle, configured_matcher)]
+
+    def get_statistics(self, needle, configured_matcher):
+        """
+        Return the IndexStatistics of the candidates of needle
+        """
+        return IndexStatistics(len(self.__elements), len(self.get_candidate_positions(needle, configured_matcher)))
+
+
+#Mersenne prime of the universal hashing of MinHash: a * x + b fits in 64 bits for x, a, b lower than it
+MINHASH_PRIME = (1 << 31) - 1
+
+#signatures passed back to MinHashIndex that ran out
+_MISSING = object()
+
+
+class MinHashIndex(HayloftIndex):
+    """
+    Class to index the token sets (lowercase words) of the text of field of a hayloft with MinHash signatures of
+    num_perm hash functions and LSH (locality sensitive hashing) buckets of bands of rows hash values each.
+
+    Two token sets with Jaccard similarity s share at least one bucket with probability 1 - (1 - s ^ rows) ^ bands,
+    a S-curve whose threshold is about (1 / bands) ^ (1 / rows). Give threshold to choose bands and rows for a target
+    Jaccard similarity (get_optimal_parameters). For a needle, only the elements sharing a bucket with it are
+    candidates, so it is approximate like PhoneticIndex: measure_recall reports the matches lost. Token set ratio is
+    high when a token set contains the other one, so the threshold must be lower than the token set ratio expected.
+
+    Signatures depend only on the tokens, num_perm and seed: get_signatures are lists of ints that can be saved
+    (JSON, pickle) and passed back as signatures with the same hayloft to skip hashing in other runs. A MatcherException
+    is raised when they are not one per element of num_perm values, or the first one is not hashed again the same.
+    """
+
+    def __init__(self, hayloft, field, num_perm=64, bands=None, rows=None, threshold=0.5, seed=1, signatures=None):
+        if not isinstance(field, str):
+            raise TypeError
+        if bands is None or rows is None:
+            bands, rows = self.get_optimal_parameters(threshold, num_perm)
+        if bands * rows > num_perm:
+            raise ValueError('bands * rows must not be greater than num_perm')
+
+        self.__field = field
+        self.__num_perm = num_perm
+        self.__bands = bands
+        self.__rows = rows
+        self.__seed = seed
+        random = Random(seed)
+        self.__a = [random.randint(1, MINHASH_PRIME - 1) for i in range(num_perm)]
+        self.__b = [random.randint(0, MINHASH_PRIME - 1) for i in range(num_perm)]
+        if HAS_NUMPY:
+            self.__a_array = numpy.array(self.__a, dtype=numpy.int64)
+            self.__b_array = numpy.array(self.__b, dtype=numpy.int64)
+
+        self.__elements = []
+        self.__signatures = []
+        self.__buckets = {}
+        #elements without tokens are always candidates, as in a full scan
+        self.__unindexed = []
+
+        if isinstance(hayloft, QuerySet):
+            hayloft = QuerySetIterator(hayloft).queryset_iterator()
+
+        if signatures is None:
+            for element in hayloft:
+                self.add_element(element)
+            return
+
+        signatures = iter(signatures)
+        checked = False
+        for element in hayloft:
+            signature = next(signatures, _MISSING)
+            if signature is _MISSING:
+                raise MatcherException(1003, msg_to_append=': fewer MinHash signatures than hayloft elements')
+            if not checked and signature is not None:
+                #the first signature is hashed again: another num_perm, seed or hayloft give another signature
+                if list(signature) != self.get_signature(get_field_value(element, self.__field)):
+                    raise MatcherException(1003, msg_to_append=': MinHash signatures of another num_perm, seed or '
+                                                               'hayloft')
+                checked = True
+            self.add_element(element, signature)
+
+        if next(signatures, _MISSING) is not _MISSING:
+            raise MatcherException(1003, msg_to_append=': more MinHash signatures than hayloft elements')
+
+    @staticmethod
+    def get_optimal_parameters(threshold, num_perm, false_positive_weight=0.5, false_negative_weight=0.5):
+        """
+        Return the (bands, rows) with bands * rows <= num_perm minimizing the weighted probabilities of false
+        positives (Jaccard lower than threshold) and false negatives (Jaccard greater than threshold)
+        """
+        steps = 100
+
+        def integrate(function, start, end):
+            width = (end - start) / steps
+            return sum(function(start + (i + 0.5) * width) for i in range(steps)) * width
+
+        best = None
+        for bands in range(1, num_perm + 1):
+            for rows in range(1, num_perm // bands + 1):
+                false_positive = integrate(lambda s: 1 - (1 - s ** rows) ** bands, 0.0, threshold)
+                false_negative = integrate(lambda s: (1 - s ** rows) ** bands, threshold, 1.0)
+                error = false_positive_weight * false_positive + false_negative_weight * false_negative
+                if best is None or error < best[0]:
+                    best = (error, bands, rows)
+
+        return best[1], best[2]
+
+    @property
+    def get_field(self):
+        return self.__field
+
+    @property
+    def get_elements(self):
+        return self.__elements
+
+    @property
+    def get_bands(self):
+        return self.__bands
+
+    @property
+    def get_rows(self):
+        return self.__rows
+
+    @property
+    def get_signatures(self):
+        return self.__signatures
+
+    def __len__(self):
+        return len(self.__elements)
+
+    def get_signature(self, value):
+        """
+        Return the MinHash signature (list of num_perm ints) of the token set of value, None if it has no tokens
+        """
+        tokens = get_tokens(value)
+        if not tokens:
+            return None
+
+        hashes = [zlib.crc32(token.encode('utf-8')) % MINHASH_PRIME for token in tokens]
+        if HAS_NUMPY:
+            values = numpy.array(hashes, dtype=numpy.int64).reshape(-1, 1)
+            return ((values * self.__a_array + self.__b_array) % MINHASH_PRIME).min(axis=0).tolist()
+
+        return [min((a * value + b) % MINHASH_PRIME for value in hashes) for a, b in zip(self.__a, self.__b)]
+
+    def __get_band_keys(self, signature):
+        rows = self.__rows
+        return [(band, tuple(signature[band * rows:(band + 1) * rows])) for band in range(self.__bands)]
+
+    def add_element(self, element, signature=None):
+        """
+        Add element to the index. signature is its signature of a previous index with the same num_perm and seed.
+        """
+        if signature is None:
+            signature = self.get_signature(get_field_value(element, self.__field))
+        elif len(signature) != self.__num_perm:
+            raise MatcherException(1003, msg_to_append=': MinHash signature of %i values, num_perm is %i'
+                                                       % (len(signature), self.__num_perm))
+
+        position = len(self.__elements)
+        self.__elements.append(element)
+        self.__signatures.append(signature)
+
+        if signature is None:
+            self.__unindexed.append(position)
+        else:
+            for key in self.__get_band_keys(signature):
+                self.__buckets.setdefault(key, []).append(position)
+
+    def get_estimated_jaccard(self, value_a, value_b):
+        """
+        Return the Jaccard similarity of the token sets of value_a and value_b estimated by their signatures
+        """
+        signature_a, signature_b = self.get_signature(value_a), self.get_signature(value_b)
+        if signature_a is None or signature_b is None:
+            return 0.0
+        return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / float(self.__num_perm)
+
+    def get_candidate_positions(self, needle, configured_matcher=None):
+        """
+        Return the sorted hayloft positions of the elements sharing a LSH bucket with needle
+        """
+        signature = self.get_signature(get_field_value(needle, self.__field))
+        if signature is None:
+            #nothing to prune, the matcher type will decide
+            return list(range(len(self.__elements)))
+
+        positions = set(self.__unindexed)
+        for key in self.__get_band_keys(signature):
+            positions.update(self.__buckets.get(key, ()))
+
+        return sorted(positions)
+
+    def get_candidates(self, needle, configured_matcher=None):
+        elements = self.__elements
+        return [elements[position] for position in self.get_candidate_positions(needle)]
+
+    def get_statistics(self, needle):
+        """
+        Return the IndexStatistics of the candidates of needle
+        """
+        return IndexStatistics(len(self.__elements), len(self.get_candidate_positions(needle)))
+
+
+def get_ngrams(value, n=3):
+    """
+    Return the set of character n-grams of the lowercase value padded with a space at both sides
+    """
+    if not value:
+        return set()
+    value = ' %s ' % value.lower()
+    if len(value) <= n:
+        return {value}
+    return set(value[i:i + n] for i in range(len(value) - n + 1))
+
+
+class PrescoreIndex(HayloftIndex):
+    """
+    Class to order the elements of a hayloft by a cheap prescore for each needle, the order of a search with a time
+    budget (ConfiguredMatcher.search_matches with budget): the elements more likely to match are scored first.
+
+    The prescore is the weighted (by the configured weights) sum of the Dice coefficient of the character n-grams of
+    text_field, counted with an inverted index, and the proximity of the point of geo_field (1 at the needle point,
+    0 at the greatest radius of the MatcherByGeoDistance), by an equirectangular distance. NumPy is needed.
+
+    As hayloft index every element is a candidate, in hayloft order.
+    """
+
+    def __init__(self, hayloft, text_field=None, geo_field=None, n=3):
+        if not HAS_NUMPY:
+            raise ImportError('NumPy is needed by PrescoreIndex')
+        if text_field is None and geo_field is None:
+            raise ValueError('PrescoreIndex needs a text_field or a geo_field')
+
+        self.__text_field = text_field
+        self.__geo_field = geo_field
+        self.__n = n
+        self.__elements = []
+        self.__postings = {}
+        self.__ngram_counts = []
+        self.__points = []
+        #arrays of __ngram_counts and __points, rebuilt after add_element
+        self.__arrays = None
+
+        if isinstance(hayloft, QuerySet):
+            hayloft = QuerySetIterator(hayloft).queryset_iterator()
+
+        for element in hayloft:
+            self.add_element(element)
+
+    @property
+    def get_text_field(self):
+        return self.__text_field
+
+    @property
+    def get_geo_field(self):
+        return self.__geo_field
+
+    @property
+    def get_elements(self):
+        return self.__elements
+
+    def __len__(self):
+        return len(self.__elements)
+
+    @staticmethod
+    def __get_point(value):
+        if isinstance(value, tuple) and len(value) == 2:
+            return radians(value[0]), radians(value[1])
+        return numpy.nan, numpy.nan
+
+    def add_element(self, element):
+        position = len(self.__elements)
+        self.__elements.append(element)
+        self.__arrays = None
+
+        if self.__text_field is not None:
+            ngrams = get_ngrams(get_field_value(element, self.__text_field), self.__n)
+            for ngram in ngrams:
+                self.__postings.setdefault(ngram, []).append(position)
+            self.__ngram_counts.append(len(ngrams))
+
+        if self.__geo_field is not None:
+            self.__points.append(self.__get_point(get_field_value(element, self.__geo_field)))
+
+    def __get_arrays(self):
+        if self.__arrays is None:
+            self.__arrays = (numpy.asarray(self.__ngram_counts, dtype=float),
+                             numpy.asarray(self.__points, dtype=float).reshape(-1, 2))
+        return self.__arrays
+
+    def __get_configuration(self, field, configured_matcher):
+        for config in configured_matcher.get_matcher_configuration:
+            if config.get_field == field:
+                return config
+        return None
+
+    def get_prescores(self, needle, configured_matcher):
+        """
+        Return the array of prescores of every element for needle
+        """
+        ngram_counts, points = self.__get_arrays()
+        prescores = numpy.zeros(len(self.__elements))
+
+        if self.__text_field is not None:
+            config = self.__get_configuration(self.__text_field, configured_matcher)
+            weight = config.get_weight if config is not None else 1.0
+            ngrams = get_ngrams(get_field_value(needle, self.__text_field), self.__n)
+            overlaps = numpy.zeros(len(self.__elements))
+            for ngram in ngrams:
+                positions = self.__postings.get(ngram)
+                if positions is not None:
+                    overlaps[positions] += 1
+            sizes = ngram_counts + len(ngrams)
+            prescores += weight * numpy.divide(2 * overlaps, sizes, out=numpy.zeros_like(overlaps), where=sizes > 0)
+
+        if self.__geo_field is not None:
+            config = self.__get_configuration(self.__geo_field, configured_matcher)
+            weight = config.get_weight if config is not None else 1.0
+            max_distance = (config.get_matcher_type.get_max_distance
+                            if config is not None and hasattr(config.get_matcher_type, 'get_max_distance') else 0)
+            lat, lng = self.__get_point(get_field_value(needle, self.__geo_field))
+            if not numpy.isnan(lat):
+                with numpy.errstate(invalid='ignore'):
+                    #longitudes wrapped around the antimeridian
+                    delta_lng = numpy.remainder(points[:, 1] - lng + numpy.pi, 2 * numpy.pi) - numpy.pi
+                    x = delta_lng * numpy.cos((points[:, 0] + lat) / 2)
+                    distances = get_haversine_earth_radius() * numpy.hypot(x, points[:, 0] - lat)
+                    if max_distance > 0:
+                        proximities = numpy.clip(1 - distances / max_distance, 0, 1)
+                    else:
+                        proximities = 1 / (1 + distances)
+                prescores += weight * numpy.nan_to_num(proximities)
+
+        return prescores
+
+    def get_order(self, needle, configured_matcher):
+        """
+        Return the list of hayloft positions from the greatest prescore for needle, by position between equal ones
+        """
+        return numpy.argsort(-self.get_prescores(needle, configured_matcher), kind='stable').tolist()
+
+    def get_candidates(self, needle, configured_matcher=None):
+        return self.__elements
+
+    def measure_recall_at(self, needles, configured_matcher, coverage):
+        """
+        Return the IndexStatistics of scoring only the first coverage fraction (0 to 1) of the order of each needle of
+        needles, against a full scan: the recall a time budget reaching that coverage gets.
+        It executes a full scan of the hayloft for each needle, so use a sample of needles.
+        """
+        elements = self.__elements
+        scored = int(round(coverage * len(elements)))
+        matches = full_scan_matches = searches = 0
+        for needle in needles:
+            searches += 1
+            first = [elements[position] for position in self.get_order(needle, configured_matcher)[:scored]]
+            matches += len(configured_matcher.search_matches(needle, first).get_matches)
+            full_scan_matches += len(configured_matcher.search_matches(needle, elements).get_matches)
+
+        return IndexStatistics(len(elements) * searches, scored * searches, matches, full_scan_matches)
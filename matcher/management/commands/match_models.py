@@ -0,0 +1,48 @@
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from matcher.configuration_loader import MatcherConfigurationLoader
+from matcher.matcher_exceptions import MatcherException
+from matcher.model_matching import ModelMatcher
+
+
+class Command(BaseCommand):
+    help = ('Match every row of a needles model against a hayloft model and save the matches as MatchingResult rows '
+            'of a resumable MatchingRun.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('needles_model', help='app_label.Model of the needles')
+        parser.add_argument('hayloft_model', help='app_label.Model of the hayloft')
+        parser.add_argument('--configuration', required=True, help='JSON or YAML matcher configuration')
+        parser.add_argument('--run', required=True, help='name of the MatchingRun, an existing run is resumed')
+        parser.add_argument('--restart', action='store_true', help='delete the results of the run and start again')
+        parser.add_argument('--top-k', type=int, default=None, help='matches saved for each needle, all by default')
+        parser.add_argument('--needle-chunksize', type=int, default=100)
+        parser.add_argument('--batch-size', type=int, default=1000, help='rows of each bulk_create')
+
+    def __get_model(self, label):
+        try:
+            return apps.get_model(label)
+        except (LookupError, ValueError) as e:
+            raise CommandError(str(e))
+
+    def handle(self, *args, **options):
+        try:
+            loader = MatcherConfigurationLoader.from_file(options['configuration'])
+        except (IOError, MatcherException) as e:
+            raise CommandError(str(e))
+
+        needles = self.__get_model(options['needles_model']).objects.all()
+        hayloft = self.__get_model(options['hayloft_model']).objects.all()
+        model_matcher = ModelMatcher(loader.get_configured_matcher(check_classes=False), top_k=options['top_k'],
+                                     needle_chunksize=options['needle_chunksize'], batch_size=options['batch_size'])
+        start = time.time()
+
+        def progress(run, needles_matched):
+            self.stdout.write('%i needles matched (last pk %s), %.1f needles/s' %
+                              (needles_matched, run.last_needle_pk, needles_matched / max(time.time() - start, 1e-6)))
+
+        run = model_matcher.run(options['run'], needles, hayloft, restart=options['restart'], progress=progress)
+        self.stdout.write('Run %s finished: %i results' % (run.name, run.results.count()))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from matcher.backends import get_backends_report
+
+
+class Command(BaseCommand):
+    help = ('List the registered text algorithms and geo distance implementors with the availability of their backends '
+            'and their comparisons per second over a small sample.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=100, help='times the sample is compared')
+
+    def handle(self, *args, **options):
+        for report in get_backends_report(repeat=options['repeat']):
+            if report.get_missing_backends:
+                state = 'missing %s' % ', '.join(report.get_missing_backends)
+            elif report.get_error is not None:
+                state = 'error %s' % report.get_error
+            else:
+                state = '%.0f calls/s' % report.get_calls_per_second
+            self.stdout.write('%-5s %-22s %s' % (report.get_kind, report.get_name, state))
@@ -1,7 +1,21 @@
+from itertools import islice
+from timeit import default_timer
+
 from django.db.models.query import QuerySet
+from matcher.backends import LazyModule, is_module_available
+from matcher.columnar_hayloft import ColumnarHayloft
+from matcher.hayloft_index import HayloftIndex, PrescoreIndex
 from matcher.matcher_type import MatcherType
 from matcher.matcher_exceptions import MatcherException
 from matcher.queryset_iterator import QuerySetIterator
+from matcher.related_fields import QueryCounter, get_field_getter, prepare_queryset
+
+
+numpy = LazyModule('numpy')
+HAS_NUMPY = is_module_available('numpy')
+
+#elements scored between two checks of the time budget of a search
+BUDGET_CHECK_INTERVAL = 16
 
 
 class MatcherFieldConfiguration(object):
@@ -62,12 +76,12 @@ class Match(object):
     __id = None
     __match_element = None
     __total_ratio = 0
-    __match_log = []
+    __match_log = None
 
-    def __init__(self, match_element, total_ratio, match_log=[]):
+    def __init__(self, match_element, total_ratio, match_log=None):
         try:
             self.__match_element = match_element
-            self.__match_log = match_log
+            self.__match_log = match_log if match_log is not None else []
             self.__total_ratio = total_ratio
         except Exception as e:
             raise e
@@ -89,26 +103,144 @@ class Match(object):
         return self.__total_ratio
 
 
-class Matcher(object):
+class MatchingPlan(object):
+    """
+    Class to define the compiled plan of one search of a needle.
+
+    The matcher configuration is compiled once per search into a flat tuple of steps, one per
+    MatcherFieldConfiguration: the field, the accessor of the hayloft element field (itemgetter for dicts, attrgetter
+    for objects, chosen by the needle class that all the hayloft elements must share, see get_field_getter for field
+    paths like 'address.city' or 'address__city'), the needle field value, the
+    weight already balanced by the max weight and the ratio match function of the MatcherType prepared for the needle
+    field value (MatcherType.prepare_ratio_match).
+    Scoring an element is then only scoring and accumulation.
+
+    check_class = False allows hayloft elements of other class than the needle with the same configured fields, i.e.
+    instances of two Django models. Needle and hayloft elements must be both dicts or both objects.
     """
-    Class to define a Matcher.
 
-    With a correct matcher configuration, a needle and hayloft,  the class try to find best matches of
-    needle in hayloft.
+    def __init__(self, needle, matcher_configuration, threshold, check_class=True):
+        self.__needle = needle
+        self.__needle_class = needle.__class__
+        self.__check_class_names = check_class
+        self.__threshold = threshold
 
-    The Matcher Configuration defines the needle field, the MatcherType for use in search and his weight.
+        is_dict = isinstance(needle, dict)
+
+        steps = []
+        for config in matcher_configuration:
+            field = config.get_field
+            getter = get_field_getter(field, is_dict)
+            try:
+                needle_field = getter(needle)
+            except (KeyError, AttributeError):
+                raise self.__field_exception(is_dict, field)
+
+            steps.append((field, getter, needle_field,
+                          float(config.get_weight) / config.get_max_weight,
+                          config.get_matcher_type.prepare_ratio_match(needle_field)))
+
+        self.__is_dict = is_dict
+        self.__steps = tuple(steps)
+
+    @property
+    def get_needle(self):
+        return self.__needle
+
+    @property
+    def get_threshold(self):
+        return self.__threshold
+
+    @property
+    def get_steps(self):
+        return self.__steps
+
+    def __field_exception(self, is_dict, field):
+        if is_dict:
+            return MatcherException(1000, msg_to_append='%s key not exist.' % field)
+        else:
+            return MatcherException(1001, msg_to_append='%s Attribute not exist.' % field)
+
+    def __check_class(self, element):
+        """
+        the needle and hayloft element must have the same class, unless the plan was compiled without check_class
+        """
+        if self.__check_class_names and element.__class__.__name__ != self.__needle_class.__name__:
+            raise TypeError
+
+    def score(self, element):
+        """
+        Return the balanced ratio of element for all fields of the plan
+        """
+        if element.__class__ is not self.__needle_class:
+            self.__check_class(element)
+
+        ratio_balanced = 0
+        for field, getter, needle_field, weight, ratio_match in self.__steps:
+            try:
+                element_field = getter(element)
+            except (KeyError, AttributeError):
+                raise self.__field_exception(self.__is_dict, field)
+
+            ratio_balanced += weight * ratio_match(element_field)
+
+        return ratio_balanced
+
+    def score_with_log(self, element):
+        """
+        Return the balanced ratio of element and the description of the ratio of each field
+        """
+        if element.__class__ is not self.__needle_class:
+            self.__check_class(element)
+
+        ratio_balanced = 0
+        result_description = []
+        for field, getter, needle_field, weight, ratio_match in self.__steps:
+            try:
+                element_field = getter(element)
+            except (KeyError, AttributeError):
+                raise self.__field_exception(self.__is_dict, field)
+
+            ratio = ratio_match(element_field)
+            ratio_balanced += weight * ratio
+            result_description.append("%s - %s" % (str(ratio), element_field))
+
+        return ratio_balanced, result_description
+
+    def match_element(self, element, logging=False):
+        """
+        Return a Match if the balanced ratio of element is greater or equal than the threshold or None otherwise.
+        """
+        if logging:
+            ratio_balanced, result_description = self.score_with_log(element)
+        else:
+            ratio_balanced, result_description = self.score(element), None
+
+        if ratio_balanced >= self.__threshold:
+            return Match(element, ratio_balanced, result_description)
+
+        return None
+
+
+class MatchResult(object):
     """
-    __needle = None
-    __matches = []
-    __matcher_configuration = []
-    __threshold = 0
+    Class to define the result of one search of a needle in a hayloft.
 
-    def __init__(self, needle, matcher_configuration, threshold):
-        if self.__check_configuration(matcher_configuration):
-            self.__needle = needle
-            self.__matcher_configuration = matcher_configuration
-            self.__threshold = threshold
-        else: raise TypeError
+    ConfiguredMatcher.search_matches returns a new MatchResult in each call, so the matches found are never shared
+    between searches or threads.
+
+    query_count is the number of queries of a search in a QuerySet hayloft with logging, None otherwise.
+
+    A search with a time budget sets the number of elements scored and the hayloft size (set_coverage): the result is
+    partial when the budget ran out before scoring every element, its matches are the best found so far.
+    """
+
+    def __init__(self, needle, matches=None, query_count=None):
+        self.__needle = needle
+        self.__matches = matches if matches is not None else []
+        self.__query_count = query_count
+        self.__scored_count = None
+        self.__hayloft_size = None
 
     @property
     def get_needle(self):
@@ -118,6 +250,96 @@ class Matcher(object):
     def get_matches(self):
         return self.__matches
 
+    @property
+    def get_query_count(self):
+        return self.__query_count
+
+    def set_query_count(self, query_count):
+        self.__query_count = query_count
+
+    @property
+    def get_scored_count(self):
+        return self.__scored_count
+
+    @property
+    def get_hayloft_size(self):
+        return self.__hayloft_size
+
+    @property
+    def get_coverage(self):
+        """
+        Fraction of the hayloft scored, None if it was not measured or the hayloft size is unknown (an iterator hayloft
+        not exhausted within the budget)
+        """
+        if self.__scored_count is None or self.__hayloft_size is None:
+            return None
+        elif not self.__hayloft_size:
+            return 1
+        return float(self.__scored_count) / self.__hayloft_size
+
+    @property
+    def is_partial(self):
+        if self.__scored_count is None:
+            return False
+        return self.__hayloft_size is None or self.__scored_count < self.__hayloft_size
+
+    def set_coverage(self, scored_count, hayloft_size):
+        self.__scored_count = scored_count
+        self.__hayloft_size = hayloft_size
+
+    def add_match(self, match):
+        self.__matches.append(match)
+
+    def order_matches(self):
+        """
+        Order a matches list based on total_ratio attribute of Radius
+        """
+        self.get_matches.sort(key=lambda x: x.get_total_ratio, reverse=True)
+
+    def get_distance_position_from_the_best(self, list_position):
+        """
+        Return the distance between a element in the list and the first element in the list
+        It is needed that the list is ordered to perform this operation correctly.
+
+        The distance is the elements ratios difference.
+        """
+        if list_position <= (len(self.get_matches) - 1):
+            return self.get_matches[0].get_total_ratio - self.get_matches[list_position].get_total_ratio
+        else:
+            return -1
+
+    def get_distance_position_with_next(self, list_position):
+        """
+        Return the distance between a element in the list and the next element in the list
+        It is needed that the list is ordered to perform this operation correctly.
+
+        The distance is the elements ratios difference.
+        """
+        if (list_position + 1) <= (len(self.get_matches) - 1):
+            return self.get_matches[list_position].get_total_ratio - self.get_matches[list_position + 1].get_total_ratio
+        else:
+            return -1
+
+
+class ConfiguredMatcher(object):
+    """
+    Class to define a configured Matcher: a matcher configuration and a threshold without needle.
+
+    A ConfiguredMatcher keeps no state between searches: the needle is passed to each search and the matches are
+    returned in a new MatchResult. It can be configured once and shared between requests and threads without locks.
+
+    The Matcher Configuration defines the needle field, the MatcherType for use in search and his weight.
+
+    check_classes = False allows to search needles in haylofts of other class (see MatchingPlan).
+    """
+
+    def __init__(self, matcher_configuration, threshold, check_classes=True):
+        if self.__check_configuration(matcher_configuration):
+            self.__matcher_configuration = tuple(matcher_configuration)
+            self.__threshold = threshold
+            self.__check_classes = check_classes
+        else: raise TypeError
+
     @property
     def get_matcher_configuration(self):
         return self.__matcher_configuration
@@ -126,6 +348,10 @@ class Matcher(object):
     def get_threshold(self):
         return self.__threshold
 
+    @property
+    def get_check_classes(self):
+        return self.__check_classes
+
     def __check_configuration(self, matcher_configuration):
         """
         check if all elements of matcher_configuration belongs to the same class MatcherFieldConfiguration
@@ -136,98 +362,314 @@ class Matcher(object):
 
         return True
 
-    def __get_field_value(self, obj, field_str):
-        if isinstance(obj, dict):
-            try:
-                return obj[field_str]
-            except KeyError:
-                raise MatcherException(1000, msg_to_append='%s key not exist.' % field_str)
+    def __get_iterator(self, hayloft):
+        return QuerySetIterator(hayloft).queryset_iterator()
 
-        else:
-            try:
-                return getattr(obj, field_str)
-            except AttributeError:
-                raise MatcherException(1000, msg_to_append='%s Attribute not exist.' % field_str)
+    def prepare_queryset(self, queryset, values=False):
+        """
+        Return queryset with the select_related / prefetch_related joins of the configured field paths, or as values()
+        dicts of them with values = True (see related_fields.prepare_queryset)
+        """
+        return prepare_queryset(queryset, [config.get_field for config in self.__matcher_configuration], values)
 
-    def __balance_ratio(self, field_weight, ratio_result, max = 1):
+    def get_min_ratio(self, field_configuration):
         """
-        balance the match ratio result for one field into general field weight
-        if for 'name' field his weight is 30% and the ratio match results is 80%
-        balance ratio is (80% * 30%) / 1 = 24%
+        Return the minimum ratio the field of field_configuration must reach so that an element can reach the
+        threshold, supposing ratio 1 in the rest of fields. Hayloft indexes use it to skip elements.
         """
-        if not isinstance(field_weight, float): field_weight = float(field_weight)
+        weights = [float(config.get_weight) / config.get_max_weight for config in self.__matcher_configuration]
+        weight = float(field_configuration.get_weight) / field_configuration.get_max_weight
+        if weight == 0:
+            return 0
 
-        return (field_weight * ratio_result) / max
+        #small tolerance so float rounding never skips an element of the threshold
+        return (self.__threshold - (sum(weights) - weight)) / weight - 1e-9
 
-    def __add_to_results(self, element, total_ratio, match_log = False):
+    def __search_columnar(self, needle, hayloft, logging):
         """
-        add one match element to match results self.__matches with his matching pattern
+        Search the matches of needle in a ColumnarHayloft: each configured field column is scored at once with
+        get_ratio_matches of its MatcherType and the matches refer to row positions.
         """
-        if match_log:
-            self.__matches.append(Match(element, total_ratio, match_log))
+        result = MatchResult(needle)
+        plan = self.compile_plan(needle)
+        size = len(hayloft)
+
+        columns = []
+        ratios_by_field = []
+        total = numpy.zeros(size) if HAS_NUMPY else [0] * size
+        for config, (field, getter, needle_field, weight, ratio_match) in zip(self.__matcher_configuration,
+                                                                               plan.get_steps):
+            column = hayloft.get_column(field)
+            ratios = config.get_matcher_type.get_ratio_matches(needle_field, column)
+
+            if HAS_NUMPY:
+                ratios = numpy.asarray(ratios, dtype=float)
+                total += weight * ratios
+            else:
+                total = [ratio_balanced + weight * ratio for ratio_balanced, ratio in zip(total, ratios)]
+
+            columns.append(column)
+            ratios_by_field.append(ratios)
+
+        if HAS_NUMPY:
+            positions = numpy.flatnonzero(total >= self.__threshold).tolist()
         else:
-            self.__matches.append(Match(element, total_ratio))
+            positions = [position for position in range(size) if total[position] >= self.__threshold]
 
-    def __get_iterator(self, hayloft):
-        return QuerySetIterator(hayloft).queryset_iterator()
+        for position in positions:
+            result_description = None
+            if logging:
+                result_description = ["%s - %s" % (str(ratios[position]), column[position])
+                                      for ratios, column in zip(ratios_by_field, columns)]
+            result.add_match(Match(position, float(total[position]), result_description))
 
-    def search_matches(self, hayloft, logging = False, clean_matches=False):
+        return result
+
+    def get_matcher(self, needle):
         """
-        Method to find the matches of self.__needle in hayloft
+        Return a Matcher of needle with this configuration
+        """
+        return Matcher(needle, self.__matcher_configuration, self.__threshold)
+
+    def compile_plan(self, needle):
+        """
+        Compile the MatchingPlan to score hayloft elements against needle
+        """
+        return MatchingPlan(needle, self.__matcher_configuration, self.__threshold, self.__check_classes)
+
+    def match_element(self, needle, element, logging=False):
+        """
+        Calculate the balanced ratio of one hayloft element against needle.
+
+        Return a Match if the ratio is greater or equal than self.__threshold or None otherwise.
+        To score several elements of the same needle compile the plan once with compile_plan.
+        """
+        return self.compile_plan(needle).match_element(element, logging)
+
+    def search_matches(self, needle, hayloft, logging=False, budget=None):
+        """
+        Method to find the matches of needle in hayloft and return them in a new MatchResult
         To find the matches we use __matcher_configuration a list of MatcherFieldConfiguration which tell us the field
         of needle and hayloft element, the matcher type to execute to obtain the match ratio and the field weight in
         matching.
 
         If result of ratio matching for all fields in one __matcher_configuration element is greater or equal than
-        self.____threshold, the hayloft element is added to self.__matches with his matching result.
+        self.____threshold, the hayloft element is added to the MatchResult with his matching result.
 
         needle object class and hayloft element object class must be the same
 
-        needle and hayloft can be objects or dicts
+        needle and hayloft can be objects or dicts. hayloft can be a ColumnarHayloft too, then the matches refer to
+        row positions, or a HayloftIndex, then only its candidates for needle are scored.
+
+        A QuerySet hayloft is read with the joins of the configured field paths (prepare_queryset), as values() dicts
+        when needle is a dict. With logging the queries of the search are counted in MatchResult.get_query_count.
+
+        budget is a time limit in seconds: the elements are scored until it runs out and the MatchResult keeps the
+        matches found so far with its coverage (partial when some elements were not scored). A PrescoreIndex hayloft
+        is scored from the elements most likely to match. ColumnarHayloft searches are vectorized and always complete.
         """
-        if clean_matches: self.__matches = []
-        
-        if self.__matcher_configuration and hayloft:
+        if budget is not None and not isinstance(hayloft, ColumnarHayloft):
+            return self.__search_within_budget(needle, hayloft, logging, budget)
+
+        if isinstance(hayloft, ColumnarHayloft):
+            if self.__matcher_configuration and len(hayloft):
+                return self.__search_columnar(needle, hayloft, logging)
+            return MatchResult(needle)
+
+        result = MatchResult(needle)
+
+        if isinstance(hayloft, HayloftIndex):
+            hayloft = hayloft.get_candidates(needle, self)
+
+        #a QuerySet is not tested for truthiness, which would fetch and keep all its rows
+        if self.__matcher_configuration and hayloft is not None:
+
+            plan = self.compile_plan(needle)
 
             if isinstance(hayloft, QuerySet):
+                hayloft = self.prepare_queryset(hayloft, values=isinstance(needle, dict))
+                if logging:
+                    with QueryCounter(hayloft) as query_counter:
+                        self.__scan(plan, self.__get_iterator(hayloft), result.add_match, logging)
+                    result.set_query_count(query_counter.get_query_count)
+                    return result
                 hayloft = self.__get_iterator(hayloft)
 
+            self.__scan(plan, hayloft, result.add_match, logging)
+
+        return result
+
+    def __search_within_budget(self, needle, hayloft, logging, budget):
+        deadline = default_timer() + budget
+        result = MatchResult(needle)
+
+        if isinstance(hayloft, PrescoreIndex):
+            elements = hayloft.get_elements
+            positions = hayloft.get_order(needle, self)
+            hayloft_size = len(positions)
+            hayloft = (elements[position] for position in positions)
+        elif isinstance(hayloft, HayloftIndex):
+            hayloft = hayloft.get_candidates(needle, self)
+            hayloft_size = len(hayloft)
+        elif isinstance(hayloft, QuerySet):
+            hayloft = self.prepare_queryset(hayloft, values=isinstance(needle, dict))
+            hayloft_size = hayloft.count()
+            hayloft = self.__get_iterator(hayloft)
+        elif hasattr(hayloft, '__len__'):
+            hayloft_size = len(hayloft)
+        else:
+            #iterators: the size is known when they are exhausted
+            hayloft_size = None
+
+        if hayloft_size == 0:
+            result.set_coverage(0, 0)
+            return result
+
+        scored_count = 0
+        if self.__matcher_configuration:
+            plan = self.compile_plan(needle)
+            iterator = iter(hayloft)
+            while default_timer() < deadline:
+                chunk = list(islice(iterator, BUDGET_CHECK_INTERVAL))
+                if not chunk:
+                    if hayloft_size is None:
+                        hayloft_size = scored_count
+                    break
+                self.__scan(plan, chunk, result.add_match, logging)
+                scored_count += len(chunk)
+        else:
+            scored_count = hayloft_size
+
+        result.set_coverage(scored_count, hayloft_size)
+        return result
+
+    def __scan(self, plan, hayloft, add_match, logging):
+        threshold = self.__threshold
+
+        if logging:
+            for element in hayloft:
+                ratio_balanced, result_description = plan.score_with_log(element)
+                if ratio_balanced >= threshold:
+                    add_match(Match(element, ratio_balanced, result_description))
+        else:
+            score = plan.score
             #For each hayloft element
             for element in hayloft:
-                #check object classes
-                if self.__needle.__class__.__name__ == element.__class__.__name__:
-                    ratio_balanced = 0
-                    result_description = []
-                    #For each Matcher Configuration in ____matcher_configuration
-                    for config in self.__matcher_configuration:
-                        needle_field = self.__get_field_value(self.__needle, config.get_field)
-                        element_field = self.__get_field_value(element, config.get_field)
+                ratio_balanced = score(element)
+                if ratio_balanced >= threshold:
+                    #append Match!!!
+                    add_match(Match(element, ratio_balanced))
+
+    def search_matches_batch(self, needles, hayloft, logging=False):
+        """
+        Method to find the matches of several needles in hayloft with one pass over hayloft.
+        Return a list with the MatchResult of each needle, the same results of search_matches for each needle.
 
-                        ratio = config.get_matcher_type.get_ratio_match(needle_field, element_field)
+        Hayloft iteration (and the QuerySet chunks) is shared by all needles, so it is cheaper than searching each
+        needle on its own. ColumnarHayloft and HayloftIndex haylofts are searched needle by needle.
+        """
+        needles = list(needles)
+        if isinstance(hayloft, (ColumnarHayloft, HayloftIndex)):
+            return [self.search_matches(needle, hayloft, logging) for needle in needles]
+
+        results = [MatchResult(needle) for needle in needles]
 
-                        """try:
-                            ratio = config.get_matcher_type.get_ratio_match(needle_field, element_field)
-                        except (TypeError, ValueError) as e:
-                            raise MatcherException(1002, msg_to_append=e)"""
+        if self.__matcher_configuration and needles and hayloft is not None:
 
-                        ratio_balanced += self.__balance_ratio(config.get_weight, ratio, config.get_max_weight)
+            plans = [(self.compile_plan(needle), result.add_match) for needle, result in zip(needles, results)]
 
-                        if logging:
-                            result_description.append("%s - %s" % (str(ratio), element_field))
+            if isinstance(hayloft, QuerySet):
+                hayloft = self.prepare_queryset(hayloft, values=isinstance(needles[0], dict))
+                if logging:
+                    with QueryCounter(hayloft) as query_counter:
+                        self.__scan_batch(plans, self.__get_iterator(hayloft), logging)
+                    for result in results:
+                        result.set_query_count(query_counter.get_query_count)
+                    return results
+                hayloft = self.__get_iterator(hayloft)
 
-                    if ratio_balanced >= self.__threshold:
-                        #append Match!!!
-                        self.__add_to_results(element, ratio_balanced, result_description)
+            self.__scan_batch(plans, hayloft, logging)
 
+        return results
+
+    def __scan_batch(self, plans, hayloft, logging):
+        threshold = self.__threshold
+
+        for element in hayloft:
+            for plan, add_match in plans:
+                if logging:
+                    ratio_balanced, result_description = plan.score_with_log(element)
                 else:
-                    #the needle and hayloft element do not have the same class
-                    raise TypeError
+                    ratio_balanced, result_description = plan.score(element), None
+                if ratio_balanced >= threshold:
+                    add_match(Match(element, ratio_balanced, result_description))
+
+
+class Matcher(object):
+    """
+    Class to define a Matcher.
+
+    With a correct matcher configuration, a needle and hayloft,  the class try to find best matches of
+    needle in hayloft.
+
+    The Matcher Configuration defines the needle field, the MatcherType for use in search and his weight.
+
+    Matcher keeps the matches of its needle between searches. To share one configuration between several needles or
+    threads use ConfiguredMatcher.
+    """
+
+    def __init__(self, needle, matcher_configuration, threshold):
+        self.__configured_matcher = ConfiguredMatcher(matcher_configuration, threshold)
+        self.__result = MatchResult(needle)
+
+    @property
+    def get_needle(self):
+        return self.__result.get_needle
+
+    @property
+    def get_matches(self):
+        return self.__result.get_matches
+
+    @property
+    def get_matcher_configuration(self):
+        return self.__configured_matcher.get_matcher_configuration
+
+    @property
+    def get_threshold(self):
+        return self.__configured_matcher.get_threshold
+
+    @property
+    def get_configured_matcher(self):
+        return self.__configured_matcher
+
+    def match_element(self, element, logging=False):
+        """
+        Calculate the balanced ratio of one hayloft element against the needle.
+
+        Return a Match if the ratio is greater or equal than the threshold or None otherwise. This method does not
+        modify the matcher state, so it can be executed from several threads at the same time.
+        """
+        return self.__configured_matcher.match_element(self.get_needle, element, logging)
+
+    def search_matches(self, hayloft, logging = False, clean_matches=False):
+        """
+        Method to find the matches of the needle in hayloft. See ConfiguredMatcher.search_matches
+
+        The matches found are added to the matches of previous searches unless clean_matches is True.
+        """
+        result = self.__configured_matcher.search_matches(self.get_needle, hayloft, logging)
+
+        if clean_matches:
+            self.__result = result
+        else:
+            for match in result.get_matches:
+                self.__result.add_match(match)
 
     def order_matches(self):
         """
         Order a matches list based on total_ratio attribute of Radius
         """
-        self.get_matches.sort(key=lambda x: x.get_total_ratio, reverse=True)
+        self.__result.order_matches()
 
     def get_distance_position_from_the_best(self, list_position):
         """
@@ -236,10 +678,7 @@ class Matcher(object):
 
         The distance is the elements ratios difference.
         """
-        if list_position <= (len(self.get_matches) - 1):
-            return self.get_matches[0].get_total_ratio - self.get_matches[list_position].get_total_ratio
-        else:
-            return -1
+        return self.__result.get_distance_position_from_the_best(list_position)
 
     def get_distance_position_with_next(self, list_position):
         """
@@ -248,7 +687,4 @@ class Matcher(object):
 
         The distance is the elements ratios difference.
         """
-        if (list_position + 1) <= (len(self.get_matches) - 1):
-            return self.get_matches[list_position].get_total_ratio - self.get_matches[list_position + 1].get_total_ratio
-        else:
-            return -1
\ No newline at end of file
+        return self.__result.get_distance_position_with_next(list_position)
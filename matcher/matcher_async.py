@@ -0,0 +1,166 @@
+import asyncio
+import threading
+
+from django.db.models.query import QuerySet
+
+from matcher.hayloft_index import HayloftIndex
+from matcher.matcher import Matcher
+from matcher.queryset_iterator import get_pk
+
+
+class AsyncQuerySetIterator(object):
+
+    def __init__(self, queryset):
+        self.__queryset = queryset
+
+    async def aqueryset_chunks(self, chunksize=1000):
+        '''
+        Iterate asynchronously over a Django Queryset ordered by the primary key, yielding lists of rows
+
+        It is the async ORM counterpart of QuerySetIterator.queryset_iterator: each chunk of a maximum of chunksize
+        rows is fetched with one awaited query, so the event loop is never blocked by the database.
+
+        Note that the implementation of the iterator does not support ordered query sets.
+        '''
+        queryset = self.__queryset.order_by('pk')
+        chunk = [row async for row in queryset[:chunksize]]
+        while chunk:
+            yield chunk
+            if len(chunk) < chunksize:
+                break
+            chunk = [row async for row in queryset.filter(pk__gt=get_pk(chunk[-1]))[:chunksize]]
+
+
+class AsyncMatcher(object):
+    """
+    Class to run the search of a Matcher from asyncio code (async Django views) without blocking the event loop.
+
+    The hayloft is read in chunks of chunksize elements (with the async ORM when it is a QuerySet) and each chunk is
+    scored in executor, a concurrent.futures Executor. executor = None means the default executor of the event loop.
+    While one chunk is scored the next one is read, so database and scoring work overlap.
+
+    timeout is the maximum number of seconds for the whole search, None means no limit. When it is exceeded
+    asyncio.TimeoutError is raised.
+    """
+
+    def __init__(self, matcher, executor=None, chunksize=1000, timeout=None):
+        if isinstance(matcher, Matcher) and isinstance(chunksize, int) and chunksize > 0:
+            self.__matcher = matcher
+            self.__executor = executor
+            self.__chunksize = chunksize
+            self.__timeout = timeout
+        else:
+            raise TypeError
+
+    @property
+    def get_matcher(self):
+        return self.__matcher
+
+    @property
+    def get_executor(self):
+        return self.__executor
+
+    @property
+    def get_chunksize(self):
+        return self.__chunksize
+
+    @property
+    def get_timeout(self):
+        return self.__timeout
+
+    def __score_chunk(self, plan, chunk, logging, cancelled):
+        """
+        Score a chunk of hayloft elements with the MatchingPlan of the search. It runs inside the executor.
+        cancelled is a threading.Event set when the search is cancelled, so a running chunk stops as soon as possible.
+        """
+        matches = []
+        for element in chunk:
+            if cancelled.is_set():
+                break
+            match = plan.match_element(element, logging)
+            if match is not None:
+                matches.append(match)
+
+        return matches
+
+    async def __get_chunks(self, hayloft):
+        """
+        Yield lists of a maximum of self.__chunksize hayloft elements.
+        hayloft can be a QuerySet, an async iterable or a iterable of objects or dicts.
+        """
+        if isinstance(hayloft, QuerySet):
+            async for chunk in AsyncQuerySetIterator(hayloft).aqueryset_chunks(self.__chunksize):
+                yield chunk
+
+        else:
+            chunk = []
+            if hasattr(hayloft, '__aiter__'):
+                async for element in hayloft:
+                    chunk.append(element)
+                    if len(chunk) == self.__chunksize:
+                        yield chunk
+                        chunk = []
+            else:
+                for element in hayloft:
+                    chunk.append(element)
+                    if len(chunk) == self.__chunksize:
+                        yield chunk
+                        chunk = []
+                        #let other tasks run between chunks of a long iterable
+                        await asyncio.sleep(0)
+
+            if chunk:
+                yield chunk
+
+    async def __wait(self, awaitable, deadline, loop):
+        if deadline is None:
+            return await awaitable
+
+        return await asyncio.wait_for(awaitable, max(deadline - loop.time(), 0))
+
+    async def search_matches(self, hayloft, logging=False):
+        """
+        Async iterator over the matches of the needle of self.__matcher in hayloft.
+        Matches are yielded chunk by chunk in hayloft order, the same matches Matcher.search_matches would find.
+
+        async for match in AsyncMatcher(my_matcher).search_matches(Place.objects.all()):
+            ...
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if self.__timeout is None else loop.time() + self.__timeout
+        cancelled = threading.Event()
+        configured_matcher = self.__matcher.get_configured_matcher
+        plan = configured_matcher.compile_plan(self.__matcher.get_needle)
+        if isinstance(hayloft, HayloftIndex):
+            hayloft = hayloft.get_candidates(self.__matcher.get_needle, configured_matcher)
+        elif isinstance(hayloft, QuerySet):
+            hayloft = configured_matcher.prepare_queryset(hayloft, values=isinstance(self.__matcher.get_needle, dict))
+        chunks = self.__get_chunks(hayloft)
+        pending = scoring = None
+
+        try:
+            while True:
+                try:
+                    chunk = await self.__wait(chunks.__anext__(), deadline, loop)
+                except StopAsyncIteration:
+                    break
+
+                scoring = loop.run_in_executor(self.__executor, self.__score_chunk, plan, chunk, logging, cancelled)
+                if pending is not None:
+                    for match in await self.__wait(pending, deadline, loop):
+                        yield match
+                pending = scoring
+
+            if pending is not None:
+                for match in await self.__wait(pending, deadline, loop):
+                    yield match
+                pending = None
+
+        finally:
+            #timeout, cancellation or the consumer stopped iterating: stop any chunk still running in the executor,
+            #the one being awaited and the one submitted after it
+            cancelled.set()
+            for future in (pending, scoring):
+                if future is not None:
+                    future.cancel()
+            await chunks.aclose()
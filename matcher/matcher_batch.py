@@ -0,0 +1,243 @@
+"""
+Streaming file to file batch matching.
+
+python -m matcher.matcher_batch --configuration configuration.yaml --needles leads.csv --hayloft venues.jsonl \
+    --output matches.jsonl --top-k 5
+
+Needles and hayloft are .csv (with header) or .jsonl files, read in chunks so the memory is bounded by the chunk
+sizes and the number of processes. Each process matches a chunk of needles against the whole hayloft file and the
+top-K matches of each needle are written to the output (.jsonl or .csv) as soon as its chunk is finished.
+"""
+import argparse
+import csv
+import heapq
+import json
+import sys
+import time
+from collections import deque
+from multiprocessing import Pool, cpu_count
+
+from matcher.configuration_loader import MatcherConfigurationLoader
+
+
+def read_rows(path):
+    """
+    Yield the rows of a .csv file (with header) or a .jsonl file (one JSON object per line) as dicts
+    """
+    if path.endswith('.csv'):
+        with open(path) as rows_file:
+            for row in csv.DictReader(rows_file):
+                yield row
+    else:
+        with open(path) as rows_file:
+            for line in rows_file:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def read_chunks(path, loader, id_field, chunksize):
+    """
+    Yield lists of a maximum of chunksize (id, record) of the rows of path. The id is the value of id_field or the
+    row number when id_field is None. Records with an empty text field can not be matched by text and their record
+    is None.
+    """
+    text_fields = loader.get_text_fields
+    chunk = []
+    for row_number, row in enumerate(read_rows(path)):
+        record = loader.get_record(row)
+        if any(not record[field] for field in text_fields):
+            record = None
+
+        chunk.append((row.get(id_field) if id_field else row_number, record))
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+class TopMatches(object):
+    """
+    Class to keep the top_k best matches of a needle while the hayloft is streamed, in the order of order_matches:
+    greater total ratio first and hayloft order between equal ratios.
+    """
+
+    def __init__(self, top_k):
+        self.__top_k = top_k
+        self.__heap = []
+
+    def add(self, position, element_id, total_ratio):
+        item = (total_ratio, -position, element_id)
+        if len(self.__heap) < self.__top_k:
+            heapq.heappush(self.__heap, item)
+        elif item > self.__heap[0]:
+            heapq.heapreplace(self.__heap, item)
+
+    def get_matches(self):
+        """
+        Return the list of (element_id, total_ratio) ordered from the best match
+        """
+        return [(element_id, total_ratio) for total_ratio, position, element_id in sorted(self.__heap, reverse=True)]
+
+
+class BatchMatcher(object):
+    """
+    Class to match the needles of a file against the hayloft of another file with the configuration of a
+    MatcherConfigurationLoader.
+    """
+
+    def __init__(self, loader, hayloft_path, hayloft_id_field=None, hayloft_chunksize=5000, top_k=10):
+        self.__loader = loader
+        self.__configured_matcher = loader.get_configured_matcher()
+        self.__hayloft_path = hayloft_path
+        self.__hayloft_id_field = hayloft_id_field
+        self.__hayloft_chunksize = hayloft_chunksize
+        self.__top_k = top_k
+
+    def match_needle_chunk(self, needle_chunk):
+        """
+        Match a chunk of (id, record) needles against the whole hayloft file.
+        Return the list of (needle_id, [(element_id, total_ratio), ...]) and the number of pairs scored.
+        """
+        threshold = self.__configured_matcher.get_threshold
+        needles = [(self.__configured_matcher.compile_plan(record).score, TopMatches(self.__top_k))
+                   for needle_id, record in needle_chunk if record is not None]
+
+        position = 0
+        pairs = 0
+        for hayloft_chunk in read_chunks(self.__hayloft_path, self.__loader, self.__hayloft_id_field,
+                                         self.__hayloft_chunksize):
+            for element_id, element in hayloft_chunk:
+                if element is not None:
+                    for score, top_matches in needles:
+                        ratio_balanced = score(element)
+                        if ratio_balanced >= threshold:
+                            top_matches.add(position, element_id, ratio_balanced)
+                    pairs += len(needles)
+                position += 1
+
+        top_matches = iter([top_matches for score, top_matches in needles])
+        results = [(needle_id, next(top_matches).get_matches() if record is not None else [])
+                   for needle_id, record in needle_chunk]
+        return results, pairs
+
+
+#BatchMatcher of each worker process, set once by _init_worker
+_worker_state = {}
+
+
+def _init_worker(description, hayloft_path, hayloft_id_field, hayloft_chunksize, top_k):
+    _worker_state['batch_matcher'] = BatchMatcher(MatcherConfigurationLoader(description), hayloft_path,
+                                                  hayloft_id_field, hayloft_chunksize, top_k)
+
+
+def _match_needle_chunk(needle_chunk):
+    return _worker_state['batch_matcher'].match_needle_chunk(needle_chunk)
+
+
+class MatchesWriter(object):
+    """
+    Class to write the top matches of each needle to a .jsonl file ({"needle": id, "matches": [{"id": id,
+    "ratio": ratio}, ...]} per line) or to a .csv file (needle, match, rank, ratio per row)
+    """
+
+    def __init__(self, output_file, path):
+        self.__output_file = output_file
+        self.__csv_writer = None
+        if path.endswith('.csv'):
+            self.__csv_writer = csv.writer(output_file)
+            self.__csv_writer.writerow(['needle', 'match', 'rank', 'ratio'])
+
+    def write(self, results):
+        for needle_id, matches in results:
+            if self.__csv_writer is not None:
+                for rank, (element_id, total_ratio) in enumerate(matches):
+                    self.__csv_writer.writerow([needle_id, element_id, rank + 1, total_ratio])
+            else:
+                self.__output_file.write(json.dumps({
+                    'needle': needle_id,
+                    'matches': [{'id': element_id, 'ratio': total_ratio} for element_id, total_ratio in matches],
+                }) + '\n')
+
+        self.__output_file.flush()
+
+
+def run(loader, needles_path, hayloft_path, output_path, needle_id_field=None, hayloft_id_field=None, top_k=10,
+        needle_chunksize=500, hayloft_chunksize=5000, processes=None, progress=sys.stderr):
+    """
+    Match needles_path against hayloft_path and write the top_k matches of each needle to output_path.
+    Return the number of needles matched.
+    """
+    processes = processes or cpu_count()
+    needle_chunks = read_chunks(needles_path, loader, needle_id_field, needle_chunksize)
+    start = time.time()
+    needles = pairs = 0
+
+    with open(output_path, 'w') as output_file:
+        writer = MatchesWriter(output_file, output_path)
+
+        def write(chunk_results):
+            results, chunk_pairs = chunk_results
+            writer.write(results)
+            return len(results), chunk_pairs
+
+        def report():
+            if progress is not None:
+                elapsed = max(time.time() - start, 1e-6)
+                progress.write('%i needles, %i pairs scored, %.0f pairs/s, %.1f s\n' %
+                               (needles, pairs, pairs / elapsed, elapsed))
+                progress.flush()
+
+        if processes == 1:
+            batch_matcher = BatchMatcher(loader, hayloft_path, hayloft_id_field, hayloft_chunksize, top_k)
+            for needle_chunk in needle_chunks:
+                chunk_needles, chunk_pairs = write(batch_matcher.match_needle_chunk(needle_chunk))
+                needles, pairs = needles + chunk_needles, pairs + chunk_pairs
+                report()
+        else:
+            pool = Pool(processes, initializer=_init_worker,
+                        initargs=(loader.get_description, hayloft_path, hayloft_id_field, hayloft_chunksize, top_k))
+            try:
+                #a bounded window of chunks in flight keeps the memory bounded, results are written in needles order
+                pending = deque()
+                for needle_chunk in needle_chunks:
+                    pending.append(pool.apply_async(_match_needle_chunk, (needle_chunk,)))
+                    if len(pending) >= 2 * processes:
+                        chunk_needles, chunk_pairs = write(pending.popleft().get())
+                        needles, pairs = needles + chunk_needles, pairs + chunk_pairs
+                        report()
+                while pending:
+                    chunk_needles, chunk_pairs = write(pending.popleft().get())
+                    needles, pairs = needles + chunk_needles, pairs + chunk_pairs
+                    report()
+            finally:
+                pool.close()
+                pool.join()
+
+    return needles
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Match a needles file against a hayloft file (.csv or .jsonl).')
+    parser.add_argument('--configuration', required=True, help='JSON or YAML matcher configuration')
+    parser.add_argument('--needles', required=True)
+    parser.add_argument('--hayloft', required=True)
+    parser.add_argument('--output', required=True, help='.jsonl or .csv output file')
+    parser.add_argument('--needle-id', default=None, help='needles id column, row number by default')
+    parser.add_argument('--hayloft-id', default=None, help='hayloft id column, row number by default')
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--needle-chunksize', type=int, default=500)
+    parser.add_argument('--hayloft-chunksize', type=int, default=5000)
+    parser.add_argument('--processes', type=int, default=None, help='all cores by default')
+    args = parser.parse_args(argv)
+
+    run(MatcherConfigurationLoader.from_file(args.configuration), args.needles, args.hayloft, args.output,
+        needle_id_field=args.needle_id, hayloft_id_field=args.hayloft_id, top_k=args.top_k,
+        needle_chunksize=args.needle_chunksize, hayloft_chunksize=args.hayloft_chunksize, processes=args.processes)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
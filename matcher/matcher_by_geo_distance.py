@@ -1,12 +1,59 @@
-from haversine import haversine
-from geopy.point import Point
-from geopy import distance
+import threading
+import weakref
+from collections import OrderedDict
+from math import asin, cos, degrees, radians, sin, sqrt
 
+from matcher.backends import DEFAULT_GEO_DISTANCE_IMPLEMENTOR, GEO_DISTANCE_IMPLEMENTORS, LazyModule, \
+    is_numpy_array
 from matcher.matcher_type import MatcherType
 
 
 EARTH_DIAMETER = 12715.43
 
+#backends imported on the first distance
+haversine = LazyModule('haversine')
+geopy_point = LazyModule('geopy.point')
+numpy = LazyModule('numpy')
+distance = LazyModule('geopy.distance')
+
+#Earth radius of the installed haversine library, calculated on the first use
+_haversine_earth_radius = None
+
+#coordinate arrays whose trig terms GeoDistanceByHaversine keeps between searches
+POINTS_TERMS_CACHE_SIZE = 8
+
+
+def get_haversine_earth_radius():
+    """
+    Return the Earth radius of the installed haversine library (it has changed between versions)
+    """
+    global _haversine_earth_radius
+    if _haversine_earth_radius is None:
+        _haversine_earth_radius = haversine.haversine((0, 0), (0, 1)) / radians(1)
+    return _haversine_earth_radius
+
+
+def get_bounding_box(point, distance, margin=0.01):
+    """
+    Return the (lat_min, lat_max, lng_min, lng_max) box in degrees of the points within distance km of point, a
+    (lat, lng) tuple. The box is enlarged by margin (1% by default) and uses the smallest Earth radius, so it also
+    contains the points within distance by Vincenty or Great-circle distances. The longitudes are not bounded when the
+    circle contains a pole or crosses the antimeridian.
+    """
+    angle = distance * (1 + margin) / (EARTH_DIAMETER / 2)
+    lat = radians(point[0])
+    lat_min = degrees(lat - angle)
+    lat_max = degrees(lat + angle)
+
+    if lat_max >= 90 or lat_min <= -90 or sin(angle) >= cos(lat):
+        return lat_min, lat_max, float('-inf'), float('inf')
+
+    delta_lng = degrees(asin(sin(angle) / cos(lat)))
+    if point[1] - delta_lng < -180 or point[1] + delta_lng > 180:
+        return lat_min, lat_max, float('-inf'), float('inf')
+    return lat_min, lat_max, point[1] - delta_lng, point[1] + delta_lng
+
+
 class GeoDistanceCalculatorAbstraction(object):
 
     def calculate_distance(self):
@@ -18,6 +65,22 @@ class GeoDistanceImplementorAPI(object):
     def calculate_distance_between_points(self, point_a, point_b):
         pass
 
+    def calculate_distances_from_point(self, point_a, points_b):
+        """
+        Return the distances from point_a to each point of points_b, an (N, 2) array or a list of tuples
+        Implementors able to calculate all distances at once override this method.
+        """
+        return [self.calculate_distance_between_points(point_a, tuple(point_b)) for point_b in points_b]
+
+    def prepare_distance_from_point(self, point_a):
+        """
+        Return a function of point_b with the distance from point_a, to calculate the distances of all the points of a
+        search from the same needle point. Implementors with work that only depends on point_a override this method
+        to do it once per search.
+        """
+        calculate_distance_between_points = self.calculate_distance_between_points
+        return lambda point_b: calculate_distance_between_points(point_a, point_b)
+
 
 #######################################################################################################################
 #       Concrete Implementors for Geo Distance                                                                        #
@@ -30,18 +93,100 @@ class GeoDistanceByHaversine(GeoDistanceImplementorAPI):
     point_a and point_b must be tuples
 
     return distance in km
+
+    The radians and cosines of the (N, 2) arrays of calculate_distances_from_point are kept for the next searches (for
+    the POINTS_TERMS_CACHE_SIZE last arrays while they exist), so those arrays must not be modified in place, as the
+    geo columns of a ColumnarHayloft. The cache is thread safe, as the shared instance of the registry is used by every
+    thread.
     """
 
+    def __init__(self):
+        self.__points_terms = OrderedDict()
+        #reentrant: the callback of a weak reference can run in any code of the thread holding it
+        self.__points_terms_lock = threading.RLock()
+
     def calculate_distance_between_points(self, point_a, point_b):
 
         if isinstance(point_a, tuple) and isinstance(point_b, tuple):
             try:
-                return haversine(point_a, point_b)
+                return haversine.haversine(point_a, point_b)
             except Exception as e:
                 raise e
         else:
             raise TypeError
 
+    def calculate_distances_from_point(self, point_a, points_b):
+        """
+        Haversine formula of the haversine library vectorized with NumPy for an (N, 2) array of points_b
+        """
+        if is_numpy_array(points_b):
+            lat_a, lng_a = radians(point_a[0]), radians(point_a[1])
+            lat_b, lng_b, cos_lat_b = self.__get_points_terms(points_b)
+
+            d = (numpy.sin((lat_b - lat_a) * 0.5) ** 2 +
+                 cos(lat_a) * cos_lat_b * numpy.sin((lng_b - lng_a) * 0.5) ** 2)
+            return 2 * get_haversine_earth_radius() * numpy.arcsin(numpy.sqrt(d))
+        else:
+            return super(GeoDistanceByHaversine, self).calculate_distances_from_point(point_a, points_b)
+
+    def __get_points_terms(self, points):
+        """
+        Return the latitude and longitude radians and the latitude cosines of an (N, 2) array of points
+        """
+        key = id(points)
+        with self.__points_terms_lock:
+            entry = self.__points_terms.get(key)
+        if entry is not None and entry[0]() is points:
+            return entry[1]
+
+        lat = numpy.radians(points[:, 0])
+        terms = (lat, numpy.radians(points[:, 1]), numpy.cos(lat))
+        try:
+            reference = weakref.ref(points, lambda reference: self.__forget_points_terms(key, reference))
+        except TypeError:
+            #arrays views of other objects may not be referenced
+            return terms
+
+        with self.__points_terms_lock:
+            self.__points_terms[key] = (reference, terms)
+            while len(self.__points_terms) > POINTS_TERMS_CACHE_SIZE:
+                self.__points_terms.popitem(last=False)
+        return terms
+
+    def __forget_points_terms(self, key, reference):
+        """
+        Remove the terms of a freed array, unless its id has been reused by a newer array
+        """
+        with self.__points_terms_lock:
+            entry = self.__points_terms.get(key)
+            if entry is not None and entry[0] is reference:
+                del self.__points_terms[key]
+
+    def prepare_distance_from_point(self, point_a):
+        """
+        The radians and cosine of point_a are calculated once, the haversine formula of the haversine library for each
+        point_b
+        """
+        if not (isinstance(point_a, tuple) and -90 <= point_a[0] <= 90 and -180 <= point_a[1] <= 180):
+            #the haversine library raises its errors
+            return super(GeoDistanceByHaversine, self).prepare_distance_from_point(point_a)
+
+        lat_a, lng_a = radians(point_a[0]), radians(point_a[1])
+        cos_lat_a = cos(lat_a)
+        earth_radius = get_haversine_earth_radius()
+        calculate_distance_between_points = self.calculate_distance_between_points
+
+        def distance_from_point(point_b):
+            if not (isinstance(point_b, tuple) and -90 <= point_b[0] <= 90 and -180 <= point_b[1] <= 180):
+                return calculate_distance_between_points(point_a, point_b)
+
+            lat_b = radians(point_b[0])
+            d = (sin((lat_b - lat_a) * 0.5) ** 2 +
+                 cos_lat_a * cos(lat_b) * sin((radians(point_b[1]) - lng_a) * 0.5) ** 2)
+            return earth_radius * (2 * asin(sqrt(d)))
+
+        return distance_from_point
+
 
 class GeoDistanceByGreatCircle(GeoDistanceImplementorAPI):
     """
@@ -56,19 +201,30 @@ class GeoDistanceByGreatCircle(GeoDistanceImplementorAPI):
     def calculate_distance_between_points(self, point_a, point_b):
 
         if isinstance(point_a, tuple):
-            point_a = Point(str(point_a[0]) + ";" + str(point_a[1]))
+            point_a = geopy_point.Point(str(point_a[0]) + ";" + str(point_a[1]))
 
         if isinstance(point_b, tuple):
-            point_b = Point(str(point_b[0]) + ";" + str(point_b[1]))
+            point_b = geopy_point.Point(str(point_b[0]) + ";" + str(point_b[1]))
 
-        if isinstance(point_a, Point) and isinstance(point_b, Point):
+        if isinstance(point_a, geopy_point.Point) and isinstance(point_b, geopy_point.Point):
 
-            distance.distance = distance.GreatCircleDistance
-            return distance.distance(point_a, point_b).km
+            return distance.GreatCircleDistance(point_a, point_b).km
 
         else:
             raise TypeError
 
+    def prepare_distance_from_point(self, point_a):
+        """
+        The geopy Point of point_a is built once
+        """
+        if isinstance(point_a, tuple):
+            try:
+                point_a = geopy_point.Point(str(point_a[0]) + ";" + str(point_a[1]))
+            except ValueError:
+                #raised by each distance, as without preparing
+                pass
+        return super(GeoDistanceByGreatCircle, self).prepare_distance_from_point(point_a)
+
 
 class GeoDistanceByVincenty(GeoDistanceImplementorAPI):
     """
@@ -83,18 +239,30 @@ class GeoDistanceByVincenty(GeoDistanceImplementorAPI):
     def calculate_distance_between_points(self, point_a, point_b):
 
         if isinstance(point_a, tuple):
-            point_a = Point(str(point_a[0]) + ";" + str(point_a[1]))
+            point_a = geopy_point.Point(str(point_a[0]) + ";" + str(point_a[1]))
 
         if isinstance(point_b, tuple):
-            point_b = Point(str(point_b[0]) + ";" + str(point_b[1]))
+            point_b = geopy_point.Point(str(point_b[0]) + ";" + str(point_b[1]))
 
-        if isinstance(point_a, Point) and isinstance(point_b, Point):
+        if isinstance(point_a, geopy_point.Point) and isinstance(point_b, geopy_point.Point):
 
             return distance.distance(point_a, point_b).km
 
         else:
             raise TypeError
 
+    def prepare_distance_from_point(self, point_a):
+        """
+        The geopy Point of point_a is built once
+        """
+        if isinstance(point_a, tuple):
+            try:
+                point_a = geopy_point.Point(str(point_a[0]) + ";" + str(point_a[1]))
+            except ValueError:
+                #raised by each distance, as without preparing
+                pass
+        return super(GeoDistanceByVincenty, self).prepare_distance_from_point(point_a)
+
 
 #######################################################################################################################
 #       End Concretes Implementors for Geo Distance                                                                   #
@@ -214,6 +382,17 @@ class Radius(object):
             return ((((self.get_min_ratio - self.get_max_ratio) / (self.get_to_distance - self.get_from_distance)) *
                     (distance - self.get_from_distance)) + self.get_max_ratio)
 
+    def balance_ratios_in_radius(self, distances):
+        """
+        balance_ratio_in_radius for a NumPy array of distances
+        """
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            ratios = ((((self.get_min_ratio - self.get_max_ratio) / (self.get_to_distance - self.get_from_distance)) *
+                      (distances - self.get_from_distance)) + self.get_max_ratio)
+
+        ratios = numpy.where(distances == self.get_to_distance, self.get_min_ratio, ratios)
+        return numpy.where(distances == self.get_from_distance, self.get_max_ratio, ratios)
+
 
 class MatcherByGeoDistance(MatcherType):
     """
@@ -228,7 +407,10 @@ class MatcherByGeoDistance(MatcherType):
     __weighted_radiuses = []
     __ratio_farther = 0
 
-    def __init__(self, weighted_radiuses, concrete_implementor=GeoDistanceByVincenty(), ratio_farther=0):
+    def __init__(self, weighted_radiuses, concrete_implementor=None, ratio_farther=0):
+        if concrete_implementor is None:
+            concrete_implementor = GEO_DISTANCE_IMPLEMENTORS.get_instance(DEFAULT_GEO_DISTANCE_IMPLEMENTOR)
+
         if self.__check_raduis(weighted_radiuses) and isinstance(concrete_implementor, GeoDistanceImplementorAPI):
             self.__weighted_radiuses = weighted_radiuses
             self.__concrete_implementor = concrete_implementor
@@ -248,6 +430,13 @@ class MatcherByGeoDistance(MatcherType):
     def get_ratio_farther(self):
         return self.__ratio_farther
 
+    @property
+    def get_max_distance(self):
+        """
+        greatest get_to_distance of the radiuses: farther points always get ratio_farther
+        """
+        return max([radius.get_to_distance for radius in self.__weighted_radiuses] or [0])
+
     def __check_raduis(self, weighted_radiuses):
         """
         check if all elements of weighted_radiuses belongs to the same class Radius
@@ -274,6 +463,23 @@ class MatcherByGeoDistance(MatcherType):
         # ratio = self.__ratio_farther means point_b is far away of greater Radius configured
         return self.get_ratio_farther
 
+    def __calculate_ratios(self, distances):
+        """
+        __calculate_ratio for a NumPy array of distances
+        """
+        ratios = numpy.full(len(distances), float(self.get_ratio_farther))
+        pending = numpy.ones(len(distances), dtype=bool)
+
+        for radius in self.__weighted_radiuses:
+            inside = pending & (radius.get_from_distance <= distances) & (distances <= radius.get_to_distance)
+            if not radius.get_balanced_by_distance:
+                ratios[inside] = radius.get_max_ratio
+            else:
+                ratios[inside] = radius.balance_ratios_in_radius(distances[inside])
+            pending &= ~inside
+
+        return ratios
+
     def get_ratio_match(self, point_a, point_b):
         """
         Return the weight of the radius according to distance from point_a to point_b
@@ -290,3 +496,48 @@ class MatcherByGeoDistance(MatcherType):
         else:
             return self.get_ratio_farther
 
+    def prepare_ratio_match(self, point_a):
+        """
+        get_ratio_match of point_a for a whole search: the distance function of the concrete implementor is prepared
+        once for point_a (see prepare_distance_from_point) and the points out of the bounding box of the greatest
+        radius get ratio_farther after at most two comparisons per coordinate, without calculating their distance.
+        """
+        ratio_farther = self.get_ratio_farther
+        if not (isinstance(point_a, tuple) and len(point_a) > 0):
+            return lambda point_b: ratio_farther
+
+        distance_from_point = self.__concrete_implementor.prepare_distance_from_point(point_a)
+        lat_min, lat_max, lng_min, lng_max = get_bounding_box(point_a, self.get_max_distance)
+        calculate_ratio = self.__calculate_ratio
+
+        def ratio_match(point_b):
+            if not (isinstance(point_b, tuple) and len(point_b) > 0):
+                return ratio_farther
+            #nothing is rejected for a NaN needle, its distances are calculated as without preparing
+            if point_b[0] < lat_min or point_b[0] > lat_max or point_b[1] < lng_min or point_b[1] > lng_max:
+                return ratio_farther
+            return calculate_ratio(distance_from_point(point_b))
+
+        return ratio_match
+
+    def get_ratio_matches(self, point_a, points_b):
+        """
+        Return the ratio matches of point_a with each point of points_b.
+        When points_b is an (N, 2) NumPy array all distances and ratios are calculated at once, rows with NaN
+        (missing points) are ratio_farther.
+        """
+        if is_numpy_array(points_b) and isinstance(point_a, tuple) and len(point_a) > 0:
+
+            valid = numpy.isfinite(points_b).all(axis=1)
+            if valid.all():
+                distances = numpy.asarray(
+                    self.__concrete_implementor.calculate_distances_from_point(point_a, points_b), dtype=float)
+            else:
+                #NaN distances are out of every radius
+                distances = numpy.full(len(points_b), numpy.nan)
+                if valid.any():
+                    distances[valid] = self.__concrete_implementor.calculate_distances_from_point(point_a,
+                                                                                                  points_b[valid])
+            return self.__calculate_ratios(distances)
+        else:
+            return super(MatcherByGeoDistance, self).get_ratio_matches(point_a, points_b)
@@ -1,10 +1,21 @@
-import jellyfish
-
-from fuzzywuzzy import fuzz
+from bisect import bisect_left
+from functools import reduce
 
+from matcher.backends import DEFAULT_TEXT_ALGORITHMS, TEXT_ALGORITHMS, LazyModule
+from matcher.edit_distance import bounded_hamming_distance, bounded_levenshtein_distance
 from matcher.matcher_type import MatcherType
 from matcher.stringslipper import score
 
+try:
+    unicode
+except NameError:
+    #Python 3: every str is unicode
+    unicode = str
+
+#backends imported on the first comparison
+jellyfish = LazyModule('jellyfish')
+fuzz = LazyModule('fuzzywuzzy.fuzz')
+
 
 class MatchAlgorithm(object):
     """
@@ -14,6 +25,21 @@ class MatchAlgorithm(object):
     def compare_two_texts(self, string_a, string_b, normalize_value=True):
         pass
 
+    def get_length_upper_bound(self, length_a, length_b):
+        """
+        Return the maximum normalized value compare_two_texts can return for two strings of length_a and length_b
+        characters. It is cheap, so it can be used to skip the comparison of strings decided by its lengths.
+        None means the algorithm has no bound based on lengths.
+        """
+        return None
+
+    def compare_two_texts_bounded(self, string_a, string_b, min_value):
+        """
+        Return the normalized value of compare_two_texts when it is greater than min_value, otherwise any value not
+        greater than min_value. Algorithms able to stop early when the value can not exceed min_value override it.
+        """
+        return self.compare_two_texts(string_a, string_b)
+
 
 class MatchBySimpleRatio(MatchAlgorithm):
     """
@@ -26,6 +52,15 @@ class MatchBySimpleRatio(MatchAlgorithm):
     def __normalized_value(self, value):
         return float(value) / 100
 
+    def get_length_upper_bound(self, length_a, length_b):
+        """
+        Simple Ratio is 2 * M / T, where M is the number of matching characters (at most the shorter length)
+        and T the total number of characters
+        """
+        if length_a + length_b == 0:
+            return 1
+        return self.__normalized_value(int(round(100 * 2.0 * min(length_a, length_b) / (length_a + length_b))))
+
     def compare_two_texts(self, string_a, string_b, normalize_value=True):
         """
         Compare two string and return the value of Simple Ratio algorithm
@@ -151,6 +186,16 @@ class MatchByJaroDistance(MatchAlgorithm):
     0 means means the worst similarity
     """
 
+    def get_length_upper_bound(self, length_a, length_b):
+        """
+        Jaro distance is (m / |a| + m / |b| + (m - t) / m) / 3, where m is the number of matching characters (at most
+        the shorter length)
+        """
+        if length_a == 0 or length_b == 0:
+            return 1
+        shorter = float(min(length_a, length_b))
+        return (shorter / length_a + shorter / length_b + 1) / 3
+
     def compare_two_texts(self, string_a, string_b):
         """
         Compare two string and return the value of Jaro algorithm
@@ -163,6 +208,32 @@ class MatchByJaroDistance(MatchAlgorithm):
             raise TypeError
 
 
+def normalize_edit_distance(value):
+    """
+    Normalized value of an edit distance: 1 for 0, from 0.9 to 0.1 for 1 to 9, from 0.09 to 0.001 for 10 to 99 and
+    0 from 100 on
+    """
+    if value == 0: return 1
+    elif value > 0 and value < 10: return 1 - (float(value) / 10)
+    elif value >= 10 and value <= 99: return (1 - (float(value) / (10*10))) / 10
+    else: return 0
+
+
+#greater distance with a normalized value greater than 0, the cutoff of the exact normalized value
+EDIT_DISTANCE_CUTOFF = 99
+
+#normalized values of the distances 0..EDIT_DISTANCE_CUTOFF negated, so they are ascending for bisect
+_negated_edit_distance_values = [-normalize_edit_distance(value) for value in range(EDIT_DISTANCE_CUTOFF + 1)]
+
+
+def get_edit_distance_cutoff(min_value):
+    """
+    Return the greater edit distance whose normalized value is greater than min_value (-1 if there is none), the
+    cutoff of a bounded edit distance when only values greater than min_value matter
+    """
+    return bisect_left(_negated_edit_distance_values, -min_value) - 1
+
+
 class MatchByLevenshteinDistance(MatchAlgorithm):
     """
     Class to compare strings by Levenshtein Distance algorithm http://en.wikipedia.org/wiki/Levenshtein_distance
@@ -173,10 +244,24 @@ class MatchByLevenshteinDistance(MatchAlgorithm):
     """
 
     def __normalized_value(self, value):
-        if value == 0: return 1
-        elif value > 0 and value < 10: return 1 - (float(value) / 10)
-        elif value >= 10 and value <= 99: return (1 - (float(value) / (10*10))) / 10
-        else: return 0
+        return normalize_edit_distance(value)
+
+    def get_length_upper_bound(self, length_a, length_b):
+        """
+        Levenshtein distance is at least the difference of lengths
+        """
+        return self.__normalized_value(abs(length_a - length_b))
+
+    def compare_two_texts_bounded(self, string_a, string_b, min_value):
+        """
+        The distance is only calculated up to the greater distance whose normalized value is greater than min_value
+        """
+        if ((isinstance(string_a, unicode) and isinstance(string_b, unicode)) or
+                (isinstance(string_a, str) and isinstance(string_b, str))):
+            return self.__normalized_value(bounded_levenshtein_distance(string_a, string_b,
+                                                                        get_edit_distance_cutoff(min_value)))
+        else:
+            raise TypeError
 
     def compare_two_texts(self, string_a, string_b, normalize_value=True):
         """
@@ -186,7 +271,8 @@ class MatchByLevenshteinDistance(MatchAlgorithm):
         if ((isinstance(string_a, unicode) and isinstance(string_b, unicode)) or
                 (isinstance(string_a, str) and isinstance(string_b, str))):
             if normalize_value:
-                return self.__normalized_value(jellyfish.levenshtein_distance(string_a, string_b))
+                #distances greater than EDIT_DISTANCE_CUTOFF are all normalized to 0
+                return self.__normalized_value(bounded_levenshtein_distance(string_a, string_b, EDIT_DISTANCE_CUTOFF))
             else:
                 return jellyfish.levenshtein_distance(string_a, string_b)
         else:
@@ -203,10 +289,24 @@ class MatchByHammingDistance(MatchAlgorithm):
     """
 
     def __normalized_value(self, value):
-        if value == 0: return 1
-        elif value > 0 and value < 10: return 1 - (float(value) / 10)
-        elif value >= 10 and value <= 99: return (1 - (float(value) / (10*10))) / 10
-        else: return 0
+        return normalize_edit_distance(value)
+
+    def get_length_upper_bound(self, length_a, length_b):
+        """
+        Hamming distance is at least the difference of lengths
+        """
+        return self.__normalized_value(abs(length_a - length_b))
+
+    def compare_two_texts_bounded(self, string_a, string_b, min_value):
+        """
+        The distance is only calculated up to the greater distance whose normalized value is greater than min_value
+        """
+        if ((isinstance(string_a, unicode) and isinstance(string_b, unicode)) or
+                (isinstance(string_a, str) and isinstance(string_b, str))):
+            return self.__normalized_value(bounded_hamming_distance(string_a, string_b,
+                                                                    get_edit_distance_cutoff(min_value)))
+        else:
+            raise TypeError
 
     def compare_two_texts(self, string_a, string_b, normalize_value=True):
         """
@@ -216,7 +316,8 @@ class MatchByHammingDistance(MatchAlgorithm):
         if ((isinstance(string_a, unicode) and isinstance(string_b, unicode)) or
                 (isinstance(string_a, str) and isinstance(string_b, str))):
             if normalize_value:
-                return self.__normalized_value(jellyfish.hamming_distance(string_a, string_b))
+                #distances greater than EDIT_DISTANCE_CUTOFF are all normalized to 0
+                return self.__normalized_value(bounded_hamming_distance(string_a, string_b, EDIT_DISTANCE_CUTOFF))
             else:
                 return jellyfish.hamming_distance(string_a, string_b)
         else:
@@ -236,10 +337,9 @@ class MatcherByText(MatcherType):
     __mode = 2  # 0 = worse case ; 1 = average ; 2 = better case. Of all algorithms executed for get_matches catch
     the value indicated by the mode attribute.
 
-    __default_algorithms = [MatchBySimpleRatio(), MatchByPartialRatio(), MatchByTokenSortRatio(),
-                            MatchByTokenSetRatio(), MatchByStringScore(), MatchByJaroDistance(),
-                            MatchByLevenshteinDistance(), MatchByHammingDistance(),
-                            ]
+    Without algorithms it uses the algorithms named in DEFAULT_TEXT_ALGORITHMS (Simple Ratio, Partial Ratio,
+    Token Sort Ratio, Token Set Ratio, String Score, Jaro, Levenshtein and Hamming), instances of the TEXT_ALGORITHMS
+    registry shared by every MatcherByText.
     each algorithm must be a MatchAlgorithm instance
     """
 
@@ -249,10 +349,7 @@ class MatcherByText(MatcherType):
         if algorithms and self.__check_algorithms(algorithms):
             self.__algorithms = algorithms
         else:
-            self.__algorithms = [MatchBySimpleRatio(), MatchByPartialRatio(), MatchByTokenSortRatio(),
-                                 MatchByTokenSetRatio(), MatchByStringScore(), MatchByJaroDistance(),
-                                 MatchByLevenshteinDistance(), MatchByHammingDistance(),
-            ]
+            self.__algorithms = [TEXT_ALGORITHMS.get_instance(name) for name in DEFAULT_TEXT_ALGORITHMS]
 
     @property
     def get_mode(self):
@@ -280,6 +377,79 @@ class MatcherByText(MatcherType):
         """
         return max(list)
 
+    def __calculate_better_case_bounded(self, string_a, string_b):
+        """
+        Return the max of the algorithms results without executing the algorithms whose length upper bound is not
+        greater than the best result already calculated. The result is the same as __calculate_better_case.
+        """
+        length_a, length_b = len(string_a), len(string_b)
+        bounded_algorithms = []
+        for position, algorithm in enumerate(self.__algorithms):
+            upper_bound = algorithm.get_length_upper_bound(length_a, length_b)
+            bounded_algorithms.append((float('inf') if upper_bound is None else upper_bound, position, algorithm))
+        #algorithms without bound first, then from the greater bound to the lower
+        bounded_algorithms.sort(key=lambda x: (-x[0], x[1]))
+
+        best = None
+        for upper_bound, position, algorithm in bounded_algorithms:
+            if best is not None and upper_bound <= best:
+                #the rest of algorithms can not improve the best result
+                break
+            if best is None:
+                result = algorithm.compare_two_texts(string_a, string_b)
+            else:
+                #only a result greater than best matters
+                result = algorithm.compare_two_texts_bounded(string_a, string_b, best)
+            if best is None or result > best:
+                best = result
+
+        return best
+
+    def get_length_upper_bound(self, length_a, length_b):
+        """
+        Return the maximum ratio get_ratio_match can return for two strings of length_a and length_b characters,
+        the value indicated by the mode of the length upper bounds of all algorithms.
+        None means there is no bound based on lengths.
+        """
+        bounds = [algorithm.get_length_upper_bound(length_a, length_b) for algorithm in self.__algorithms]
+
+        if self.__mode == 0:
+            #the worse case is not greater than any bounded result
+            bounds = [bound for bound in bounds if bound is not None]
+            return self.__calculate_worse_case(bounds) if bounds else None
+        elif None in bounds: return None
+        elif self.__mode ==1: return self.__calculate_average(bounds)
+        else: return self.__calculate_better_case(bounds)
+
+    def get_max_edit_distance(self, min_ratio):
+        """
+        Return the greater Levenshtein distance of two strings whose ratio can be greater or equal than min_ratio, or
+        None when the ratio of the mode is not bounded by the Levenshtein distance.
+
+        Hamming distance is never lower than Levenshtein distance, so the normalized values of both algorithms are
+        bounded by the normalized Levenshtein distance, and the rest of algorithms by 1.
+        """
+        edit_algorithms = len([algorithm for algorithm in self.__algorithms
+                               if isinstance(algorithm, (MatchByLevenshteinDistance, MatchByHammingDistance))])
+        other_algorithms = len(self.__algorithms) - edit_algorithms
+        if not edit_algorithms:
+            return None
+
+        if self.__mode == 0:
+            min_value = min_ratio
+        elif self.__mode == 1:
+            min_value = (len(self.__algorithms) * min_ratio - other_algorithms) / float(edit_algorithms)
+        elif other_algorithms:
+            return None
+        else:
+            min_value = min_ratio
+
+        if min_value <= 0:
+            #distances of 100 or more are normalized to 0
+            return None
+        #a normalized value greater or equal than min_value, with a small tolerance for float rounding
+        return get_edit_distance_cutoff(min_value - 1e-9)
+
     def __check_algorithms(self, algorithms):
         """
         check if all elements of algorithms belongs to the same class MatchAlgorithm
@@ -310,6 +480,9 @@ class MatcherByText(MatcherType):
 
         if len(string_a) > 0 and len(string_b) > 0:
 
+            if self.__mode != 0 and self.__mode != 1:
+                return self.__calculate_better_case_bounded(string_a, string_b)
+
             results = []
             for algorithm in self.__algorithms:
                 results.append(algorithm.compare_two_texts(string_a, string_b))
@@ -0,0 +1,216 @@
+import hashlib
+from math import log, sqrt
+
+try:
+    import numpy
+    from scipy import sparse
+except ImportError:
+    numpy = sparse = None
+
+from matcher.matcher_by_text import MatchAlgorithm, unicode
+
+
+#ratios are rounded so the float rounding of the sparse product and the pairwise comparison do not differ
+RATIO_DECIMALS = 12
+
+
+class MatchByTfidfCosine(MatchAlgorithm):
+    """
+    Class to compare strings by the cosine similarity of their TF-IDF vectors of character n-grams.
+    Return a value normalized between 0 and 1
+    1 means a perfect similarity
+    0 means means the worst similarity
+
+    The IDF weights are fitted over the values of a hayloft field with fit, and the fitted values are kept as an
+    L2-normalized sparse matrix (NumPy and SciPy are needed to fit), so a needle, or a batch of needles, is scored
+    against all of them with one sparse matrix product (get_ratios, get_top_matches). N-grams out of the fitted
+    vocabulary weight as the rarest n-gram. Without fit every n-gram weights the same.
+
+    Texts are lowercased and padded with a space at both sides, so the first and last characters make their own
+    n-grams.
+    """
+
+    def __init__(self, n=3):
+        if n < 1:
+            raise ValueError('n must be greater than 0')
+
+        self.__n = n
+        self.__vocabulary = {}
+        self.__idf = None
+        self.__missing_idf = 1.0
+        self.__matrix = None
+        self.__fitting_fingerprint = None
+
+    @property
+    def get_n(self):
+        return self.__n
+
+    @property
+    def get_vocabulary_size(self):
+        return len(self.__vocabulary)
+
+    @property
+    def get_fitting_fingerprint(self):
+        """
+        Stable hash (hex) of the fitted vocabulary and IDF weights, None without fit
+        """
+        return self.__fitting_fingerprint
+
+    @property
+    def get_fitted_size(self):
+        return 0 if self.__matrix is None else self.__matrix.shape[0]
+
+    def get_ngrams(self, text):
+        """
+        Return the dict of character n-gram -> count of text
+        """
+        text = ' %s ' % text.lower()
+        n = self.__n
+        if len(text) <= n:
+            return {text: 1}
+
+        ngrams = {}
+        for i in range(len(text) - n + 1):
+            ngram = text[i:i + n]
+            ngrams[ngram] = ngrams.get(ngram, 0) + 1
+        return ngrams
+
+    def fit(self, texts):
+        """
+        Fit the vocabulary and the IDF weights (smoothed: log((1 + N) / (1 + df)) + 1) over texts, a hayloft column,
+        and keep texts as a sparse matrix for get_ratios and get_top_matches. Return self.
+        """
+        if sparse is None:
+            raise ImportError('NumPy and SciPy are needed to fit MatchByTfidfCosine')
+
+        vocabulary = {}
+        document_frequency = []
+        indptr = [0]
+        indices = []
+        counts = []
+        for text in texts:
+            for ngram, count in self.get_ngrams(text).items():
+                column = vocabulary.get(ngram)
+                if column is None:
+                    column = vocabulary[ngram] = len(vocabulary)
+                    document_frequency.append(0)
+                document_frequency[column] += 1
+                indices.append(column)
+                counts.append(count)
+            indptr.append(len(indices))
+
+        size = len(indptr) - 1
+        self.__vocabulary = vocabulary
+        self.__idf = numpy.log((1.0 + size) / (1.0 + numpy.asarray(document_frequency, dtype=float))) + 1
+        self.__missing_idf = log(1.0 + size) + 1
+
+        matrix = sparse.csr_matrix((numpy.asarray(counts, dtype=float), numpy.asarray(indices, dtype=numpy.int64),
+                                    numpy.asarray(indptr, dtype=numpy.int64)), shape=(size, len(vocabulary)))
+        self.__matrix = self.__normalize_rows(matrix.multiply(self.__idf.reshape(1, -1)).tocsr())
+
+        fingerprint = hashlib.sha1(repr((size, sorted(vocabulary.items()))).encode('utf-8'))
+        fingerprint.update(self.__idf.tobytes())
+        self.__fitting_fingerprint = fingerprint.hexdigest()
+        return self
+
+    def __normalize_rows(self, matrix, norms=None):
+        if norms is None:
+            norms = numpy.sqrt(numpy.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return sparse.diags(1.0 / norms).dot(matrix).tocsr()
+
+    def __get_weights(self, text):
+        """
+        Return the dict of n-gram -> TF-IDF weight of text
+        """
+        vocabulary = self.__vocabulary
+        idf = self.__idf
+        weights = {}
+        for ngram, count in self.get_ngrams(text).items():
+            column = vocabulary.get(ngram)
+            if idf is None:
+                weights[ngram] = float(count)
+            else:
+                weights[ngram] = count * (idf[column] if column is not None else self.__missing_idf)
+        return weights
+
+    def transform(self, texts):
+        """
+        Return the L2-normalized sparse matrix of TF-IDF vectors of texts over the fitted vocabulary. N-grams out of
+        the vocabulary are not columns of the matrix but they count in the norm of each row.
+        """
+        if self.__matrix is None:
+            raise ValueError('MatchByTfidfCosine must be fitted')
+
+        vocabulary = self.__vocabulary
+        indptr = [0]
+        indices = []
+        data = []
+        norms = []
+        for text in texts:
+            norm = 0
+            for ngram, weight in self.__get_weights(text).items():
+                norm += weight * weight
+                column = vocabulary.get(ngram)
+                if column is not None:
+                    indices.append(column)
+                    data.append(weight)
+            indptr.append(len(indices))
+            norms.append(sqrt(norm))
+
+        matrix = sparse.csr_matrix((numpy.asarray(data, dtype=float), numpy.asarray(indices, dtype=numpy.int64),
+                                    numpy.asarray(indptr, dtype=numpy.int64)),
+                                   shape=(len(indptr) - 1, len(vocabulary)))
+        return self.__normalize_rows(matrix, numpy.asarray(norms, dtype=float))
+
+    def get_ratios(self, texts):
+        """
+        Return the sparse matrix (len(texts) x fitted texts) of the ratios of each text of texts with each fitted
+        text, with one sparse matrix product. Missing entries are 0.
+        """
+        ratios = self.transform(texts).dot(self.__matrix.T).tocsr()
+        #float rounding, identical vectors are 1
+        numpy.minimum(numpy.round(ratios.data, RATIO_DECIMALS), 1.0, out=ratios.data)
+        return ratios
+
+    def get_top_matches(self, texts, top_k, min_ratio=0):
+        """
+        Return for each text of texts the list of its top_k (fitted position, ratio) with ratio greater than
+        min_ratio, from the greater ratio and by position between equal ratios
+        """
+        ratios = self.get_ratios(texts)
+        top_matches = []
+        for row in range(ratios.shape[0]):
+            start, end = ratios.indptr[row], ratios.indptr[row + 1]
+            data = ratios.data[start:end]
+            positions = ratios.indices[start:end]
+            selected = numpy.nonzero(data > min_ratio)[0]
+            if len(selected) > top_k:
+                selected = selected[numpy.argpartition(-data[selected], top_k - 1)[:top_k]]
+                #the ratio of the last one may be shared with elements not selected, keep all of them for the order
+                selected = numpy.nonzero(data >= data[selected].min())[0]
+            order = numpy.lexsort((positions[selected], -data[selected]))[:top_k]
+            top_matches.append([(int(positions[selected[i]]), float(data[selected[i]])) for i in order])
+
+        return top_matches
+
+    def compare_two_texts(self, string_a, string_b):
+        """
+        Compare two string and return the cosine similarity of their TF-IDF vectors
+        the value is normalized between 0 and 1 values.
+        """
+        if ((isinstance(string_a, unicode) and isinstance(string_b, unicode)) or
+                (isinstance(string_a, str) and isinstance(string_b, str))):
+            weights_a = self.__get_weights(string_a)
+            weights_b = self.__get_weights(string_b)
+            if len(weights_a) > len(weights_b):
+                weights_a, weights_b = weights_b, weights_a
+
+            product = sum(weight * weights_b.get(ngram, 0) for ngram, weight in weights_a.items())
+            norm_a = sqrt(sum(weight * weight for weight in weights_a.values()))
+            norm_b = sqrt(sum(weight * weight for weight in weights_b.values()))
+            if product == 0:
+                return 0.0
+            return min(1.0, round(product / (norm_a * norm_b), RATIO_DECIMALS))
+        else:
+            raise TypeError
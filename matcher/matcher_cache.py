@@ -0,0 +1,217 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.db.models import Max
+
+from matcher.matcher import Match, MatchResult
+from matcher.matcher_by_geo_distance import MatcherByGeoDistance
+from matcher.matcher_by_text import MatcherByText
+from matcher.related_fields import get_field_getter
+
+
+def get_class_path(obj):
+    return '%s.%s' % (obj.__class__.__module__, obj.__class__.__name__)
+
+
+def describe_algorithm(algorithm):
+    """
+    Return a description of a MatchAlgorithm: its class, and the n-gram size and fitting of fitted algorithms
+    (MatchByTfidfCosine), which change its ratios
+    """
+    if hasattr(algorithm, 'get_fitting_fingerprint'):
+        return (get_class_path(algorithm), algorithm.get_n, algorithm.get_fitting_fingerprint)
+    return (get_class_path(algorithm),)
+
+
+def describe_matcher_type(matcher_type):
+    """
+    Return a description of a MatcherType with everything that changes its ratios: mode and algorithms of a
+    MatcherByText, implementor, ratio_farther and radiuses of a MatcherByGeoDistance, the class of any other one.
+    """
+    if isinstance(matcher_type, MatcherByText):
+        return (get_class_path(matcher_type), matcher_type.get_mode,
+                tuple(describe_algorithm(algorithm) for algorithm in matcher_type.get_algorithms))
+
+    elif isinstance(matcher_type, MatcherByGeoDistance):
+        return (get_class_path(matcher_type), get_class_path(matcher_type.get_concrete_implementor),
+                float(matcher_type.get_ratio_farther),
+                tuple((radius.get_from_distance, radius.get_to_distance, radius.get_max_ratio, radius.get_min_ratio,
+                       bool(radius.get_balanced_by_distance)) for radius in matcher_type.get_weighted_radiuses))
+
+    return (get_class_path(matcher_type),)
+
+
+def get_configuration_fingerprint(configured_matcher):
+    """
+    Return a stable hash (hex) of the threshold, the class check and each MatcherFieldConfiguration (field, weight and
+    matcher type description) of a ConfiguredMatcher
+    """
+    description = (float(configured_matcher.get_threshold), bool(configured_matcher.get_check_classes),
+                   tuple((config.get_field, float(config.get_weight), float(config.get_max_weight),
+                          describe_matcher_type(config.get_matcher_type))
+                         for config in configured_matcher.get_matcher_configuration))
+    return hashlib.sha1(repr(description).encode('utf-8')).hexdigest()
+
+
+def get_needle_fingerprint(needle, configured_matcher):
+    """
+    Return a stable hash (hex) of the configured field values of needle and its kind (dict or class name), the only
+    parts of a needle a search depends on
+    """
+    is_dict = isinstance(needle, dict)
+    values = tuple(get_field_getter(config.get_field, is_dict)(needle)
+                   for config in configured_matcher.get_matcher_configuration)
+    kind = 'dict' if is_dict else needle.__class__.__name__
+    return hashlib.sha1(repr((kind, values)).encode('utf-8')).hexdigest()
+
+
+def get_queryset_version(queryset):
+    """
+    Hayloft version of a QuerySet: its number of rows and greatest primary key. It changes when rows are added or
+    deleted, not when they are updated: pass the greatest modification date as version when rows are updated.
+    """
+    aggregate = queryset.aggregate(max_pk=Max('pk'))
+    return '%s:%s' % (queryset.count(), aggregate['max_pk'])
+
+
+class ResultCacheBackend(object):
+    """
+    Interface for the storage of a CachedMatcher. get returns None for missing or expired keys.
+    """
+
+    def get(self, key):
+        pass
+
+    def set(self, key, value):
+        pass
+
+
+class LocalResultCache(ResultCacheBackend):
+    """
+    Class to keep the results in the memory of the process, up to max_size results (the least recently used one is
+    removed first) of a maximum age of ttl seconds (None means no expiration). It is thread safe.
+    """
+
+    def __init__(self, max_size=1000, ttl=None):
+        self.__max_size = max_size
+        self.__ttl = ttl
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, key):
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return None
+
+            expires, value = entry
+            if expires is not None and expires <= time.time():
+                del self.__entries[key]
+                return None
+
+            self.__entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = time.time() + self.__ttl if self.__ttl is not None else None
+        with self.__lock:
+            self.__entries[key] = (expires, value)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__max_size:
+                self.__entries.popitem(last=False)
+
+
+class DjangoResultCache(ResultCacheBackend):
+    """
+    Class to keep the results in a Django cache (CACHES alias), shared between processes with a shared backend.
+    ttl is the timeout in seconds of each result, None means the default timeout of the cache. Size bounds and eviction
+    are the ones of the backend (i.e. MAX_ENTRIES of locmem).
+    """
+
+    def __init__(self, alias='default', ttl=None):
+        self.__alias = alias
+        self.__ttl = ttl
+
+    def __get_cache(self):
+        from django.core.cache import caches
+        return caches[self.__alias]
+
+    def get(self, key):
+        return self.__get_cache().get(key)
+
+    def set(self, key, value):
+        if self.__ttl is None:
+            self.__get_cache().set(key, value)
+        else:
+            self.__get_cache().set(key, value, self.__ttl)
+
+
+class CachedMatcher(object):
+    """
+    Class to cache the results of the searches of a ConfiguredMatcher between requests.
+
+    Results are keyed by the configuration fingerprint, the hayloft version and the needle fingerprint, so two
+    needles with the same configured field values share the result, and a new hayloft version never reads results of
+    the old one. hayloft_version is the version token or a function called with the hayloft of each search that
+    returns it (i.e. get_queryset_version). Each search returns a new MatchResult, cached or not.
+
+    Searches with logging are not cached.
+    """
+
+    def __init__(self, configured_matcher, hayloft_version, backend=None, key_prefix='matcher'):
+        self.__configured_matcher = configured_matcher
+        self.__hayloft_version = hayloft_version
+        self.__backend = backend if backend is not None else LocalResultCache()
+        self.__key_prefix = key_prefix
+        self.__configuration_fingerprint = get_configuration_fingerprint(configured_matcher)
+        self.__hits = 0
+        self.__misses = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def get_configured_matcher(self):
+        return self.__configured_matcher
+
+    @property
+    def get_backend(self):
+        return self.__backend
+
+    @property
+    def get_hits(self):
+        return self.__hits
+
+    @property
+    def get_misses(self):
+        return self.__misses
+
+    def get_key(self, needle, hayloft):
+        version = self.__hayloft_version(hayloft) if callable(self.__hayloft_version) else self.__hayloft_version
+        key = hashlib.sha1(repr((self.__configuration_fingerprint, str(version),
+                                 get_needle_fingerprint(needle, self.__configured_matcher))).encode('utf-8'))
+        return '%s:%s' % (self.__key_prefix, key.hexdigest())
+
+    def search_matches(self, needle, hayloft, logging=False):
+        """
+        Return the MatchResult of needle in hayloft, from the cache when it was already searched in the same
+        hayloft version
+        """
+        if logging:
+            return self.__configured_matcher.search_matches(needle, hayloft, logging)
+
+        key = self.get_key(needle, hayloft)
+        matches = self.__backend.get(key)
+        if matches is not None:
+            with self.__lock:
+                self.__hits += 1
+            return MatchResult(needle, [Match(element, total_ratio) for element, total_ratio in matches])
+
+        with self.__lock:
+            self.__misses += 1
+        result = self.__configured_matcher.search_matches(needle, hayloft)
+        self.__backend.set(key, [(match.get_match_element, match.get_total_ratio) for match in result.get_matches])
+        return result
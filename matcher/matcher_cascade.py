@@ -0,0 +1,115 @@
+from heapq import nlargest
+
+from django.db.models.query import QuerySet
+
+from matcher.backends import GEO_DISTANCE_IMPLEMENTORS, TEXT_ALGORITHMS
+from matcher.columnar_hayloft import ColumnarHayloft
+from matcher.hayloft_index import IndexStatistics
+from matcher.matcher import ConfiguredMatcher, Match, MatcherFieldConfiguration, MatchResult
+from matcher.matcher_by_geo_distance import MatcherByGeoDistance
+from matcher.matcher_by_text import MatcherByText
+from matcher.matcher_exceptions import MatcherException
+
+
+def get_screening_matcher(configured_matcher, screening_threshold=0, text_algorithm='simple_ratio',
+                          geo_implementor='haversine'):
+    """
+    Return a cheap ConfiguredMatcher with the fields and weights of configured_matcher: each MatcherByText only with
+    text_algorithm and each MatcherByGeoDistance with the same radiuses and geo_implementor (names of the backend
+    registries). Other matcher types are kept.
+    """
+    matcher_configuration = []
+    for config in configured_matcher.get_matcher_configuration:
+        matcher_type = config.get_matcher_type
+        if isinstance(matcher_type, MatcherByText):
+            matcher_type = MatcherByText(matcher_type.get_mode, [TEXT_ALGORITHMS.create(text_algorithm)])
+        elif isinstance(matcher_type, MatcherByGeoDistance):
+            matcher_type = MatcherByGeoDistance(matcher_type.get_weighted_radiuses,
+                                                GEO_DISTANCE_IMPLEMENTORS.get_instance(geo_implementor),
+                                                matcher_type.get_ratio_farther)
+        matcher_configuration.append(MatcherFieldConfiguration(matcher_type, config.get_field, config.get_weight))
+
+    return ConfiguredMatcher(matcher_configuration, screening_threshold, configured_matcher.get_check_classes)
+
+
+class CascadeMatcher(object):
+    """
+    Class to search in two stages: screening_matcher (a cheap ConfiguredMatcher, see get_screening_matcher) scores
+    the whole hayloft and only its survivors, the matches over its threshold (the top_n best ones when top_n is
+    given), are scored by configured_matcher, the expensive configuration with the final threshold.
+
+    Every match of a cascade is a match of configured_matcher, but matches of configured_matcher that do not survive
+    the screening are lost: measure_recall measures that loss against a full search on a sample of needles.
+    The matches are in hayloft order, as in a full search, and a ColumnarHayloft keeps its row positions.
+    """
+
+    def __init__(self, screening_matcher, configured_matcher, top_n=None):
+        if not (isinstance(screening_matcher, ConfiguredMatcher) and isinstance(configured_matcher, ConfiguredMatcher)):
+            raise MatcherException(1003, msg_to_append=': CascadeMatcher stages must be ConfiguredMatcher instances')
+        if top_n is not None and top_n < 1:
+            raise MatcherException(1003, msg_to_append=': top_n must be greater than 0')
+
+        self.__screening_matcher = screening_matcher
+        self.__configured_matcher = configured_matcher
+        self.__top_n = top_n
+
+    @property
+    def get_screening_matcher(self):
+        return self.__screening_matcher
+
+    @property
+    def get_configured_matcher(self):
+        return self.__configured_matcher
+
+    @property
+    def get_top_n(self):
+        return self.__top_n
+
+    def get_survivors(self, needle, hayloft):
+        """
+        Return the list of Match of the screening of needle that are scored again, in hayloft order
+        """
+        matches = self.__screening_matcher.search_matches(needle, hayloft).get_matches
+        if self.__top_n is not None and len(matches) > self.__top_n:
+            #the best ratios, by hayloft order between equal ones
+            best = nlargest(self.__top_n, range(len(matches)), key=lambda i: (matches[i].get_total_ratio, -i))
+            matches = [matches[i] for i in sorted(best)]
+        return matches
+
+    def search_matches(self, needle, hayloft, logging=False):
+        """
+        Return the MatchResult of needle in hayloft, with only the survivors of the screening scored by
+        configured_matcher
+        """
+        survivors = self.get_survivors(needle, hayloft)
+
+        if isinstance(hayloft, ColumnarHayloft):
+            #the survivors are row positions
+            result = MatchResult(needle)
+            plan = self.__configured_matcher.compile_plan(needle)
+            for survivor in survivors:
+                position = survivor.get_match_element
+                match = plan.match_element(hayloft.get_row(position), logging)
+                if match is not None:
+                    result.add_match(Match(position, match.get_total_ratio, match.get_match_log))
+            return result
+
+        return self.__configured_matcher.search_matches(needle, [survivor.get_match_element for survivor in survivors],
+                                                        logging)
+
+    def measure_recall(self, needles, hayloft):
+        """
+        Search each needle of needles with the cascade and with configured_matcher alone and return the
+        IndexStatistics of all of them: candidates are the survivors scored by configured_matcher and recall the
+        fraction of the matches of the full search found by the cascade.
+        It executes a full search of configured_matcher for each needle, so use a sample of needles.
+        """
+        hayloft_size = hayloft.count() if isinstance(hayloft, QuerySet) else len(hayloft)
+        survivors = matches = full_search_matches = searches = 0
+        for needle in needles:
+            searches += 1
+            survivors += len(self.get_survivors(needle, hayloft))
+            matches += len(self.search_matches(needle, hayloft).get_matches)
+            full_search_matches += len(self.__configured_matcher.search_matches(needle, hayloft).get_matches)
+
+        return IndexStatistics(hayloft_size * searches, survivors, matches, full_search_matches)
@@ -0,0 +1,336 @@
+from itertools import islice
+from multiprocessing import Pool
+
+from django.db.models.query import QuerySet
+
+from matcher.geo_grid import GeoGrid
+from matcher.hayloft_index import PHONETIC_ENCODERS, get_field_value, get_phonetic_keys
+from matcher.matcher import ConfiguredMatcher
+from matcher.queryset_iterator import QuerySetIterator
+
+
+class Blocking(object):
+    """
+    Interface for any Blocking of a Deduplicator.
+
+    get_keys returns the keys an element is indexed by and get_query_keys the keys looked up for an element.
+    Two elements are a candidate pair when a query key of one of them is a key of the other one.
+    """
+
+    def get_keys(self, element):
+        pass
+
+    def get_query_keys(self, element):
+        return self.get_keys(element)
+
+
+class GeoCellBlocking(Blocking):
+    """
+    Class to block elements by the GeoGrid cell of a geo field.
+    Elements within distance km are always candidate pairs. Elements without point are not blocked.
+    """
+
+    def __init__(self, field, distance):
+        self.__field = field
+        self.__distance = float(distance)
+        self.__grid = GeoGrid(self.__distance)
+
+    @property
+    def get_field(self):
+        return self.__field
+
+    @property
+    def get_distance(self):
+        return self.__distance
+
+    def get_keys(self, element):
+        point = get_field_value(element, self.__field)
+        if not point:
+            return []
+        return [self.__grid.get_cell(point)]
+
+    def get_query_keys(self, element):
+        point = get_field_value(element, self.__field)
+        if not point:
+            return []
+        return self.__grid.get_cells_within(point, self.__distance)
+
+
+class NGramBlocking(Blocking):
+    """
+    Class to block elements by the lowercase character n-grams of a text field
+    """
+
+    def __init__(self, field, n=3):
+        if n < 1:
+            raise ValueError('n must be greater than 0')
+        self.__field = field
+        self.__n = n
+
+    @property
+    def get_field(self):
+        return self.__field
+
+    def get_keys(self, element):
+        value = get_field_value(element, self.__field)
+        if not value:
+            return set()
+
+        value = value.lower()
+        if len(value) <= self.__n:
+            return set([value])
+        return set(value[i:i + self.__n] for i in range(len(value) - self.__n + 1))
+
+
+class PhoneticBlocking(Blocking):
+    """
+    Class to block elements by the phonetic keys of the words of a text field (see PhoneticIndex)
+    """
+
+    def __init__(self, field, encoders=('metaphone',), min_token_length=3):
+        for encoder in encoders:
+            if encoder not in PHONETIC_ENCODERS:
+                raise ValueError('Unknown phonetic encoder %s' % encoder)
+        self.__field = field
+        self.__encoders = tuple(encoders)
+        self.__min_token_length = min_token_length
+
+    @property
+    def get_field(self):
+        return self.__field
+
+    def get_keys(self, element):
+        return get_phonetic_keys(get_field_value(element, self.__field), self.__encoders, self.__min_token_length)
+
+
+class UnionFind(object):
+    """
+    Disjoint sets of positions 0..size-1 with path compression and union by size
+    """
+
+    def __init__(self, size):
+        self.__parents = list(range(size))
+        self.__sizes = [1] * size
+
+    def find(self, position):
+        parents = self.__parents
+        root = position
+        while parents[root] != root:
+            root = parents[root]
+        while parents[position] != root:
+            parents[position], position = root, parents[position]
+        return root
+
+    def union(self, position_a, position_b):
+        root_a, root_b = self.find(position_a), self.find(position_b)
+        if root_a == root_b:
+            return root_a
+        if self.__sizes[root_a] < self.__sizes[root_b]:
+            root_a, root_b = root_b, root_a
+        self.__parents[root_b] = root_a
+        self.__sizes[root_a] += self.__sizes[root_b]
+        return root_a
+
+    def get_sets(self):
+        """
+        Return the sets with more than one position, as sorted lists ordered by their first position
+        """
+        sets = {}
+        for position in range(len(self.__parents)):
+            sets.setdefault(self.find(position), []).append(position)
+        return [positions for positions in sorted(sets.values()) if len(positions) > 1]
+
+
+class DedupeResult(object):
+    """
+    Class to define the result of a Deduplicator.
+
+    get_pairs are the (element_a, element_b, total_ratio) pairs greater or equal than the threshold, each unordered
+    pair once. get_clusters are the lists (of more than one element) of elements connected by those pairs.
+    """
+
+    def __init__(self, elements, scored_pairs, clusters, candidate_pairs):
+        self.__elements = elements
+        self.__scored_pairs = scored_pairs
+        self.__clusters = clusters
+        self.__candidate_pairs = candidate_pairs
+
+    @property
+    def get_pairs(self):
+        elements = self.__elements
+        return [(elements[a], elements[b], ratio) for a, b, ratio in self.__scored_pairs]
+
+    @property
+    def get_clusters(self):
+        elements = self.__elements
+        return [[elements[position] for position in cluster] for cluster in self.__clusters]
+
+    @property
+    def get_cluster_positions(self):
+        return self.__clusters
+
+    @property
+    def get_candidate_pairs(self):
+        """
+        number of pairs scored
+        """
+        return self.__candidate_pairs
+
+    @property
+    def get_total_pairs(self):
+        """
+        number of pairs of a full self-join
+        """
+        size = len(self.__elements)
+        return size * (size - 1) // 2
+
+
+#state of each deduplication worker process, set once by _init_worker
+_worker_state = {}
+
+
+def _init_worker(configured_matcher, elements):
+    _worker_state['configured_matcher'] = configured_matcher
+    _worker_state['elements'] = elements
+
+
+def _score_partners(partners):
+    return Deduplicator.score_partners(_worker_state['configured_matcher'], _worker_state['elements'], partners)
+
+
+class Deduplicator(object):
+    """
+    Class to deduplicate a hayloft against itself.
+
+    Candidate pairs are generated through blockings (GeoCellBlocking, NGramBlocking, PhoneticBlocking...): two elements
+    are a candidate pair when any blocking blocks them together. Each unordered candidate pair is scored once with
+    matcher_configuration and the pairs greater or equal than threshold are joined in clusters with union-find.
+    The candidate pairs are produced and scored blocking by blocking and element by element, so the memory grows with
+    the blocks and not with the number of candidate pairs.
+
+    Keys blocking more than max_block_size elements are ignored (a very common n-gram or word does not tell
+    duplicates apart and it would make the blocking quadratic). None means no limit.
+    """
+
+    def __init__(self, matcher_configuration, threshold, blockings, max_block_size=None):
+        if not blockings or not all(isinstance(blocking, Blocking) for blocking in blockings):
+            raise TypeError
+
+        self.__configured_matcher = ConfiguredMatcher(matcher_configuration, threshold)
+        self.__blockings = tuple(blockings)
+        self.__max_block_size = max_block_size
+
+    @property
+    def get_configured_matcher(self):
+        return self.__configured_matcher
+
+    @property
+    def get_blockings(self):
+        return self.__blockings
+
+    def iter_candidate_partners(self, elements):
+        """
+        Yield (position, sorted list of greater positions) with the candidate pairs of elements, blocking by blocking.
+        Each unordered pair is yielded once, by the first blocking that blocks it: a position can be yielded once per
+        blocking.
+        """
+        #keys of each element and blocks (positions by key) of each blocking
+        blockings = []
+        for blocking in self.__blockings:
+            element_keys = [set(blocking.get_keys(element)) for element in elements]
+            blocks = {}
+            for position, keys in enumerate(element_keys):
+                for key in keys:
+                    blocks.setdefault(key, []).append(position)
+
+            if self.__max_block_size is not None:
+                blocks = dict((key, positions) for key, positions in blocks.items()
+                              if len(positions) <= self.__max_block_size)
+            blockings.append((blocking, element_keys, blocks))
+
+        for index, (blocking, element_keys, blocks) in enumerate(blockings):
+            for position, element in enumerate(elements):
+                partners = set()
+                for key in blocking.get_query_keys(element):
+                    for partner in blocks.get(key, ()):
+                        if partner > position:
+                            partners.add(partner)
+
+                if partners and index:
+                    #the pairs blocked by a previous blocking were yielded there
+                    previous_query_keys = [(previous_keys, set(key for key in previous_blocking.get_query_keys(element)
+                                                               if key in previous_blocks))
+                                           for previous_blocking, previous_keys, previous_blocks in blockings[:index]]
+                    partners = [partner for partner in partners
+                                if all(previous_keys[partner].isdisjoint(query_keys)
+                                       for previous_keys, query_keys in previous_query_keys)]
+
+                if partners:
+                    yield position, sorted(partners)
+
+    def get_candidate_partners(self, elements):
+        """
+        Return a dict of position -> sorted list of greater positions of its candidate pairs
+        """
+        partners = {}
+        for position, partner_positions in self.iter_candidate_partners(elements):
+            partners.setdefault(position, []).extend(partner_positions)
+
+        return dict((position, sorted(positions)) for position, positions in partners.items())
+
+    @staticmethod
+    def score_partners(configured_matcher, elements, partners):
+        """
+        Score the candidate pairs of partners, a list of (position, [partner positions]).
+        Return the list of (position, partner, total_ratio) greater or equal than the threshold.
+        """
+        threshold = configured_matcher.get_threshold
+        scored_pairs = []
+        for position, partner_positions in partners:
+            score = configured_matcher.compile_plan(elements[position]).score
+            for partner in partner_positions:
+                ratio = score(elements[partner])
+                if ratio >= threshold:
+                    scored_pairs.append((position, partner, ratio))
+
+        return scored_pairs
+
+    def deduplicate(self, hayloft, processes=1, chunksize=1000):
+        """
+        Deduplicate hayloft (a QuerySet or a iterable of objects or dicts) and return a DedupeResult.
+
+        With processes > 1 the candidate pairs are scored in a multiprocessing Pool, in chunks of chunksize elements.
+        The configuration and the elements are sent once to each process, so they must be picklable.
+        """
+        if isinstance(hayloft, QuerySet):
+            hayloft = QuerySetIterator(self.__configured_matcher.prepare_queryset(hayloft)).queryset_iterator()
+        elements = list(hayloft)
+
+        chunk_pairs = []
+
+        def get_chunks():
+            partners = self.iter_candidate_partners(elements)
+            chunk = list(islice(partners, chunksize))
+            while chunk:
+                chunk_pairs.append(sum(len(partner_positions) for position, partner_positions in chunk))
+                yield chunk
+                chunk = list(islice(partners, chunksize))
+
+        if processes > 1 and len(elements) > chunksize:
+            pool = Pool(processes, initializer=_init_worker, initargs=(self.__configured_matcher, elements))
+            try:
+                scored_pairs = [pair for chunk in pool.imap(_score_partners, get_chunks()) for pair in chunk]
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            scored_pairs = [pair for chunk in get_chunks()
+                            for pair in self.score_partners(self.__configured_matcher, elements, chunk)]
+        scored_pairs.sort(key=lambda pair: pair[:2])
+        candidate_pairs = sum(chunk_pairs)
+
+        union_find = UnionFind(len(elements))
+        for position, partner, ratio in scored_pairs:
+            union_find.union(position, partner)
+
+        return DedupeResult(elements, scored_pairs, union_find.get_sets(), candidate_pairs)
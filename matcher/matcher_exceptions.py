@@ -9,6 +9,7 @@ class MatcherException(Exception):
         1001 : 'AttributeError Exception in get_field of Needle or Element hayloft Dict. ',
         1002 : 'Error in Needle or Element hayloft Values passed. ',
         1003 : 'Wrong Matcher Configuration',
+        1004 : 'All columns of a Columnar hayloft must have the same length. ',
     }
 
     def __init__(self, code, msg = None, msg_to_append = None):
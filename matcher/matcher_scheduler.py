@@ -0,0 +1,268 @@
+import threading
+from concurrent.futures import Future, TimeoutError
+from timeit import default_timer
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from matcher.matcher import ConfiguredMatcher
+from matcher.matcher_exceptions import MatcherException
+
+
+class ScheduledRequest(object):
+    """
+    Class to define a needle waiting in a MicroBatchScheduler: its Future and the deadline (default_timer seconds, None
+    means no limit) to answer it
+    """
+
+    def __init__(self, needle, deadline=None):
+        self.__needle = needle
+        self.__deadline = deadline
+        self.__future = Future()
+        self.__submitted = default_timer()
+
+    @property
+    def get_needle(self):
+        return self.__needle
+
+    @property
+    def get_deadline(self):
+        return self.__deadline
+
+    @property
+    def get_future(self):
+        return self.__future
+
+    @property
+    def get_submitted(self):
+        return self.__submitted
+
+    def is_expired(self, now):
+        return self.__deadline is not None and now > self.__deadline
+
+
+class MicroBatchScheduler(object):
+    """
+    Class to search many concurrent single needle requests against the same hayloft and configuration with shared
+    hayloft passes.
+
+    Each worker thread takes the first waiting needle, collects the needles that arrive in the next max_delay seconds
+    (up to max_batch_size) and searches all of them with one ConfiguredMatcher.search_matches_batch, then the
+    MatchResult of each needle is set in its Future. The results are the ones of search_matches for each needle.
+
+    Backpressure: at most max_queue_size needles wait, submit blocks while the queue is full (or raises queue.Full
+    with block = False). timeout (seconds, None means no limit) bounds each request from its submit: a request not
+    answered in time fails with concurrent.futures.TimeoutError and is not searched if its batch has not started.
+    """
+
+    def __init__(self, configured_matcher, hayloft, max_batch_size=32, max_delay=0.005, max_queue_size=1024,
+                 timeout=None, workers=1, logging=False):
+        if not isinstance(configured_matcher, ConfiguredMatcher):
+            raise MatcherException(1003, msg_to_append=': MicroBatchScheduler needs a ConfiguredMatcher')
+        if max_batch_size < 1 or max_queue_size < 1 or workers < 1 or max_delay < 0:
+            raise MatcherException(1003, msg_to_append=': wrong MicroBatchScheduler limits')
+
+        self.__configured_matcher = configured_matcher
+        self.__hayloft = hayloft
+        self.__max_batch_size = max_batch_size
+        self.__max_delay = max_delay
+        self.__timeout = timeout
+        self.__logging = logging
+        self.__max_queue_size = max_queue_size
+        #unbounded, so the close signal never waits: max_queue_size is kept by submit under the lock
+        self.__queue = queue.Queue()
+        self.__lock = threading.Lock()
+        self.__not_full = threading.Condition(self.__lock)
+        self.__closed = False
+
+        #metrics
+        self.__max_queue_depth = 0
+        self.__batches = 0
+        self.__searched = 0
+        self.__timeouts = 0
+        self.__rejected = 0
+        self.__errors = 0
+        self.__wait_time = 0.0
+
+        self.__workers = []
+        for _ in range(workers):
+            worker = threading.Thread(target=self.__run)
+            worker.daemon = True
+            worker.start()
+            self.__workers.append(worker)
+
+    @property
+    def get_configured_matcher(self):
+        return self.__configured_matcher
+
+    @property
+    def get_max_batch_size(self):
+        return self.__max_batch_size
+
+    @property
+    def get_max_delay(self):
+        return self.__max_delay
+
+    @property
+    def get_queue_depth(self):
+        return self.__queue.qsize()
+
+    @property
+    def get_max_queue_depth(self):
+        return self.__max_queue_depth
+
+    @property
+    def get_batches(self):
+        return self.__batches
+
+    @property
+    def get_searched(self):
+        return self.__searched
+
+    @property
+    def get_timeouts(self):
+        return self.__timeouts
+
+    @property
+    def get_rejected(self):
+        return self.__rejected
+
+    @property
+    def get_errors(self):
+        return self.__errors
+
+    @property
+    def get_mean_batch_size(self):
+        return float(self.__searched) / self.__batches if self.__batches else 0.0
+
+    @property
+    def get_mean_wait_time(self):
+        """
+        Mean seconds the searched needles waited in the queue before their batch started
+        """
+        return self.__wait_time / self.__searched if self.__searched else 0.0
+
+    def submit(self, needle, timeout=None, block=True):
+        """
+        Queue needle and return the Future of its MatchResult. timeout replaces the timeout of the scheduler.
+        """
+        timeout = self.__timeout if timeout is None else timeout
+        deadline = None if timeout is None else default_timer() + timeout
+        request = ScheduledRequest(needle, deadline)
+
+        #the closed check and the put are atomic with close: no needle is queued after the close signal
+        with self.__not_full:
+            while True:
+                if self.__closed:
+                    raise RuntimeError('MicroBatchScheduler is closed')
+                if self.__queue.qsize() < self.__max_queue_size:
+                    break
+                remaining = None if deadline is None else deadline - default_timer()
+                if not block or (remaining is not None and remaining <= 0):
+                    self.__rejected += 1
+                    raise queue.Full
+                self.__not_full.wait(remaining)
+
+            self.__queue.put_nowait(request)
+            self.__max_queue_depth = max(self.__max_queue_depth, self.__queue.qsize())
+        return request.get_future
+
+    def search_matches(self, needle, timeout=None):
+        """
+        Return the MatchResult of needle, the same as ConfiguredMatcher.search_matches, waiting for its batch
+        """
+        return self.submit(needle, timeout).result()
+
+    def __get_batch(self):
+        """
+        Return the next list of requests, an empty list when the scheduler is closed
+        """
+        request = self.__queue.get()
+        if request is None:
+            #keep the close signal for the other workers
+            self.__queue.put_nowait(None)
+            return []
+
+        batch = [request]
+        batch_deadline = default_timer() + self.__max_delay
+        while len(batch) < self.__max_batch_size:
+            remaining = batch_deadline - default_timer()
+            try:
+                request = self.__queue.get(remaining > 0, max(remaining, 0))
+            except queue.Empty:
+                break
+            if request is None:
+                self.__queue.put_nowait(None)
+                break
+            batch.append(request)
+
+        with self.__not_full:
+            self.__not_full.notify_all()
+        return batch
+
+    def __expire(self, request):
+        request.get_future.set_exception(TimeoutError('Needle not searched within its timeout'))
+        with self.__lock:
+            self.__timeouts += 1
+
+    def __run(self):
+        while True:
+            batch = self.__get_batch()
+            if not batch:
+                break
+
+            now = default_timer()
+            requests = []
+            for request in batch:
+                if not request.get_future.set_running_or_notify_cancel():
+                    continue
+                if request.is_expired(now):
+                    self.__expire(request)
+                else:
+                    requests.append(request)
+            if not requests:
+                continue
+
+            with self.__lock:
+                self.__batches += 1
+                self.__searched += len(requests)
+                self.__wait_time += sum(now - request.get_submitted for request in requests)
+
+            try:
+                results = self.__configured_matcher.search_matches_batch(
+                    [request.get_needle for request in requests], self.__hayloft, self.__logging)
+            except Exception as e:
+                with self.__lock:
+                    self.__errors += 1
+                for request in requests:
+                    request.get_future.set_exception(e)
+                continue
+
+            now = default_timer()
+            for request, result in zip(requests, results):
+                if request.is_expired(now):
+                    self.__expire(request)
+                else:
+                    request.get_future.set_result(result)
+
+    def close(self, wait=True):
+        """
+        Stop accepting needles, without waiting. The queued needles are still searched, wait = True waits for them.
+        """
+        with self.__not_full:
+            if not self.__closed:
+                self.__closed = True
+                self.__queue.put_nowait(None)
+            #submits waiting for room fail now
+            self.__not_full.notify_all()
+        if wait:
+            for worker in self.__workers:
+                worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
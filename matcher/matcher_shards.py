@@ -0,0 +1,472 @@
+import pickle
+import socket
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from heapq import nlargest
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from django.db.models.query import QuerySet
+
+from matcher.geo_grid import GeoGrid
+from matcher.hayloft_index import get_field_value
+from matcher.matcher import Match, MatchResult
+from matcher.matcher_exceptions import MatcherException
+from matcher.queryset_iterator import get_pk
+
+
+#length prefix of each pickled message of the socket transport
+MESSAGE_HEADER = struct.Struct('!Q')
+
+
+class ShardError(Exception):
+    """
+    Error of a shard search: the worker failed or could not be reached
+    """
+
+    def __init__(self, shard, message):
+        super(ShardError, self).__init__('Shard %i: %s' % (shard, message))
+        self.shard = shard
+
+
+def get_top_matches(matches, top_k):
+    """
+    Return the top_k (all when top_k is None) of matches, a list of (total_ratio, position, element, match_log), in
+    the order of MatchResult.order_matches over the whole hayloft: from the greater ratio and by hayloft position
+    between equal ratios.
+    """
+    key = lambda match: (match[0], -match[1])
+    if top_k is None:
+        return sorted(matches, key=key, reverse=True)
+    return nlargest(top_k, matches, key=key)
+
+
+#######################################################################################################################
+#       Partitioners                                                                                                  #
+#######################################################################################################################
+
+class ShardPartitioner(object):
+    """
+    Interface to split a hayloft in shards and to choose the shards a needle is sent to
+    """
+
+    def get_shards_count(self):
+        pass
+
+    def get_shard(self, element):
+        pass
+
+    def get_needle_shards(self, needle, configured_matcher):
+        """
+        Return the list of shards that can have matches of needle, all of them by default
+        """
+        return list(range(self.get_shards_count()))
+
+    def partition(self, hayloft):
+        """
+        Return for each shard the tuple (elements, positions) of its elements and their positions in hayloft, the
+        positions that break the ties between equal ratios as in a search of the whole hayloft
+        """
+        shards = [([], []) for _ in range(self.get_shards_count())]
+        for position, element in enumerate(hayloft):
+            elements, positions = shards[self.get_shard(element)]
+            elements.append(element)
+            positions.append(position)
+        return shards
+
+
+class PkRangePartitioner(ShardPartitioner):
+    """
+    Class to split a hayloft by ranges of primary key: shard i has the pks from boundaries[i - 1] (included) to
+    boundaries[i] (excluded), the first shard every pk lower than boundaries[0] and the last one every pk greater or
+    equal than boundaries[-1]. Elements can be model instances or values() dicts.
+    """
+
+    def __init__(self, boundaries):
+        self.__boundaries = sorted(boundaries)
+
+    @classmethod
+    def from_queryset(cls, queryset, shards_count):
+        """
+        Return the PkRangePartitioner of shards of about the same number of rows of queryset
+        """
+        count = queryset.count()
+        pks = queryset.order_by('pk').values_list('pk', flat=True)
+        return cls([pks[count * shard // shards_count] for shard in range(1, shards_count) if count])
+
+    @property
+    def get_boundaries(self):
+        return self.__boundaries
+
+    def get_shards_count(self):
+        return len(self.__boundaries) + 1
+
+    def get_shard(self, element):
+        pk = get_pk(element)
+        shard = 0
+        while shard < len(self.__boundaries) and pk >= self.__boundaries[shard]:
+            shard += 1
+        return shard
+
+    def get_querysets(self, queryset):
+        """
+        Return the QuerySet of each shard of queryset
+        """
+        querysets = []
+        for shard in range(self.get_shards_count()):
+            shard_queryset = queryset
+            if shard > 0:
+                shard_queryset = shard_queryset.filter(pk__gte=self.__boundaries[shard - 1])
+            if shard < len(self.__boundaries):
+                shard_queryset = shard_queryset.filter(pk__lt=self.__boundaries[shard])
+            querysets.append(shard_queryset)
+        return querysets
+
+
+class GeoCellPartitioner(ShardPartitioner):
+    """
+    Class to split a hayloft by the GeoGrid region of the point of field: regions of about region_size km are
+    assigned to shards_count shards, elements without point go to the first shard.
+
+    A needle is only sent to the shards of the regions within the greatest radius of its MatcherByGeoDistance when
+    ratio_farther can not reach the minimum ratio the field needs to reach the threshold (as GeoGridIndex), so
+    region_size should be several times that radius.
+    """
+
+    def __init__(self, field, region_size, shards_count):
+        if shards_count < 1:
+            raise ValueError('shards_count must be greater than 0')
+
+        self.__field = field
+        self.__grid = GeoGrid(region_size)
+        self.__shards_count = shards_count
+
+    @property
+    def get_field(self):
+        return self.__field
+
+    def get_shards_count(self):
+        return self.__shards_count
+
+    @staticmethod
+    def __is_point(value):
+        return isinstance(value, tuple) and len(value) > 0
+
+    def __get_cell_shard(self, cell):
+        row, column = cell
+        return (row * 7919 + column) % self.__shards_count
+
+    def get_shard(self, element):
+        point = get_field_value(element, self.__field)
+        if not self.__is_point(point):
+            return 0
+        return self.__get_cell_shard(self.__grid.get_cell(point))
+
+    def get_needle_shards(self, needle, configured_matcher):
+        for config in configured_matcher.get_matcher_configuration:
+            if config.get_field == self.__field and hasattr(config.get_matcher_type, 'get_max_distance'):
+                break
+        else:
+            return list(range(self.__shards_count))
+
+        matcher_type = config.get_matcher_type
+        if matcher_type.get_ratio_farther >= configured_matcher.get_min_ratio(config):
+            return list(range(self.__shards_count))
+
+        point = get_field_value(needle, self.__field)
+        if not self.__is_point(point):
+            #every element gets ratio_farther
+            return []
+
+        return sorted(set(self.__get_cell_shard(cell)
+                          for cell in self.__grid.get_cells_within(point, matcher_type.get_max_distance)))
+
+
+#######################################################################################################################
+#       Workers and transports                                                                                        #
+#######################################################################################################################
+
+class ShardWorker(object):
+    """
+    Class to search the needles of a coordinator in one shard of the hayloft.
+
+    hayloft is the shard: a list of elements with their positions in the whole hayloft (see
+    ShardPartitioner.partition), or a QuerySet, whose positions are the pks. Each needle returns its local top_k
+    matches as (total_ratio, position, element, match_log) tuples. The needles of a request are searched with one
+    pass over the shard (ConfiguredMatcher.search_matches_batch for a QuerySet), the position of each element goes
+    with it through the pass.
+    """
+
+    def __init__(self, configured_matcher, hayloft, positions=None, top_k=None):
+        self.__configured_matcher = configured_matcher
+        self.__hayloft = hayloft
+        self.__top_k = top_k
+        self.__positions = None
+        if not isinstance(hayloft, QuerySet):
+            self.__positions = list(positions) if positions is not None else list(range(len(hayloft)))
+
+    @property
+    def get_configured_matcher(self):
+        return self.__configured_matcher
+
+    @property
+    def get_top_k(self):
+        return self.__top_k
+
+    def search(self, needles, logging=False):
+        """
+        Return for each needle of needles the list of its local top_k matches
+        """
+        if self.__positions is None:
+            results = self.__configured_matcher.search_matches_batch(needles, self.__hayloft, logging)
+            return [get_top_matches([(match.get_total_ratio, get_pk(match.get_match_element), match.get_match_element,
+                                      match.get_match_log) for match in result.get_matches], self.__top_k)
+                    for result in results]
+
+        matches = [[] for _ in needles]
+        if self.__configured_matcher.get_matcher_configuration:
+            plans = [self.__configured_matcher.compile_plan(needle) for needle in needles]
+            for index, element in enumerate(self.__hayloft):
+                position = self.__positions[index]
+                for plan, needle_matches in zip(plans, matches):
+                    match = plan.match_element(element, logging)
+                    if match is not None:
+                        needle_matches.append((match.get_total_ratio, position, element, match.get_match_log))
+
+        return [get_top_matches(needle_matches, self.__top_k) for needle_matches in matches]
+
+
+class ShardTransport(object):
+    """
+    Interface to send the needles of a coordinator to the workers of the shards. search returns the result of
+    ShardWorker.search of the shard or raises ShardError. replica is the attempt number, transports with several
+    workers per shard use it to choose one.
+    """
+
+    def get_shards_count(self):
+        pass
+
+    def search(self, shard, needles, logging=False, replica=0):
+        pass
+
+
+class LocalTransport(ShardTransport):
+    """
+    Class to call ShardWorker instances of the same process, one per shard (or a list of replicas per shard)
+    """
+
+    def __init__(self, workers):
+        self.__workers = [worker if isinstance(worker, (list, tuple)) else [worker] for worker in workers]
+
+    def get_shards_count(self):
+        return len(self.__workers)
+
+    def search(self, shard, needles, logging=False, replica=0):
+        replicas = self.__workers[shard]
+        try:
+            return replicas[replica % len(replicas)].search(needles, logging)
+        except Exception as e:
+            raise ShardError(shard, '%s: %s' % (e.__class__.__name__, e))
+
+
+def send_message(connection, message):
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    connection.sendall(MESSAGE_HEADER.pack(len(data)) + data)
+
+
+def receive_message(connection):
+    header = receive_bytes(connection, MESSAGE_HEADER.size)
+    return pickle.loads(receive_bytes(connection, MESSAGE_HEADER.unpack(header)[0]))
+
+
+def receive_bytes(connection, size):
+    chunks = []
+    while size > 0:
+        chunk = connection.recv(min(size, 1 << 20))
+        if not chunk:
+            raise EOFError('connection closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+class ShardRequestHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        needles, logging = receive_message(self.request)
+        try:
+            response = (True, self.server.worker.search(needles, logging))
+        except Exception as e:
+            response = (False, '%s: %s' % (e.__class__.__name__, e))
+        send_message(self.request, response)
+
+
+class ShardServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    Class to serve a ShardWorker to SocketTransport coordinators over TCP, one request per connection.
+    Messages are pickled: only serve trusted networks. port = 0 chooses a free port (get_address).
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, worker, host='127.0.0.1', port=0):
+        socketserver.TCPServer.__init__(self, (host, port), ShardRequestHandler)
+        self.worker = worker
+
+    @property
+    def get_address(self):
+        return self.server_address
+
+    def serve_in_thread(self):
+        """
+        Serve in a daemon thread and return it, shutdown stops it
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+class SocketTransport(ShardTransport):
+    """
+    Class to send the needles to ShardServer workers over TCP. addresses has the (host, port) of the worker of each
+    shard, or a list of (host, port) replicas per shard tried in turn. timeout (seconds) bounds each request.
+    """
+
+    def __init__(self, addresses, timeout=30):
+        self.__addresses = [[address] if isinstance(address, tuple) else list(address) for address in addresses]
+        self.__timeout = timeout
+
+    def get_shards_count(self):
+        return len(self.__addresses)
+
+    def search(self, shard, needles, logging=False, replica=0):
+        replicas = self.__addresses[shard]
+        address = replicas[replica % len(replicas)]
+        try:
+            connection = socket.create_connection(address, self.__timeout)
+            try:
+                send_message(connection, (needles, logging))
+                succeeded, response = receive_message(connection)
+            finally:
+                connection.close()
+        except (socket.error, EOFError, pickle.UnpicklingError) as e:
+            raise ShardError(shard, '%s:%s %s' % (address[0], address[1], e))
+
+        if not succeeded:
+            raise ShardError(shard, response)
+        return response
+
+
+#######################################################################################################################
+#       Coordinator                                                                                                   #
+#######################################################################################################################
+
+class ShardCoordinator(object):
+    """
+    Class to search needles in a hayloft split in shards served by the workers of a transport.
+
+    Each needle is sent to its shards (all of them, or the ones of partitioner.get_needle_shards), in parallel, and
+    their local top_k matches are merged in the order of MatchResult.order_matches over the whole hayloft: the
+    result is the same as the ordered top_k of a search of the whole hayloft (all matches with top_k = None, then
+    workers must not limit them either).
+
+    A failed shard search is retried up to retries times (the next replica each time). When a shard still fails,
+    search_matches raises ShardError, or with allow_partial = True it returns partial results whose coverage counts
+    shards: MatchResult.get_scored_count shards answered of get_hayloft_size shards searched.
+    """
+
+    def __init__(self, transport, configured_matcher=None, partitioner=None, top_k=None, retries=2,
+                 allow_partial=False):
+        if partitioner is not None and configured_matcher is None:
+            raise MatcherException(1003, msg_to_append=': the partitioner routes needles with a configured_matcher')
+        if retries < 0:
+            raise MatcherException(1003, msg_to_append=': retries can not be negative')
+
+        self.__transport = transport
+        self.__configured_matcher = configured_matcher
+        self.__partitioner = partitioner
+        self.__top_k = top_k
+        self.__retries = retries
+        self.__allow_partial = allow_partial
+        self.__executor = ThreadPoolExecutor(max_workers=max(1, transport.get_shards_count()))
+
+    @property
+    def get_transport(self):
+        return self.__transport
+
+    @property
+    def get_top_k(self):
+        return self.__top_k
+
+    def close(self):
+        self.__executor.shutdown()
+
+    def __get_needle_shards(self, needle):
+        if self.__partitioner is None:
+            return list(range(self.__transport.get_shards_count()))
+        return self.__partitioner.get_needle_shards(needle, self.__configured_matcher)
+
+    def __search_shard(self, shard, needles, logging):
+        error = None
+        for replica in range(self.__retries + 1):
+            try:
+                return self.__transport.search(shard, needles, logging, replica)
+            except ShardError as e:
+                error = e
+        raise error
+
+    def search_matches_batch(self, needles, logging=False):
+        """
+        Return the MatchResult of each needle of needles, with its matches ordered. Each shard gets one request with
+        all its needles.
+        """
+        needles = list(needles)
+        needles_by_shard = {}
+        for index, needle in enumerate(needles):
+            for shard in self.__get_needle_shards(needle):
+                needles_by_shard.setdefault(shard, []).append(index)
+
+        futures = dict((shard, self.__executor.submit(self.__search_shard, shard,
+                                                      [needles[index] for index in indexes], logging))
+                       for shard, indexes in needles_by_shard.items())
+
+        matches = [[] for _ in needles]
+        searched = [0] * len(needles)
+        answered = [0] * len(needles)
+        for shard, future in futures.items():
+            indexes = needles_by_shard[shard]
+            try:
+                shard_results = future.result()
+            except ShardError:
+                if not self.__allow_partial:
+                    raise
+                shard_results = None
+
+            for position, index in enumerate(indexes):
+                searched[index] += 1
+                if shard_results is not None:
+                    answered[index] += 1
+                    matches[index].extend(shard_results[position])
+
+        results = []
+        for index, needle in enumerate(needles):
+            top_matches = get_top_matches(matches[index], self.__top_k)
+            result = MatchResult(needle, [Match(element, total_ratio, match_log)
+                                          for total_ratio, position, element, match_log in top_matches])
+            if answered[index] < searched[index]:
+                result.set_coverage(answered[index], searched[index])
+            results.append(result)
+
+        return results
+
+    def search_matches(self, needle, logging=False):
+        """
+        Return the MatchResult of needle, with its matches ordered
+        """
+        return self.search_matches_batch([needle], logging)[0]
@@ -1,3 +1,4 @@
+from functools import partial
 
 
 class MatcherType(object):
@@ -8,3 +9,19 @@ class MatcherType(object):
 
     def get_ratio_match(self, object_a, object_b):
         pass
+
+    def get_ratio_matches(self, object_a, objects_b):
+        """
+        Return the list of ratio matches of object_a with each object of objects_b (a column of a hayloft).
+        Matcher types able to score a whole column at once override this method.
+        """
+        get_ratio_match = self.get_ratio_match
+        return [get_ratio_match(object_a, object_b) for object_b in objects_b]
+
+    def prepare_ratio_match(self, object_a):
+        """
+        Return a function of object_b with the ratio match of object_a and object_b, to score all the elements of a
+        search against the same needle value. Matcher types with work that only depends on object_a override this
+        method to do it once per search.
+        """
+        return partial(self.get_ratio_match, object_a)
@@ -0,0 +1,39 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MatchingRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('last_needle_pk', models.BigIntegerField(blank=True, null=True)),
+                ('finished', models.BooleanField(default=False)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MatchingResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('needle_pk', models.BigIntegerField(db_index=True)),
+                ('element_pk', models.BigIntegerField()),
+                ('total_ratio', models.FloatField()),
+                ('rank', models.PositiveIntegerField()),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results',
+                                          to='matcher.MatchingRun')),
+            ],
+            options={
+                'ordering': ('run', 'needle_pk', 'rank'),
+            },
+        ),
+    ]
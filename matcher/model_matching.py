@@ -0,0 +1,78 @@
+from django.db import transaction
+
+from matcher.models import MatchingResult, MatchingRun
+from matcher.queryset_iterator import QuerySetIterator
+
+
+class ModelMatcher(object):
+    """
+    Class to match every row of a needles QuerySet against a hayloft QuerySet and save the matches as
+    MatchingResult rows of a MatchingRun.
+
+    Needles are read in chunks of needle_chunksize rows ordered by pk and each chunk is searched with one pass over
+    the hayloft (ConfiguredMatcher.search_matches_batch). The results of a chunk are saved with bulk_create in batches
+    of batch_size rows in the same transaction as the checkpoint of the run (the pk of the last needle of the chunk),
+    so a crashed run continues after the last needle saved.
+
+    top_k limits the matches saved for each needle (the best ones), None saves all of them.
+    Needles and hayloft must have integer primary keys.
+    """
+
+    def __init__(self, configured_matcher, top_k=None, needle_chunksize=100, batch_size=1000):
+        self.__configured_matcher = configured_matcher
+        self.__top_k = top_k
+        self.__needle_chunksize = needle_chunksize
+        self.__batch_size = batch_size
+
+    @property
+    def get_configured_matcher(self):
+        return self.__configured_matcher
+
+    def __get_results(self, run, result):
+        result.order_matches()
+        matches = result.get_matches if self.__top_k is None else result.get_matches[:self.__top_k]
+        needle_pk = result.get_needle.pk
+
+        return [MatchingResult(run=run, needle_pk=needle_pk, element_pk=match.get_match_element.pk,
+                               total_ratio=match.get_total_ratio, rank=rank + 1)
+                for rank, match in enumerate(matches)]
+
+    def run(self, run_name, needles, hayloft, restart=False, progress=None):
+        """
+        Match needles against hayloft (two QuerySets) in the MatchingRun named run_name and return the run.
+
+        If the run exists it continues after its checkpoint, unless restart is True: then its results are deleted and
+        it starts again. progress is an optional function called after each chunk with the run and the number of
+        needles matched in this call.
+        """
+        run, created = MatchingRun.objects.get_or_create(name=run_name)
+        if restart and not created:
+            with transaction.atomic():
+                run.results.all().delete()
+                run.last_needle_pk = None
+                run.finished = False
+                run.save()
+
+        if run.finished:
+            return run
+
+        needles_matched = 0
+        needles = self.__configured_matcher.prepare_queryset(needles)
+        for needle_chunk in QuerySetIterator(needles).queryset_chunks(self.__needle_chunksize,
+                                                                       from_pk=run.last_needle_pk):
+            results = []
+            for result in self.__configured_matcher.search_matches_batch(needle_chunk, hayloft):
+                results.extend(self.__get_results(run, result))
+
+            with transaction.atomic():
+                MatchingResult.objects.bulk_create(results, batch_size=self.__batch_size)
+                run.last_needle_pk = needle_chunk[-1].pk
+                run.save(update_fields=['last_needle_pk', 'updated'])
+
+            needles_matched += len(needle_chunk)
+            if progress is not None:
+                progress(run, needles_matched)
+
+        run.finished = True
+        run.save(update_fields=['finished', 'updated'])
+        return run
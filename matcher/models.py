@@ -0,0 +1,32 @@
+from django.db import models
+
+
+class MatchingRun(models.Model):
+    """
+    Model to define a resumable model to model matching run (see ModelMatcher).
+
+    last_needle_pk is the checkpoint: the primary key of the last needle whose results are saved.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    last_needle_pk = models.BigIntegerField(null=True, blank=True)
+    finished = models.BooleanField(default=False)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+
+class MatchingResult(models.Model):
+    """
+    Model to define one match of a MatchingRun: the hayloft element element_pk matches the needle needle_pk with
+    total_ratio. rank is the position of the match in the ordered matches of the needle, starting at 1.
+    """
+    run = models.ForeignKey(MatchingRun, related_name='results', on_delete=models.CASCADE)
+    needle_pk = models.BigIntegerField(db_index=True)
+    element_pk = models.BigIntegerField()
+    total_ratio = models.FloatField()
+    rank = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ('run', 'needle_pk', 'rank')
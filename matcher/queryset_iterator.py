@@ -1,6 +1,13 @@
 import gc
 
 
+def get_pk(row):
+    """
+    Return the primary key of a model instance or of a values() dict with a pk key
+    """
+    return row['pk'] if isinstance(row, dict) else row.pk
+
+
 class QuerySetIterator(object):
 
     def __init__(self, queryset):
@@ -17,11 +24,36 @@ class QuerySetIterator(object):
 
         Note that the implementation of the iterator does not support ordered query sets.
         '''
+        last_row = self.__queryset.order_by('-pk').first()
+        if last_row is None:
+            return
+
         pk = 0
-        last_pk = self.__queryset.order_by('-pk')[0].pk
+        last_pk = get_pk(last_row)
         queryset = self.__queryset.order_by('pk')
         while pk < last_pk:
             for row in queryset.filter(pk__gt=pk)[:chunksize]:
-                pk = row.pk
+                pk = get_pk(row)
                 yield row
             gc.collect()
+
+    def queryset_chunks(self, chunksize=1000, from_pk=None):
+        '''
+        Iterate over a Django Queryset ordered by the primary key, yielding lists of a maximum of chunksize rows
+
+        When from_pk is given the iteration starts after that primary key, so an interrupted iteration can be resumed
+        from the last primary key processed.
+
+        Note that the implementation of the iterator does not support ordered query sets.
+        '''
+        queryset = self.__queryset.order_by('pk')
+        if from_pk is not None:
+            chunk = list(queryset.filter(pk__gt=from_pk)[:chunksize])
+        else:
+            chunk = list(queryset[:chunksize])
+
+        while chunk:
+            yield chunk
+            if len(chunk) < chunksize:
+                break
+            chunk = list(queryset.filter(pk__gt=get_pk(chunk[-1]))[:chunksize])
@@ -0,0 +1,135 @@
+import re
+from operator import attrgetter, itemgetter
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections
+
+
+FIELD_PATH_SEPARATOR = re.compile(r'__|\.')
+
+#default of the key and attribute reads of get_field_getter, None can be a value
+_MISSING = object()
+
+
+def get_field_path(field):
+    """
+    Return the tuple of names of a field path: 'address.city.name' and 'address__city__name' are
+    ('address', 'city', 'name'). A field without separators (or with empty names, i.e. '__private') is a path of one
+    name.
+    """
+    path = tuple(FIELD_PATH_SEPARATOR.split(field))
+    if len(path) > 1 and all(path):
+        return path
+    return (field,)
+
+
+def get_field_getter(field, is_dict):
+    """
+    Return the accessor of field: the key (dicts) or attribute (objects) named field when the element has it, so keys
+    like 'venue.name' of CSV rows or attributes like geo__point are read as they are. Otherwise field is read as a
+    field path: the Django values() key ('address__city__name') for dicts, the dotted path for objects.
+    """
+    path = get_field_path(field)
+    if len(path) == 1:
+        if is_dict:
+            return itemgetter(field)
+        #attrgetter would split a name with dots
+        return attrgetter(field) if '.' not in field else lambda element: getattr(element, field)
+
+    if is_dict:
+        path_key = '__'.join(path)
+
+        def get_item(row):
+            value = row.get(field, _MISSING)
+            return row[path_key] if value is _MISSING else value
+
+        return get_item
+
+    get_path = attrgetter('.'.join(path))
+
+    def get_attribute(element):
+        value = getattr(element, field, _MISSING)
+        return get_path(element) if value is _MISSING else value
+
+    return get_attribute
+
+
+def get_related_lookups(model, fields):
+    """
+    Analyse the field paths of fields over a Django model.
+    Return the sorted lists of select_related lookups (paths of foreign keys and one to one relations) and
+    prefetch_related lookups (paths ending in a many to many or reverse foreign key relation).
+
+    The analysis stops at the first name of a path which is not a relation field (a column, a property...), so
+    properties of related objects are covered but relations used inside a property are not.
+    """
+    select_related = set()
+    prefetch_related = set()
+
+    for field in fields:
+        current_model = model
+        lookup = []
+        for name in get_field_path(field):
+            try:
+                model_field = current_model._meta.get_field(name)
+            except FieldDoesNotExist:
+                break
+            if not model_field.is_relation or model_field.related_model is None:
+                break
+
+            lookup.append(name)
+            if model_field.many_to_many or model_field.one_to_many:
+                #the path can not go on through a manager, the related objects are prefetched
+                prefetch_related.add('__'.join(lookup))
+                lookup = None
+                break
+            current_model = model_field.related_model
+
+        if lookup:
+            select_related.add('__'.join(lookup))
+
+    #a select_related lookup contained in a longer one is redundant
+    select_related = [lookup for lookup in select_related
+                      if not any(other.startswith(lookup + '__') for other in select_related)]
+    return sorted(select_related), sorted(prefetch_related)
+
+
+def prepare_queryset(queryset, fields, values=False):
+    """
+    Return queryset with the joins needed to read fields from its rows without a query per row:
+    select_related / prefetch_related of the related objects of the field paths (see get_related_lookups).
+
+    With values = True it returns the rows as dicts of pk and the Django lookups of the fields instead
+    ('address__city__name'), the keys read by get_field_getter for dicts. Every field must be then a model field path.
+    """
+    if values:
+        return queryset.values('pk', *sorted(set('__'.join(get_field_path(field)) for field in fields)))
+
+    select_related, prefetch_related = get_related_lookups(queryset.model, fields)
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+    return queryset
+
+
+class QueryCounter(object):
+    """
+    Context manager to count the queries executed in the database of a QuerySet (or the default database)
+    """
+
+    def __init__(self, queryset=None):
+        #django.test is slow to import, only searches with logging need it
+        from django.test.utils import CaptureQueriesContext
+        self.__context = CaptureQueriesContext(connections[queryset.db if queryset is not None else 'default'])
+
+    def __enter__(self):
+        self.__context.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.__context.__exit__(exc_type, exc_value, traceback)
+
+    @property
+    def get_query_count(self):
+        return len(self.__context)
@@ -0,0 +1,313 @@
+import json
+import struct
+import sys
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    resource_tracker = shared_memory = None
+
+from django.db.models.query import QuerySet
+
+from matcher.backends import LazyModule, is_module_available
+from matcher.columnar_hayloft import ColumnarHayloft
+from matcher.matcher_by_geo_distance import MatcherByGeoDistance
+from matcher.matcher_by_text import unicode
+from matcher.matcher_exceptions import MatcherException
+from matcher.related_fields import get_field_getter
+
+
+numpy = LazyModule('numpy')
+HAS_NUMPY = is_module_available('numpy')
+
+#the block starts with the length of the JSON layout, the layout and the aligned column buffers, at offsets of the
+#layout relative to the first one
+HEADER_FORMAT = '<Q'
+ALIGNMENT = 8
+
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def attach_shared_memory(name):
+    """
+    Attach to the shared memory block name without taking its ownership: the block is not unlinked when the
+    attached process exits.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+
+    #before Python 3.13 every attach registers the block in the resource tracker, which unlinks it when it stops
+    memory = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(memory._name, 'shared_memory')
+    return memory
+
+
+def unlink_shared_memory(memory):
+    """
+    Remove the shared memory block of memory, from the creator or from any attached process
+    """
+    if sys.version_info < (3, 13):
+        #an attach from a process sharing the resource tracker of the creator removed its registration, the one
+        #unlink removes
+        resource_tracker.register(memory._name, 'shared_memory')
+    memory.unlink()
+
+
+class SharedTextColumn(object):
+    """
+    Sequence of the texts of a column stored as UTF-8 bytes with the offsets of each text (offsets[i]:offsets[i + 1]).
+    Each text is decoded when it is read, the column itself is not copied.
+    """
+
+    def __init__(self, offsets, data):
+        self.__offsets = offsets
+        self.__data = data
+
+    def __len__(self):
+        return len(self.__offsets) - 1
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        return unicode(self.__data[int(self.__offsets[position]):int(self.__offsets[position + 1])], 'utf-8')
+
+    def __iter__(self):
+        data = self.__data
+        offsets = self.__offsets.tolist()
+        for start, end in zip(offsets, offsets[1:]):
+            yield unicode(data[start:end], 'utf-8')
+
+
+class SharedColumnarHayloft(ColumnarHayloft):
+    """
+    Class to define a ColumnarHayloft stored in one multiprocessing shared memory block, so the worker processes of
+    a server read the same hayloft instead of a copy each. NumPy and Python 3.8 are needed.
+
+    create loads the configured fields of a hayloft (list of dicts or objects, or QuerySet) in a new block: the text
+    fields as UTF-8 bytes with their offsets, the fields of a MatcherByGeoDistance as a float64 (N, 2) array of
+    (lat, lng) rows and optionally a key field (i.e. 'pk') as an int64 array to map row positions back to elements.
+    None points are stored as (nan, nan), which are scored as ratio_farther. Text fields can not be None (a
+    MatcherException is raised), as MatcherByText can not score empty texts.
+
+    attach opens an existing block by name without copying it; a SharedColumnarHayloft is pickled as its name, so it
+    can be passed to the processes of a pool. Processes forked after create share it without attach.
+
+    search_matches accepts it as any ColumnarHayloft: the matches refer to row positions. The process that created
+    the block must unlink it when no worker needs it. close can only release the block when no column returned by
+    get_column is still referenced.
+    """
+
+    def __init__(self, memory, owner=False):
+        if not HAS_NUMPY or shared_memory is None:
+            raise ImportError('NumPy and multiprocessing.shared_memory are needed by SharedColumnarHayloft')
+
+        super(SharedColumnarHayloft, self).__init__({})
+        self.__memory = memory
+        self.__owner = owner
+
+        buffer = memory.buf
+        header_size = struct.calcsize(HEADER_FORMAT)
+        layout_size = struct.unpack_from(HEADER_FORMAT, buffer)[0]
+        self.__layout = json.loads(bytes(buffer[header_size:header_size + layout_size]).decode('utf-8'))
+        start = align(header_size + layout_size)
+
+        size = self.__layout['size']
+        self.__text_columns = {}
+        self.__geo_columns = {}
+        self.__keys = None
+        for column in self.__layout['columns']:
+            if column['kind'] == 'text':
+                offsets = numpy.ndarray((size + 1,), dtype=numpy.int64, buffer=buffer, offset=start + column['offset'])
+                data_offset = start + column['data_offset']
+                data = buffer[data_offset:data_offset + column['data_size']]
+                self.__text_columns[column['field']] = SharedTextColumn(offsets, data)
+            elif column['kind'] == 'geo':
+                self.__geo_columns[column['field']] = numpy.ndarray((size, 2), dtype=numpy.float64, buffer=buffer,
+                                                                    offset=start + column['offset'])
+            else:
+                self.__keys = numpy.ndarray((size,), dtype=numpy.int64, buffer=buffer, offset=start + column['offset'])
+
+    @classmethod
+    def create(cls, hayloft, configured_matcher, key_field=None, name=None):
+        """
+        Load the configured fields of hayloft in a new shared memory block (named name or a random name) and
+        return its SharedColumnarHayloft, owner of the block.
+        """
+        if not HAS_NUMPY or shared_memory is None:
+            raise ImportError('NumPy and multiprocessing.shared_memory are needed by SharedColumnarHayloft')
+
+        configuration = configured_matcher.get_matcher_configuration
+        if isinstance(hayloft, QuerySet):
+            hayloft = configured_matcher.prepare_queryset(hayloft)
+        elements = list(hayloft)
+        size = len(elements)
+        is_dict = size > 0 and isinstance(elements[0], dict)
+
+        columns = []
+        buffers = []
+        for config in configuration:
+            getter = get_field_getter(config.get_field, is_dict)
+            if isinstance(config.get_matcher_type, MatcherByGeoDistance):
+                points = numpy.full((size, 2), numpy.nan)
+                for position, element in enumerate(elements):
+                    point = getter(element)
+                    if point is not None and len(point) == 2:
+                        points[position] = point
+                columns.append({'field': config.get_field, 'kind': 'geo'})
+                buffers.append((points.tobytes(),))
+            else:
+                texts = []
+                offsets = numpy.zeros(size + 1, dtype=numpy.int64)
+                for position, element in enumerate(elements):
+                    value = getter(element)
+                    if value is None:
+                        raise MatcherException(1002, msg_to_append='%s is None in row %i, text fields can not be '
+                                                                   'missing.' % (config.get_field, position))
+                    text = (value if isinstance(value, unicode) else unicode(value)).encode('utf-8')
+                    texts.append(text)
+                    offsets[position + 1] = offsets[position] + len(text)
+                columns.append({'field': config.get_field, 'kind': 'text'})
+                buffers.append((offsets.tobytes(), b''.join(texts)))
+
+        if key_field is not None:
+            getter = get_field_getter(key_field, is_dict)
+            keys = numpy.fromiter((getter(element) for element in elements), dtype=numpy.int64, count=size)
+            columns.append({'field': key_field, 'kind': 'key'})
+            buffers.append((keys.tobytes(),))
+
+        #offsets are relative to the start of the buffers, after the layout
+        layout = {'size': size, 'columns': columns}
+        offset = 0
+        for column, column_buffers in zip(columns, buffers):
+            column['offset'] = offset
+            offset = align(offset + len(column_buffers[0]))
+            if column['kind'] == 'text':
+                column['data_offset'] = offset
+                column['data_size'] = len(column_buffers[1])
+                offset = align(offset + len(column_buffers[1]))
+
+        encoded_layout = json.dumps(layout).encode('utf-8')
+        start = align(struct.calcsize(HEADER_FORMAT) + len(encoded_layout))
+        memory = shared_memory.SharedMemory(name=name, create=True, size=start + max(offset, 1))
+        try:
+            buffer = memory.buf
+            struct.pack_into(HEADER_FORMAT, buffer, 0, len(encoded_layout))
+            buffer[struct.calcsize(HEADER_FORMAT):start] = encoded_layout.ljust(start - struct.calcsize(HEADER_FORMAT))
+            for column, column_buffers in zip(columns, buffers):
+                column_offset = start + column['offset']
+                buffer[column_offset:column_offset + len(column_buffers[0])] = column_buffers[0]
+                if column['kind'] == 'text':
+                    data_offset = start + column['data_offset']
+                    buffer[data_offset:data_offset + column['data_size']] = column_buffers[1]
+            del buffer
+            return cls(memory, owner=True)
+        except Exception:
+            memory.close()
+            memory.unlink()
+            raise
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Return the SharedColumnarHayloft of the existing shared memory block name, without copying it
+        """
+        if not HAS_NUMPY or shared_memory is None:
+            raise ImportError('NumPy and multiprocessing.shared_memory are needed by SharedColumnarHayloft')
+
+        return cls(attach_shared_memory(name))
+
+    def __del__(self):
+        #the columns are released before the block, which can not be closed while they exist
+        try:
+            self.close()
+        except (AttributeError, BufferError):
+            pass
+
+    def __reduce__(self):
+        return (self.__class__.attach, (self.get_name,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.close()
+        except BufferError:
+            #the traceback of an exception can keep columns referenced
+            if exc_type is None:
+                raise
+        finally:
+            if self.__owner:
+                self.unlink()
+
+    @property
+    def get_name(self):
+        return self.__memory.name
+
+    @property
+    def get_size(self):
+        """
+        Size in bytes of the shared memory block
+        """
+        return self.__memory.size
+
+    @property
+    def get_columns(self):
+        columns = dict(self.__text_columns)
+        columns.update(self.__geo_columns)
+        return columns
+
+    @property
+    def get_geo_fields(self):
+        return list(self.__geo_columns.keys())
+
+    @property
+    def get_keys(self):
+        """
+        Return the int64 array of the key field of each row, None without key field
+        """
+        return self.__keys
+
+    def __len__(self):
+        return self.__layout['size']
+
+    def get_column(self, field):
+        """
+        Return the values of field for all rows: a SharedTextColumn for text fields and an (N, 2) array of (lat, lng)
+        rows for geo fields, both reading the shared memory block.
+        """
+        if field in self.__geo_columns:
+            return self.__geo_columns[field]
+        if field in self.__text_columns:
+            return self.__text_columns[field]
+        raise MatcherException(1000, msg_to_append='%s column not exist.' % field)
+
+    def get_row(self, position):
+        """
+        Return a dict with the configured values of the row in position
+        """
+        row = {}
+        for field, column in self.__text_columns.items():
+            row[field] = column[position]
+        for field, column in self.__geo_columns.items():
+            row[field] = tuple(float(value) for value in column[position])
+        return row
+
+    def close(self):
+        """
+        Release the shared memory block in this process
+        """
+        self.__text_columns = {}
+        self.__geo_columns = {}
+        self.__keys = None
+        self.__memory.close()
+
+    def unlink(self):
+        """
+        Remove the shared memory block, it is freed when every process has closed it
+        """
+        unlink_shared_memory(self.__memory)
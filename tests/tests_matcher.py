@@ -1,9 +1,59 @@
-from apps.matcher.matcher_by_text import MatcherByText
-from apps.matcher.matcher_by_geo_distance import MatcherByGeoDistance, Radius
-from apps.matcher.matcher import Matcher, MatcherFieldConfiguration
+import asyncio
+import csv
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from operator import attrgetter
 
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 
-class MatcherTest(object):
+from apps.matcher.matcher_by_text import MatcherByText, MatchByLevenshteinDistance
+from apps.matcher.matcher_by_geo_distance import GeoDistanceByHaversine, MatcherByGeoDistance, Radius
+from apps.matcher.matcher import Matcher, MatcherFieldConfiguration, ConfiguredMatcher
+from apps.matcher.matcher_dedupe import Deduplicator, GeoCellBlocking, NGramBlocking
+from apps.matcher.hayloft_index import BKTreeIndex, GeoGridIndex, LengthBucketedIndex, MinHashIndex, PhoneticIndex, \
+    PrescoreIndex
+from apps.matcher.related_fields import get_field_getter, get_field_path, prepare_queryset
+from apps.matcher.edit_distance import bounded_hamming_distance, bounded_levenshtein_distance
+from apps.matcher.matcher_by_tfidf import MatchByTfidfCosine
+from apps.matcher.matcher_cache import CachedMatcher, DjangoResultCache, LocalResultCache, \
+    get_configuration_fingerprint
+from apps.matcher.shared_hayloft import SharedColumnarHayloft
+from apps.matcher.backends import GEO_DISTANCE_IMPLEMENTORS, TEXT_ALGORITHMS, BackendRegistry
+from apps.matcher.matcher_cascade import CascadeMatcher, get_screening_matcher
+from apps.matcher.matcher_shards import GeoCellPartitioner, LocalTransport, ShardCoordinator, ShardWorker
+from apps.matcher.matcher_scheduler import MicroBatchScheduler
+from apps.matcher.matcher_async import AsyncMatcher
+from apps.matcher.columnar_hayloft import ColumnarHayloft
+from apps.matcher.configuration_loader import MatcherConfigurationLoader
+from apps.matcher import matcher_batch
+from apps.matcher.models import MatchingResult, MatchingRun
+from apps.matcher.model_matching import ModelMatcher
+from apps.matcher.queryset_iterator import QuerySetIterator
+from apps.matcher.matcher_exceptions import MatcherException
+
+
+def get_match_pairs(matches, get_element=None, ndigits=None):
+    """
+    Return the (element, total_ratio) of each Match to compare two searches: the elements as returned by get_element
+    and the ratios rounded to ndigits when given
+    """
+    return [(get_element(match.get_match_element) if get_element else match.get_match_element,
+             match.get_total_ratio if ndigits is None else round(match.get_total_ratio, ndigits))
+            for match in matches]
+
+
+class MatcherTest(unittest.TestCase):
+
+    class Venue(object):
+        geo__point = (41.380853, 2.122907)
 
     place_a = {'Place': 'Camp Nou', 'Geopoint': (41.380853, 2.122907)}
     place_b = {'Place': 'santiago_bernabeu', 'Geopoint': (40.451585, -3.690375)}
@@ -36,10 +86,541 @@ class MatcherTest(object):
         try:
             my_matcher.search_matches(self.hayloft, logging=True)
             if my_matcher.get_matches:
-                print "Needle searched is: %s\n\n" % str(my_matcher.get_needle)
+                print("Needle searched is: %s\n\n" % str(my_matcher.get_needle))
                 for match in my_matcher.get_matches:
-                    print "%s - %s - %s\n" % (match.get_match_element, str(match.get_total_ratio), match.get_match_log)
+                    print("%s - %s - %s\n" % (match.get_match_element, str(match.get_total_ratio), match.get_match_log))
         except Exception as e:
-            print "Exception: %s" % e
+            print("Exception: %s" % e)
+            pass
+
+    def test_configured_matcher_does_not_share_results(self):
+        configured_matcher = ConfiguredMatcher(self.matcher_config, threshold=0)
+
+        result_a = configured_matcher.search_matches(self.place_a, self.hayloft)
+        result_b = configured_matcher.search_matches(self.place_b, self.hayloft)
+
+        assert len(result_a.get_matches) == len(self.hayloft)
+        assert len(result_b.get_matches) == len(self.hayloft)
+        assert result_a.get_matches is not result_b.get_matches
+        assert Matcher(self.place_a, self.matcher_config, threshold=0).get_matches == []
+
+    def test_deduplicate(self):
+        hayloft = self.hayloft + [{'Place': 'Camp Nou', 'Geopoint': (41.380853, 2.122907)}]
+        deduplicator = Deduplicator(self.matcher_config, 0.9, [GeoCellBlocking('Geopoint', 10)])
+
+        result = deduplicator.deduplicate(hayloft)
+
+        assert result.get_candidate_pairs < result.get_total_pairs
+        assert result.get_cluster_positions == [[0, len(hayloft) - 1]]
+
+    def test_deduplicate_with_overlapping_blockings(self):
+        hayloft = self.hayloft + [{'Place': 'Camp Nou', 'Geopoint': (41.380853, 2.122907)}]
+        blockings = [GeoCellBlocking('Geopoint', 10), NGramBlocking('Place')]
+        deduplicator = Deduplicator(self.matcher_config, 0.9, blockings)
+        pairs = [(position, partner) for position, partners in deduplicator.iter_candidate_partners(hayloft)
+                 for partner in partners]
+        blocked_pairs = set((position, partner) for blocking in blockings
+                            for position, partners in Deduplicator(self.matcher_config, 0.9, [blocking])
+                            .get_candidate_partners(hayloft).items() for partner in partners)
+        result = deduplicator.deduplicate(hayloft)
+
+        assert len(pairs) == len(set(pairs)) and set(pairs) == blocked_pairs
+        assert result.get_candidate_pairs == len(pairs)
+        assert result.get_cluster_positions == [[0, len(hayloft) - 1]]
+
+    def test_geo_grid_index(self):
+        configured_matcher = ConfiguredMatcher(self.matcher_config, threshold=0.5)
+        index = GeoGridIndex(self.hayloft, 'Geopoint', 10)
+
+        result = configured_matcher.search_matches(self.place_a, index)
+        full_scan = configured_matcher.search_matches(self.place_a, self.hayloft)
+
+        assert index.get_statistics(self.place_a, configured_matcher).get_pruning > 0
+        assert get_match_pairs(result.get_matches) == get_match_pairs(full_scan.get_matches)
+
+    def test_related_field_paths(self):
+        venue = {'Place': 'Camp Nou', 'Geopoint': (41.380853, 2.122907), 'city__name': 'Barcelona'}
+
+        assert get_field_path('city.name') == get_field_path('city__name') == ('city', 'name')
+        assert get_field_path('__private') == ('__private',)
+        assert get_field_getter('city.name', is_dict=True)(venue) == 'Barcelona'
+        assert get_field_getter('venue.name', is_dict=True)({'venue.name': 'Camp Nou'}) == 'Camp Nou'
+        assert get_field_getter('geo__point', is_dict=False)(MatcherTest.Venue()) == (41.380853, 2.122907)
+
+    def test_bounded_edit_distances(self):
+        assert bounded_levenshtein_distance('Camp Nou', 'Camp Nou Stadium', 10) == 8
+        assert bounded_levenshtein_distance('Camp Nou', 'Camp Nou Stadium', 5) == 6
+        assert bounded_hamming_distance('Camp Nou', 'Camp Now', 0) == 1
+        assert MatchByLevenshteinDistance().compare_two_texts('a' * 200, 'b' * 200) == 0
+
+    def test_bk_tree_index(self):
+        index = BKTreeIndex(self.hayloft, 'Place')
+
+        assert index.get_values_within('Camp Nu', 1) == [('Camp Nou', 1)]
+        assert index.get_positions_within('Plaza Mayor - Madrid', 0) == [7]
+
+    def test_tfidf_cosine(self):
+        algorithm = MatchByTfidfCosine().fit([element['Place'] for element in self.hayloft])
+
+        assert algorithm.compare_two_texts('Camp Nou', 'camp nou') == 1
+        assert algorithm.get_top_matches(['Santiago Bernabeu'], 2)[0][0] == (1, 1)
+        assert algorithm.get_ratios(['Hotel NH']).shape == (1, len(self.hayloft))
+
+    def test_minhash_index(self):
+        index = MinHashIndex(self.hayloft, 'Place', threshold=0.3)
+        reused = MinHashIndex(self.hayloft, 'Place', threshold=0.3, signatures=index.get_signatures)
+
+        assert 1 in index.get_candidate_positions({'Place': 'Bernabeu Santiago'})
+        assert index.get_candidate_positions(self.place_b) == reused.get_candidate_positions(self.place_b)
+
+    def test_minhash_index_rejects_other_signatures(self):
+        signatures = MinHashIndex(self.hayloft, 'Place', threshold=0.3).get_signatures
+
+        for other_signatures, options in ((signatures[:-1], {}), (signatures + [None], {}),
+                                          (signatures, {'num_perm': 32}), (signatures, {'seed': 2})):
+            try:
+                MinHashIndex(self.hayloft, 'Place', threshold=0.3, signatures=other_signatures, **options)
+                assert False
+            except MatcherException as e:
+                assert e.code == 1003
+
+    def test_cached_matcher(self):
+        configured_matcher = ConfiguredMatcher(self.matcher_config, threshold=0.1)
+        cached_matcher = CachedMatcher(configured_matcher, 'v1', LocalResultCache(max_size=10))
+        result = cached_matcher.search_matches(self.place_a, self.hayloft)
+        cached = cached_matcher.search_matches(dict(self.place_a), self.hayloft)
+
+        assert cached_matcher.get_hits == 1 and cached_matcher.get_misses == 1
+        assert get_match_pairs(cached.get_matches) == get_match_pairs(result.get_matches)
+
+    def test_cached_matcher_key_of_tfidf(self):
+        places = [element['Place'] for element in self.hayloft]
+        fingerprints = [get_configuration_fingerprint(ConfiguredMatcher(
+            [MatcherFieldConfiguration(MatcherByText(algorithms=[algorithm]), 'Place', weight=1.0)], threshold=0.5))
+            for algorithm in (MatchByTfidfCosine(), MatchByTfidfCosine().fit(places),
+                              MatchByTfidfCosine(n=2).fit(places), MatchByTfidfCosine().fit(places[:4]))]
+
+        assert len(set(fingerprints)) == 4
+        assert MatchByTfidfCosine().get_fitting_fingerprint is None
+        assert MatchByTfidfCosine().fit(places).get_fitting_fingerprint == \
+            MatchByTfidfCosine().fit(list(places)).get_fitting_fingerprint
+
+    def test_shared_columnar_hayloft(self):
+        configured_matcher = ConfiguredMatcher(self.matcher_config, threshold=0.5)
+        full_scan = configured_matcher.search_matches(self.place_a, self.hayloft)
+
+        with SharedColumnarHayloft.create(self.hayloft, configured_matcher) as shared_hayloft:
+            attached = SharedColumnarHayloft.attach(shared_hayloft.get_name)
+            result = configured_matcher.search_matches(self.place_a, attached)
+
+            assert attached.get_row(1) == self.hayloft[1]
+            assert get_match_pairs(result.get_matches) == get_match_pairs(full_scan.get_matches, self.hayloft.index)
+            attached.close()
+
+    def test_shared_columnar_hayloft_missing_values(self):
+        configured_matcher = ConfiguredMatcher(self.matcher_config, threshold=0)
+        hayloft = self.hayloft + [{'Place': 'Camp Nou', 'Geopoint': None}]
+
+        with SharedColumnarHayloft.create(hayloft, configured_matcher) as shared_hayloft:
+            result = configured_matcher.search_matches(self.place_a, shared_hayloft)
+
+            assert get_match_pairs(result.get_matches, ndigits=9) == \
+                get_match_pairs(configured_matcher.search_matches(self.place_a, hayloft).get_matches, hayloft.index, 9)
+        try:
+            SharedColumnarHayloft.create(hayloft + [{'Place': None, 'Geopoint': None}], configured_matcher)
+            assert False
+        except MatcherException as e:
+            assert e.code == 1002
+
+    def test_backend_registry(self):
+        registry = BackendRegistry()
+        registry.register('levenshtein', MatchByLevenshteinDistance, backends=('jellyfish',))
+
+        assert registry['levenshtein'] is MatchByLevenshteinDistance
+        assert registry.get_instance('levenshtein') is registry.get_instance('levenshtein')
+        assert TEXT_ALGORITHMS['levenshtein_distance'] is MatchByLevenshteinDistance
+        assert MatcherByText().get_algorithms[0] is MatcherByText().get_algorithms[0]
+
+    def test_search_within_budget(self):
+        configured_matcher = ConfiguredMatcher(self.matcher_config, threshold=0.5)
+        index = PrescoreIndex(self.hayloft, 'Place', 'Geopoint')
+        complete = configured_matcher.search_matches(self.place_a, index, budget=10)
+        exhausted = configured_matcher.search_matches(self.place_a, index, budget=0)
+
+        assert index.get_order(self.place_a, configured_matcher)[0] == 0
+        assert not complete.is_partial and complete.get_coverage == 1
+        assert exhausted.is_partial and exhausted.get_scored_count == 0
+
+    def test_search_within_budget_of_generator(self):
+        configured_matcher = ConfiguredMatcher(self.matcher_config, threshold=0.5)
+        result = configured_matcher.search_matches(self.place_a, (element for element in self.hayloft), budget=10)
+        exhausted = configured_matcher.search_matches(self.place_a, (element for element in self.hayloft), budget=0)
+
+        assert get_match_pairs(result.get_matches) == \
+            get_match_pairs(configured_matcher.search_matches(self.place_a, self.hayloft).get_matches)
+        assert not result.is_partial and result.get_hayloft_size == len(self.hayloft) and result.get_coverage == 1
+        assert exhausted.is_partial and exhausted.get_hayloft_size is None and exhausted.get_coverage is None
+
+    def test_cascade_matcher(self):
+        configured_matcher = ConfiguredMatcher(self.matcher_config, threshold=0.5)
+        cascade_matcher = CascadeMatcher(get_screening_matcher(configured_matcher, 0.3), configured_matcher, top_n=3)
+        full_search = configured_matcher.search_matches(self.place_a, self.hayloft)
+        result = cascade_matcher.search_matches(self.place_a, self.hayloft)
+
+        assert len(cascade_matcher.get_survivors(self.place_a, self.hayloft)) == 3
+        assert set(match.get_total_ratio for match in result.get_matches) <= \
+            set(match.get_total_ratio for match in full_search.get_matches)
+        assert cascade_matcher.measure_recall([self.place_a], self.hayloft).get_recall == 1
+
+    def test_sharded_matching(self):
+        configured_matcher = ConfiguredMatcher(self.matcher_config, threshold=0.3)
+        partitioner = GeoCellPartitioner('Geopoint', 300, 2)
+        workers = [ShardWorker(configured_matcher, elements, positions, top_k=2)
+                   for elements, positions in partitioner.partition(self.hayloft)]
+        coordinator = ShardCoordinator(LocalTransport(workers), configured_matcher, partitioner, top_k=2)
+        full_search = configured_matcher.search_matches(self.place_a, self.hayloft)
+        full_search.order_matches()
+        result = coordinator.search_matches(self.place_a)
+
+        assert [match.get_match_element for match in result.get_matches] == \
+            [match.get_match_element for match in full_search.get_matches[:2]]
+        assert not result.is_partial
+
+    def test_shard_worker_positions_of_repeated_elements(self):
+        configured_matcher = ConfiguredMatcher(self.matcher_config, threshold=0.9)
+        worker = ShardWorker(configured_matcher, [self.hayloft[0], self.hayloft[1], self.hayloft[0]], [10, 11, 12])
+
+        assert [position for ratio, position, element, match_log in worker.search([self.place_a])[0]] == [10, 12]
+        try:
+            ShardCoordinator(LocalTransport([worker]), retries=-1)
+            assert False
+        except MatcherException as e:
+            assert e.code == 1003
+
+    def test_micro_batch_scheduler(self):
+        configured_matcher = ConfiguredMatcher(self.matcher_config, threshold=0.5)
+        full_search = configured_matcher.search_matches(self.place_a, self.hayloft)
+
+        with MicroBatchScheduler(configured_matcher, self.hayloft, max_batch_size=4, max_delay=0.05) as scheduler:
+            futures = [scheduler.submit(needle) for needle in (self.place_a, self.place_b, self.place_a)]
+            results = [future.result() for future in futures]
+
+        assert [match.get_total_ratio for match in results[0].get_matches] == \
+            [match.get_total_ratio for match in full_search.get_matches]
+        assert scheduler.get_searched == 3 and scheduler.get_batches <= 3
+
+    def test_micro_batch_scheduler_close_with_full_queue(self):
+        configured_matcher = ConfiguredMatcher(self.matcher_config, threshold=0.5)
+        started, release = threading.Event(), threading.Event()
+
+        class BlockingHayloft(list):
+            def __iter__(self):
+                started.set()
+                release.wait(10)
+                return list.__iter__(self)
+
+        scheduler = MicroBatchScheduler(configured_matcher, BlockingHayloft(self.hayloft), max_batch_size=1,
+                                        max_delay=0, max_queue_size=1)
+        searching = scheduler.submit(self.place_a)
+        started.wait(10)
+        queued = scheduler.submit(self.place_b)
+        try:
+            scheduler.submit(self.place_a, block=False)
+            assert False
+        except queue.Full:
             pass
 
+        closing = threading.Thread(target=scheduler.close, kwargs={'wait': False})
+        closing.start()
+        closing.join(5)
+        assert not closing.is_alive()
+        try:
+            scheduler.submit(self.place_a)
+            assert False
+        except RuntimeError:
+            pass
+
+        release.set()
+        scheduler.close()
+        assert get_match_pairs(searching.result().get_matches) == \
+            get_match_pairs(configured_matcher.search_matches(self.place_a, self.hayloft).get_matches)
+        assert get_match_pairs(queued.result().get_matches) == \
+            get_match_pairs(configured_matcher.search_matches(self.place_b, self.hayloft).get_matches)
+
+    def test_prepared_geo_ratio_match(self):
+        radiuses = [Radius(0, 0.2, 1, 0.8, balanced_by_distance=True), Radius(0.2, 1, 0.8, 0.5)]
+        matcher_type = MatcherByGeoDistance(radiuses, GeoDistanceByHaversine(), ratio_farther=0.1)
+        ratio_match = matcher_type.prepare_ratio_match(self.place_a['Geopoint'])
+
+        for element in self.hayloft:
+            assert ratio_match(element['Geopoint']) == \
+                matcher_type.get_ratio_match(self.place_a['Geopoint'], element['Geopoint'])
+        assert ratio_match(None) == 0.1
+
+    def test_haversine_points_terms_between_threads(self):
+        implementor = GEO_DISTANCE_IMPLEMENTORS['haversine']()
+        points = [element['Geopoint'] for element in self.hayloft]
+        expected = [round(implementor.calculate_distance_between_points(self.place_a['Geopoint'], point), 9)
+                    for point in points]
+
+        def get_distances(copy):
+            #a new array per call: the cached terms are added, reused and removed from every thread
+            columnar = ColumnarHayloft({'lat': [point[0] for point in points], 'lng': [point[1] for point in points]},
+                                       geo_fields={'Geopoint': ('lat', 'lng')})
+            column = columnar.get_column('Geopoint')
+            distances = [implementor.calculate_distances_from_point(self.place_a['Geopoint'], column)
+                         for _ in range(copy % 3 + 1)]
+            return [[round(distance, 9) for distance in row.tolist()] for row in distances]
+
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(get_distances, range(200)))
+
+        assert all(row == expected for result in results for row in result)
+
+    def __run_async_search(self, async_matcher, hayloft):
+        loop = asyncio.new_event_loop()
+        matches = []
+        search = async_matcher.search_matches(hayloft)
+        try:
+            while True:
+                try:
+                    matches.append(loop.run_until_complete(search.__anext__()))
+                except StopAsyncIteration:
+                    return matches
+        finally:
+            loop.run_until_complete(search.aclose())
+            loop.close()
+
+    def test_async_matcher(self):
+        matcher = Matcher(self.place_a, self.matcher_config, threshold=0.5)
+        full_search = matcher.get_configured_matcher.search_matches(self.place_a, self.hayloft)
+        matches = self.__run_async_search(AsyncMatcher(matcher, chunksize=3), self.hayloft)
+
+        assert get_match_pairs(matches) == get_match_pairs(full_search.get_matches)
+
+        try:
+            self.__run_async_search(AsyncMatcher(matcher, chunksize=1, timeout=0), self.hayloft * 100)
+            assert False
+        except asyncio.TimeoutError:
+            pass
+
+    def test_matching_plan(self):
+        configured_matcher = ConfiguredMatcher(self.matcher_config, threshold=0.3)
+        plan = configured_matcher.compile_plan(self.place_a)
+        full_search = configured_matcher.search_matches(self.place_a, self.hayloft)
+        matches = [plan.match_element(element) for element in self.hayloft]
+
+        assert get_match_pairs(match for match in matches if match is not None) == \
+            get_match_pairs(full_search.get_matches)
+        assert plan.score(self.hayloft[1]) == plan.score_with_log(self.hayloft[1])[0]
+
+    def test_columnar_hayloft(self):
+        configured_matcher = ConfiguredMatcher(self.matcher_config, threshold=0.3)
+        hayloft = ColumnarHayloft({'Place': [element['Place'] for element in self.hayloft],
+                                   'lat': [element['Geopoint'][0] for element in self.hayloft],
+                                   'lng': [element['Geopoint'][1] for element in self.hayloft]},
+                                  geo_fields={'Geopoint': ('lat', 'lng')})
+        full_search = configured_matcher.search_matches(self.place_a, self.hayloft)
+        result = configured_matcher.search_matches(self.place_a, hayloft)
+
+        assert get_match_pairs(result.get_matches, ndigits=9) == \
+            get_match_pairs(full_search.get_matches, self.hayloft.index, 9)
+        assert hayloft.get_row(2)['Geopoint'] == self.hayloft[2]['Geopoint']
+
+    def test_length_bucketed_index(self):
+        matcher_config = [MatcherFieldConfiguration(MatcherByText(algorithms=[MatchByLevenshteinDistance()]), 'Place',
+                                                    weight=1.0)]
+        configured_matcher = ConfiguredMatcher(matcher_config, threshold=0.8)
+        index = LengthBucketedIndex(self.hayloft, 'Place')
+        full_search = configured_matcher.search_matches(self.place_a, self.hayloft)
+        result = configured_matcher.search_matches(self.place_a, index)
+
+        assert get_match_pairs(result.get_matches) == get_match_pairs(full_search.get_matches)
+        assert len(index.get_candidates(self.place_a, configured_matcher)) < len(self.hayloft)
+
+    def test_phonetic_index(self):
+        configured_matcher = ConfiguredMatcher(self.matcher_config, threshold=0.5)
+        needle = {'Place': 'Santiago Bernabeo', 'Geopoint': (40.451585, -3.690375)}
+        index = PhoneticIndex(self.hayloft, 'Place')
+        full_search = configured_matcher.search_matches(needle, self.hayloft)
+        result = configured_matcher.search_matches(needle, index)
+
+        assert index.get_candidate_positions(needle) == [1, 5]
+        assert get_match_pairs(result.get_matches) == \
+            get_match_pairs(match for match in full_search.get_matches
+                            if match.get_match_element in index.get_candidates(needle))
+        assert index.measure_recall([needle], configured_matcher).get_recall <= 1
+
+    def __write_csv(self, path, elements):
+        with open(path, 'w') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(['id', 'Place', 'lat', 'lng'])
+            for position, element in enumerate(elements):
+                writer.writerow([position, element['Place'], element['Geopoint'][0], element['Geopoint'][1]])
+
+    def test_batch_matching(self):
+        loader = MatcherConfigurationLoader({'threshold': 0.3, 'fields': [
+            {'field': 'Place', 'type': 'text', 'weight': 0.3},
+            {'field': 'Geopoint', 'type': 'geo', 'weight': 0.7, 'implementor': 'haversine', 'columns': ['lat', 'lng'],
+             'radiuses': [{'from': 0, 'to': 0.2, 'max_ratio': 1, 'min_ratio': 0.8, 'balanced_by_distance': True},
+                          {'from': 0.2, 'to': 5, 'max_ratio': 0.8, 'min_ratio': 0}]}]})
+        directory = tempfile.mkdtemp()
+        try:
+            needles_path = os.path.join(directory, 'needles.csv')
+            hayloft_path = os.path.join(directory, 'hayloft.csv')
+            self.__write_csv(needles_path, [self.place_a, self.place_b, self.hayloft[6]])
+            self.__write_csv(hayloft_path, self.hayloft)
+
+            outputs = []
+            for processes in (1, 2):
+                output_path = os.path.join(directory, 'matches_%i.jsonl' % processes)
+                assert matcher_batch.run(loader, needles_path, hayloft_path, output_path, needle_id_field='id',
+                                         hayloft_id_field='id', top_k=3, needle_chunksize=1, processes=processes,
+                                         progress=None) == 3
+                with open(output_path) as output_file:
+                    outputs.append([json.loads(line) for line in output_file])
+
+            hayloft = [loader.get_record(row) for row in matcher_batch.read_rows(hayloft_path)]
+            full_search = loader.get_configured_matcher().search_matches(hayloft[0], hayloft)
+            full_search.order_matches()
+
+            assert outputs[0] == outputs[1]
+            assert [(match['id'], match['ratio']) for match in outputs[0][0]['matches']] == \
+                [(match.get_match_element['id'], match.get_total_ratio) for match in full_search.get_matches[:3]]
+        finally:
+            shutil.rmtree(directory)
+
+
+class MatcherDatabaseTest(TestCase):
+    """
+    Tests over SQLite: the names of MatchingRun rows are the needles and the hayloft
+    """
+
+    matcher_config = [MatcherFieldConfiguration(MatcherByText(), 'name', weight=1.0)]
+
+    def setUp(self):
+        self.hayloft_pks = [MatchingRun.objects.create(name=element['Place']).pk for element in MatcherTest.hayloft]
+        self.needle_pks = [MatchingRun.objects.create(name=name).pk for name in ('camp nou', 'santiago_bernabeu')]
+        self.hayloft = MatchingRun.objects.filter(pk__in=self.hayloft_pks)
+        self.needles = MatchingRun.objects.filter(pk__in=self.needle_pks)
+
+    def test_deduplicate_empty_queryset(self):
+        deduplicator = Deduplicator(self.matcher_config, 0.9, [NGramBlocking('name')])
+        result = deduplicator.deduplicate(MatchingRun.objects.none())
+
+        clusters = deduplicator.deduplicate(MatchingRun.objects.filter(pk__in=self.hayloft_pks + self.needle_pks[:1]))
+
+        assert result.get_clusters == [] and result.get_candidate_pairs == 0
+        assert [self.hayloft_pks[0], self.needle_pks[0]] in \
+            [[run.pk for run in cluster] for cluster in clusters.get_clusters]
+
+    def test_queryset_chunks(self):
+        iterator = QuerySetIterator(self.hayloft)
+
+        assert [[run.pk for run in chunk] for chunk in iterator.queryset_chunks(3, from_pk=self.hayloft_pks[1])] == \
+            [self.hayloft_pks[2:5], self.hayloft_pks[5:8]]
+        assert [len(chunk) for chunk in iterator.queryset_chunks(4)] == [4, 4]
+        assert list(iterator.queryset_chunks(3, from_pk=self.hayloft_pks[-1])) == []
+
+    def test_search_does_not_cache_the_queryset(self):
+        configured_matcher = ConfiguredMatcher(self.matcher_config, threshold=0.5)
+        needles = list(self.needles)
+        results = configured_matcher.search_matches_batch(needles, self.hayloft)
+
+        assert self.hayloft._result_cache is None
+        assert [get_match_pairs(result.get_matches) for result in results] == \
+            [get_match_pairs(configured_matcher.search_matches(needle, self.hayloft).get_matches) for needle in needles]
+        assert self.hayloft._result_cache is None
+        assert configured_matcher.search_matches_batch(needles, self.hayloft.none())[0].get_matches == []
+
+    def test_search_empty_queryset_within_budget(self):
+        configured_matcher = ConfiguredMatcher(self.matcher_config, threshold=0.5)
+        needle = MatchingRun(name='Camp Nou')
+        result = configured_matcher.search_matches(needle, self.hayloft.none(), budget=1)
+
+        assert result.get_matches == [] and not result.is_partial and result.get_coverage == 1
+        assert configured_matcher.search_matches(needle, self.hayloft, budget=10).get_coverage == 1
+
+    def test_model_matcher(self):
+        configured_matcher = ConfiguredMatcher(self.matcher_config, threshold=0.5)
+        run = ModelMatcher(configured_matcher, top_k=2, needle_chunksize=1, batch_size=1).run('test', self.needles,
+                                                                                                self.hayloft)
+        full_search = configured_matcher.search_matches(self.needles[0], self.hayloft)
+        full_search.order_matches()
+
+        assert run.finished and run.last_needle_pk == self.needle_pks[-1]
+        assert [(result.element_pk, result.total_ratio, result.rank)
+                for result in run.results.filter(needle_pk=self.needle_pks[0])] == \
+            [(match.get_match_element.pk, match.get_total_ratio, rank + 1)
+             for rank, match in enumerate(full_search.get_matches[:2])]
+
+    def test_model_matcher_resumes_after_last_needle(self):
+        configured_matcher = ConfiguredMatcher(self.matcher_config, threshold=0.5)
+        model_matcher = ModelMatcher(configured_matcher, needle_chunksize=1)
+
+        def crash(run, needles_matched):
+            raise KeyboardInterrupt
+
+        try:
+            model_matcher.run('resumed', self.needles, self.hayloft, progress=crash)
+            assert False
+        except KeyboardInterrupt:
+            pass
+        interrupted = MatchingRun.objects.get(name='resumed')
+        saved = interrupted.results.count()
+        needles_matched = []
+        run = model_matcher.run('resumed', self.needles, self.hayloft,
+                                progress=lambda run, needles: needles_matched.append(needles))
+
+        assert interrupted.last_needle_pk == self.needle_pks[0] and not interrupted.finished
+        assert needles_matched == [1] and run.finished
+        assert run.results.count() == saved + run.results.filter(needle_pk=self.needle_pks[1]).count()
+        assert not run.results.exclude(needle_pk__in=self.needle_pks).exists()
+
+    def test_match_models_command(self):
+        directory = tempfile.mkdtemp()
+        output = StringIO()
+        try:
+            configuration_path = os.path.join(directory, 'configuration.json')
+            with open(configuration_path, 'w') as configuration_file:
+                json.dump({'threshold': 0.9, 'fields': [{'field': 'name', 'type': 'text', 'weight': 1,
+                                                          'algorithms': ['simple_ratio']}]},
+                          configuration_file)
+
+            call_command('match_models', 'matcher.MatchingRun', 'matcher.MatchingRun',
+                         configuration=configuration_path, run='command', top_k=1, stdout=output)
+        finally:
+            shutil.rmtree(directory)
+
+        run = MatchingRun.objects.get(name='command')
+        assert run.finished and 'Run command finished' in output.getvalue()
+        results = run.results.filter(needle_pk__in=self.hayloft_pks)
+        assert [(result.needle_pk, result.element_pk) for result in results] == [(pk, pk) for pk in self.hayloft_pks]
+
+    def test_related_fields_queryset(self):
+        for pk in self.hayloft_pks:
+            MatchingResult.objects.create(run_id=pk, needle_pk=0, element_pk=pk, total_ratio=1, rank=1)
+        configured_matcher = ConfiguredMatcher([MatcherFieldConfiguration(MatcherByText(), 'run.name', weight=1.0)],
+                                               threshold=0.5)
+        needle = MatchingResult(run=MatchingRun(name='Camp Nou'))
+        results = MatchingResult.objects.all()
+
+        assert configured_matcher.prepare_queryset(results).query.select_related == {'run': {}}
+        assert prepare_queryset(MatchingRun.objects.all(), ['results.rank'])._prefetch_related_lookups == ('results',)
+        assert configured_matcher.search_matches(needle, results.filter(pk__lte=2), logging=True).get_query_count == \
+            configured_matcher.search_matches(needle, results, logging=True).get_query_count
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                           'LOCATION': 'matcher-tests'}})
+    def test_django_result_cache(self):
+        configured_matcher = ConfiguredMatcher(self.matcher_config, threshold=0.1)
+        backend = DjangoResultCache(ttl=60)
+        cached_matcher = CachedMatcher(configured_matcher, 'v1', backend)
+        needle = MatchingRun(name='Camp Nou')
+        result = cached_matcher.search_matches(needle, self.hayloft)
+        cached = CachedMatcher(configured_matcher, 'v1', DjangoResultCache()).search_matches(needle, self.hayloft)
+
+        assert backend.get(cached_matcher.get_key(needle, self.hayloft)) is not None
+        assert get_match_pairs(cached.get_matches, attrgetter('pk')) == \
+            get_match_pairs(result.get_matches, attrgetter('pk'))
+        assert cached_matcher.search_matches(needle, self.hayloft) and cached_matcher.get_hits == 1